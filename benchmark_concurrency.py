@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark de concurrencia: subidas, descargas y borrados simultáneos
+
+Levanta un coordinador y varios nodos como procesos separados sobre un
+directorio temporal y lanza clientes concurrentes contra el coordinador.
+Cada cliente repite subir -> descargar y verificar -> eliminar. Reporta
+operaciones por segundo para cada nivel de concurrencia y los errores o
+descargas con datos distintos a los subidos (asignaciones solapadas).
+
+Uso: python benchmark_concurrency.py [--nodes 4] [--clients 1 4 16] [--seconds 10]
+"""
+import argparse
+import base64
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Añadir directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import COORDINATOR_PORT
+from common.protocol import MessageType, send_message, receive_message
+
+def call(msg_type: MessageType, data: dict = None):
+    """Envía una petición al coordinador y retorna la respuesta"""
+    sock = socket.create_connection(("127.0.0.1", COORDINATOR_PORT), timeout=60)
+    try:
+        send_message(sock, msg_type, data)
+        return receive_message(sock)
+    finally:
+        sock.close()
+
+def client_loop(client_id: int, file_size: int, deadline: float, stats: dict, lock: threading.Lock):
+    """Ciclo subir -> descargar -> eliminar hasta el plazo indicado"""
+    n = 0
+    while time.time() < deadline:
+        payload = os.urandom(file_size)
+        n += 1
+        response = call(MessageType.UPLOAD_FILE, {
+            "filename": f"c{client_id}_{n}.bin",
+            "size": len(payload),
+            "file_data": base64.b64encode(payload).decode("utf-8")
+        })
+        if not response or response.get("type") != MessageType.UPLOAD_RESPONSE.value:
+            with lock:
+                stats["errors"] += 1
+            continue
+        file_id = response["data"]["file_id"]
+        
+        response = call(MessageType.DOWNLOAD_FILE, {"file_id": file_id})
+        blocks = (response or {}).get("data", {}).get("blocks", {})
+        data = b"".join(base64.b64decode(blocks[k]) for k in sorted(blocks, key=int))
+        
+        call(MessageType.DELETE_FILE, {"file_id": file_id})
+        with lock:
+            stats["ops"] += 1
+            if data != payload:
+                stats["mismatches"] += 1
+
+def run_level(clients: int, seconds: float, file_size: int) -> dict:
+    """Ejecuta un nivel de concurrencia y retorna sus estadísticas"""
+    stats = {"ops": 0, "errors": 0, "mismatches": 0}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+    threads = [threading.Thread(target=client_loop, args=(i, file_size, deadline, stats, lock))
+               for i in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats["elapsed"] = time.time() - start
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de concurrencia del coordinador")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--file-kb", type=int, default=1536, help="tamaño de cada archivo en KB")
+    args = parser.parse_args()
+    
+    root = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix="sadtf_bench_")
+    processes = []
+    
+    def spawn(script, *script_args):
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(root, script), *script_args], cwd=workdir,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    
+    try:
+        spawn("start_coordinator.py")
+        time.sleep(1)
+        for _ in range(args.nodes):
+            spawn("start_node.py", "--space", "100MB", "--coordinator-host", "127.0.0.1")
+        
+        # Esperar a que todos los nodos estén registrados
+        for _ in range(60):
+            time.sleep(0.5)
+            try:
+                response = call(MessageType.GET_ACTIVE_NODES)
+            except OSError:
+                continue
+            if len(response.get("data", {}).get("nodes", [])) >= args.nodes:
+                break
+        
+        print(f"{'clientes':>8}{'ops':>8}{'ops/s':>10}{'errores':>10}{'corruptos':>11}")
+        for clients in args.clients:
+            stats = run_level(clients, args.seconds, args.file_kb * 1024)
+            print(f"{clients:>8}{stats['ops']:>8}{stats['ops'] / stats['elapsed']:>10.1f}"
+                  f"{stats['errors']:>10}{stats['mismatches']:>11}")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
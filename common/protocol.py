@@ -3,6 +3,8 @@ Protocolo de comunicación entre coordinador, nodos y clientes
 """
 import json
 import struct
+import zlib
+import base64
 from enum import Enum
 
 class MessageType(Enum):
@@ -14,6 +16,8 @@ class MessageType(Enum):
     BLOCK_STORED = "BLOCK_STORED"
     BLOCK_RETRIEVED = "BLOCK_RETRIEVED"
     BLOCK_DELETED = "BLOCK_DELETED"
+    BLOCK_CORRUPTED = "BLOCK_CORRUPTED"
+    INVENTORY_DIGEST = "INVENTORY_DIGEST"
     
     # Mensajes del coordinador al nodo
     REGISTER_RESPONSE = "REGISTER_RESPONSE"
@@ -21,15 +25,26 @@ class MessageType(Enum):
     RETRIEVE_BLOCK = "RETRIEVE_BLOCK"
     DELETE_BLOCK = "DELETE_BLOCK"
     UPDATE_BLOCK_TABLE = "UPDATE_BLOCK_TABLE"
+    CLUSTER_EVENTS = "CLUSTER_EVENTS"
+    REPLICATE_BLOCK = "REPLICATE_BLOCK"
+    ORPHAN_BLOCKS = "ORPHAN_BLOCKS"
     
     # Mensajes del cliente al coordinador
     UPLOAD_FILE = "UPLOAD_FILE"
+    UPLOAD_BEGIN = "UPLOAD_BEGIN"
+    UPLOAD_BLOCK = "UPLOAD_BLOCK"
+    UPLOAD_COMMIT = "UPLOAD_COMMIT"
+    UPLOAD_ABORT = "UPLOAD_ABORT"
+    UPLOAD_RESUME = "UPLOAD_RESUME"
     DOWNLOAD_FILE = "DOWNLOAD_FILE"
+    DOWNLOAD_BLOCK = "DOWNLOAD_BLOCK"
     DELETE_FILE = "DELETE_FILE"
     LIST_FILES = "LIST_FILES"
     GET_FILE_INFO = "GET_FILE_INFO"
     GET_BLOCK_TABLE = "GET_BLOCK_TABLE"
     GET_ACTIVE_NODES = "GET_ACTIVE_NODES"
+    GET_METRICS = "GET_METRICS"
+    SUBSCRIBE_EVENTS = "SUBSCRIBE_EVENTS"
     
     # Mensajes del coordinador al cliente
     UPLOAD_RESPONSE = "UPLOAD_RESPONSE"
@@ -39,6 +54,7 @@ class MessageType(Enum):
     FILE_INFO = "FILE_INFO"
     BLOCK_TABLE_DATA = "BLOCK_TABLE_DATA"
     ACTIVE_NODES_DATA = "ACTIVE_NODES_DATA"
+    METRICS_DATA = "METRICS_DATA"
     ERROR = "ERROR"
     SUCCESS = "SUCCESS"
 
@@ -55,7 +71,13 @@ def create_message(msg_type: MessageType, data: dict = None):
 
 def receive_message(socket):
     """Recibe un mensaje completo del socket"""
-    # Leer longitud del mensaje (4 bytes)
+    length = receive_message_length(socket)
+    if length is None:
+        return None
+    return receive_message_body(socket, length)
+
+def receive_message_length(socket):
+    """Lee el prefijo de longitud (4 bytes) de un mensaje. Retorna None si se cerró la conexión"""
     length_data = b''
     while len(length_data) < 4:
         chunk = socket.recv(4 - len(length_data))
@@ -63,9 +85,10 @@ def receive_message(socket):
             return None
         length_data += chunk
     
-    length = struct.unpack('!I', length_data)[0]
-    
-    # Leer el mensaje completo
+    return struct.unpack('!I', length_data)[0]
+
+def receive_message_body(socket, length: int):
+    """Lee y decodifica el cuerpo de un mensaje de length bytes"""
     message_data = b''
     while len(message_data) < length:
         chunk = socket.recv(length - len(message_data))
@@ -75,8 +98,91 @@ def receive_message(socket):
     
     return json.loads(message_data.decode('utf-8'))
 
+def discard_message_body(socket, length: int, chunk_size: int = 64 * 1024) -> bool:
+    """Consume el cuerpo de un mensaje sin guardarlo en memoria"""
+    remaining = length
+    while remaining > 0:
+        chunk = socket.recv(min(chunk_size, remaining))
+        if not chunk:
+            return False
+        remaining -= len(chunk)
+    return True
+
 def send_message(socket, msg_type: MessageType, data: dict = None):
     """Envía un mensaje a través del socket"""
     message = create_message(msg_type, data)
     socket.sendall(message)
 
+
+# Registro de un bloque en el reporte de inventario: block_id, block_number, flags, checksum
+REPORT_RECORD = struct.Struct('!IIBI')
+REPORT_FILE_HEADER = struct.Struct('!HI')
+REPORT_FLAG_REPLICA = 0x01
+REPORT_FLAG_CHECKSUM = 0x02
+
+def pack_block_report(blocks: dict) -> str:
+    """
+    Empaqueta el inventario de bloques de un nodo en formato binario compacto
+    Agrupa los registros por archivo, comprime con zlib y retorna texto base64
+    """
+    by_file = {}
+    for info in blocks.values():
+        flags = REPORT_FLAG_REPLICA if info.get("is_replica") else 0
+        if info.get("checksum") is not None:
+            flags |= REPORT_FLAG_CHECKSUM
+        by_file.setdefault(info["file_id"], []).append(
+            (int(info["block_id"]), int(info["block_number"]), flags, info.get("checksum") or 0))
+    
+    parts = []
+    for file_id, records in by_file.items():
+        fid = file_id.encode('utf-8')
+        parts.append(REPORT_FILE_HEADER.pack(len(fid), len(records)))
+        parts.append(fid)
+        parts.extend(REPORT_RECORD.pack(*record) for record in records)
+    
+    return base64.b64encode(zlib.compress(b''.join(parts))).decode('utf-8')
+
+def unpack_block_report(report: str):
+    """
+    Desempaqueta un reporte de inventario
+    Retorna dict file_id -> lista de (block_id, block_number, is_replica, checksum o None)
+    """
+    raw = zlib.decompress(base64.b64decode(report))
+    by_file = {}
+    offset = 0
+    while offset < len(raw):
+        fid_len, count = REPORT_FILE_HEADER.unpack_from(raw, offset)
+        offset += REPORT_FILE_HEADER.size
+        file_id = raw[offset:offset + fid_len].decode('utf-8')
+        offset += fid_len
+        end = offset + count * REPORT_RECORD.size
+        by_file[file_id] = [(block_id, block_number, bool(flags & REPORT_FLAG_REPLICA),
+                             checksum if flags & REPORT_FLAG_CHECKSUM else None)
+                            for block_id, block_number, flags, checksum
+                            in REPORT_RECORD.iter_unpack(raw[offset:end])]
+        offset = end
+    return by_file
+
+ID_RANGE = struct.Struct('!II')
+
+def pack_id_ranges(block_ids) -> str:
+    """
+    Resume un conjunto de IDs de bloque como rangos ordenados [inicio, fin]
+    comprimidos (zlib + base64). Los IDs contiguos ocupan un solo rango
+    """
+    ranges = []
+    for block_id in sorted(set(int(bid) for bid in block_ids)):
+        if ranges and ranges[-1][1] + 1 == block_id:
+            ranges[-1][1] = block_id
+        else:
+            ranges.append([block_id, block_id])
+    raw = b''.join(ID_RANGE.pack(start, end) for start, end in ranges)
+    return base64.b64encode(zlib.compress(raw)).decode('utf-8')
+
+def unpack_id_ranges(digest: str):
+    """Expande un resumen de rangos a un conjunto de IDs de bloque"""
+    raw = zlib.decompress(base64.b64decode(digest))
+    block_ids = set()
+    for start, end in ID_RANGE.iter_unpack(raw):
+        block_ids.update(range(start, end + 1))
+    return block_ids
@@ -4,6 +4,9 @@ Utilidades comunes
 import os
 import hashlib
 import shutil
+import threading
+import zlib
+from contextlib import contextmanager
 from pathlib import Path
 
 def ensure_directory(path):
@@ -35,6 +38,20 @@ def split_file_into_blocks(file_path, block_size):
             block_num += 1
     return blocks
 
+def iter_blocks(chunks, block_size):
+    """
+    Reagrupa fragmentos de cualquier tamaño en bloques de block_size
+    (el último puede ser menor); sólo un bloque se mantiene en memoria
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= block_size:
+            yield bytes(buffer[:block_size])
+            del buffer[:block_size]
+    if buffer:
+        yield bytes(buffer)
+
 def combine_blocks_into_file(blocks, output_path):
     """Combina bloques en un archivo"""
     # Ordenar bloques por número
@@ -57,6 +74,62 @@ def get_directory_size(directory):
         pass
     return total
 
+def calculate_checksum(data, crc: int = 0) -> int:
+    """
+    Calcula el CRC32 de un bloque
+    Acepta bytes o un iterable de fragmentos para calcularlo de forma incremental
+    Con crc continúa el de los datos anteriores (p. ej. al añadir a un bloque)
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return zlib.crc32(data, crc)
+    for chunk in data:
+        crc = zlib.crc32(chunk, crc)
+    return crc
+
+class ReadWriteLock:
+    """
+    Lock de lectores y escritores con preferencia de escritura
+    Varios lectores pueden tenerlo a la vez; un escritor en espera bloquea
+    a los lectores nuevos para no quedar postergado indefinidamente
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+    
+    @contextmanager
+    def read(self):
+        """Acceso compartido"""
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        """Acceso exclusivo"""
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
 def format_size(size_bytes):
     """Formatea el tamaño en bytes a formato legible"""
     for unit in ['B', 'KB', 'MB', 'GB']:
@@ -15,15 +15,106 @@ MAX_SHARED_SPACE = 100 * 1024 * 1024  # 100 MB máximo
 # Configuración de replicación
 REPLICATION_FACTOR = 2  # Cada bloque tiene 2 copias (original + réplica)
 
+# Política de colocación de bloques: round_robin, weighted_random, least_loaded, power_of_two
+PLACEMENT_POLICY = "power_of_two"
+
 # Directorios
 SHARED_DIRECTORY = "espacioCompartido"
 COORDINATOR_DATA_DIR = "coordinator_data"
 
+# Persistencia de metadatos del coordinador (WAL + snapshots)
+WAL_GROUP_COMMIT_INTERVAL = 0.005  # segundos entre volcados en lote del log
+SNAPSHOT_INTERVAL = 300  # segundos entre snapshots
+SNAPSHOT_MAX_RECORDS = 100000  # registros en el log que fuerzan un snapshot
+
 # Timeout para conexiones (segundos)
 CONNECTION_TIMEOUT = 5
-HEARTBEAT_INTERVAL = 10  # Intervalo de heartbeat en segundos
-NODE_TIMEOUT = 30  # Tiempo sin heartbeat antes de considerar nodo desconectado
+HEARTBEAT_INTERVAL = 2  # Intervalo de heartbeat en segundos
+NODE_TIMEOUT = 30  # Tiempo máximo sin heartbeat antes de considerar nodo desconectado
+PHI_THRESHOLD = 8  # nivel de sospecha (phi-accrual) a partir del que un nodo se da por caído
+PHI_WINDOW = 100  # intervalos entre heartbeats recordados por nodo
+PHI_MIN_STD = 0.5  # desviación mínima (segundos) para tolerar variaciones de red
+DISK_LATENCY_ALPHA = 0.2  # peso de cada medida en la media móvil de latencia de disco
+UNHEALTHY_LATENCY_MS = 200  # latencia de disco a partir de la que se evita un nodo en lecturas
+SPACE_RECONCILE_INTERVAL = 60  # segundos entre recálculos del espacio usado contra el disco
+SCRUB_INTERVAL = 3600  # segundos entre pasadas completas de verificación de bloques
+SCRUB_BYTES_PER_SEC = 4 * 1024 * 1024  # presupuesto de lectura del verificador en segundo plano
+
+# Re-replicación automática tras la pérdida de un nodo
+REPAIR_CONCURRENCY = 2  # copias de bloques simultáneas
+REPAIR_BANDWIDTH = 8 * 1024 * 1024  # bytes por segundo dedicados a re-replicar
+REPAIR_RETRY_BACKOFF = 5  # segundos antes de reintentar una reparación fallida (se duplica en cada fallo)
+REPAIR_RETRY_MAX_BACKOFF = 300  # espera máxima entre reintentos de una misma reparación
+
+# Rebalanceo de bloques hacia nodos con menos ocupación
+REBALANCE_INTERVAL = 60  # segundos entre comprobaciones del sesgo de ocupación
+REBALANCE_TARGET_SKEW = 0.10  # diferencia de ocupación (0-1) que se considera equilibrada
+REBALANCE_BANDWIDTH = 4 * 1024 * 1024  # bytes por segundo dedicados a mover bloques
+REBALANCE_MAX_LOAD = 8  # peticiones en curso en el clúster a partir de las cuales se pausa
+
+# Recolección de bloques huérfanos
+GC_INTERVAL = 1  # segundos entre envíos de lotes de borrado a los nodos
+GC_BATCH_SIZE = 256  # bloques por mensaje DELETE_BLOCK
+INVENTORY_DIGEST_INTERVAL = 600  # segundos entre conciliaciones de inventario de cada nodo
+ORPHAN_GRACE_PERIOD = 300  # antigüedad mínima de un bloque para considerarlo huérfano
+
+# Subidas por bloques reanudables (UPLOAD_BEGIN con resumable y UPLOAD_RESUME)
+UPLOAD_SESSION_TTL = 3600  # segundos sin actividad tras los que se cancela una subida reanudable
+UPLOAD_SESSION_CHECK_INTERVAL = 60  # segundos entre búsquedas de subidas caducadas
+
+# Empaquetado de archivos pequeños en bloques compartidos (paquetes)
+PACK_SMALL_FILES = True  # los archivos pequeños comparten bloque en lugar de ocupar uno cada uno
+PACK_MAX_FILE_SIZE = 128 * 1024  # tamaño máximo de un archivo que se empaqueta
+PACK_COMPACTION_THRESHOLD = 0.5  # fracción de espacio muerto de un paquete que dispara su compactación
+PACK_COMPACTION_INTERVAL = 60  # segundos entre pasadas de compactación de paquetes
+
+# Listado paginado de archivos (LIST_FILES con limit/cursor)
+LIST_FILES_PAGE_SIZE = 100  # archivos por página si el cliente no indica limit
+LIST_FILES_MAX_PAGE = 1000  # máximo de archivos por página
+
+# Mapa de bloques agregado (GET_BLOCK_TABLE con view="summary")
+BLOCK_MAP_DEFAULT_CELLS = 1024  # celdas del mapa si el cliente no indica cells
+BLOCK_MAP_MAX_CELLS = 16384  # máximo de celdas por consulta
+BLOCK_MAP_MAX_FILES = 50  # archivos con más bloques en el rango que se detallan
+
+# Difusión de eventos del clúster a los suscriptores (nodos)
+EVENT_COALESCE_WINDOW = 0.05  # segundos durante los que se agrupan los cambios antes de enviarlos
+EVENT_QUEUE_LIMIT = 1000  # lotes en cola por suscriptor antes de descartarlos y pedir resincronizar
+
+# Control de admisión de peticiones grandes en el coordinador
+ADMISSION_MEMORY_BUDGET = 512 * 1024 * 1024  # bytes de memoria para peticiones en curso
+ADMISSION_MIN_BYTES = 256 * 1024  # mensajes menores no pasan por el control de admisión
+ADMISSION_MEMORY_FACTOR = 4  # copias en memoria de una subida (JSON, decodificado, bloques, reenvíos)
+ADMISSION_PER_CLIENT = 4  # peticiones grandes simultáneas por dirección de cliente
+ADMISSION_MAX_QUEUE = 64  # peticiones en espera antes de rechazar con retry_after
+ADMISSION_MAX_WAIT = 10  # segundos máximos de espera en la cola
+
+# Sincronización a disco de los bloques: "always" (fsync por bloque),
+# "batch" (una sincronización por lote de STORE_BLOCK) o "none"
+STORE_SYNC_POLICY = "batch"
+STORE_WRITE_WORKERS = 4  # hilos que escriben en paralelo los bloques de un lote
+
+# Backend de almacenamiento de los nodos: "files" (un .dat por bloque) o "segments"
+STORAGE_BACKEND = "files"
+SEGMENT_SIZE = 16 * 1024 * 1024  # tamaño preasignado de cada segmento
+SEGMENT_COMPACTION_THRESHOLD = 0.5  # fracción de espacio muerto que dispara la compactación
+SEGMENT_COMPACTION_INTERVAL = 30  # segundos entre pasadas de compactación
+
+# Cliente sadtf (python -m sadtf) para transferencias masivas
+CLIENT_CONCURRENCY = 8  # archivos transferidos en paralelo (y conexiones con el coordinador)
+CLIENT_PROGRESS_INTERVAL = 0.5  # segundos entre actualizaciones del progreso
+CLIENT_RETRIES = 3  # reanudaciones de una transferencia tras perder la conexión
+CLIENT_RETRY_DELAY = 2  # segundos de espera antes de la primera reanudación (crece con cada intento)
+CLIENT_UPLOAD_JOURNAL = os.path.join(os.path.expanduser("~"), ".sadtf_uploads.json")  # subidas a medias
 
 # Configuración de la interfaz web
 WEB_UPDATE_INTERVAL = 5000  # ms (actualización automática en la web)
+WEB_POOL_MAX_IDLE = 8  # conexiones inactivas que la web conserva por coordinador
+WEB_POOL_IDLE_TIMEOUT = 60  # segundos tras los que una conexión inactiva se cierra
+WEB_CACHE_TTL = 1.0  # segundos que las consultas del panel se sirven desde la caché compartida
+WEB_CACHE_MAX_ENTRIES = 1024  # entradas (p. ej. páginas de archivos) antes de purgar las caducadas
+WEB_SSE_CLIENT_QUEUE = 100  # lotes de eventos pendientes por pestaña antes de pedirle recargar todo
+WEB_SSE_KEEPALIVE = 15  # segundos entre comentarios keep-alive en el canal de eventos
+WEB_BLOCK_TIMEOUT = 30  # segundos de espera por bloque en las subidas y descargas por bloques
+WEB_UPLOAD_BUSY_RETRIES = 5  # reintentos de un bloque rechazado por coordinador ocupado
 
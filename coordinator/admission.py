@@ -0,0 +1,139 @@
+"""
+Control de admisión de peticiones grandes en el coordinador
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    ADMISSION_MEMORY_BUDGET, ADMISSION_PER_CLIENT, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT
+)
+
+class Ticket:
+    """Petición en espera de admisión"""
+
+    def __init__(self, client: str, num_bytes: int):
+        self.client = client
+        self.num_bytes = num_bytes
+        self.granted = False
+        self.enqueued_at = time.time()
+
+class AdmissionController:
+    """
+    Presupuesto global de bytes en memoria con límite de concurrencia por cliente
+
+    Cada petición grande reserva los bytes que ocupará en memoria antes de
+    leerse o procesarse. Si no caben en el presupuesto, o el cliente ya
+    tiene per_client peticiones en curso, espera en una cola FIFO: se admite
+    siempre la petición más antigua cuyo cliente está por debajo de su
+    límite, de modo que un cliente que envía muchas no bloquea a los demás
+    y una petición grande no queda postergada por otras pequeñas. Si la
+    cola está llena o la espera supera max_wait, se rechaza y el cliente
+    recibe un retry_after.
+    """
+
+    def __init__(self, budget: int = ADMISSION_MEMORY_BUDGET, per_client: int = ADMISSION_PER_CLIENT,
+                 max_queue: int = ADMISSION_MAX_QUEUE, max_wait: float = ADMISSION_MAX_WAIT):
+        self.budget = budget
+        self.per_client = per_client
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.queue = deque()
+        self.in_flight_bytes = 0
+        self.active: Dict[str, int] = {}  # cliente -> peticiones admitidas en curso
+
+        # Métricas
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+
+    def _fits(self, ticket: Ticket) -> bool:
+        """La petición cabe en el presupuesto (una mayor que todo el presupuesto entra sola)"""
+        return (self.in_flight_bytes + ticket.num_bytes <= self.budget or
+                self.in_flight_bytes == 0)
+
+    def _grant(self):
+        """Admite en orden FIFO las peticiones posibles (con el lock tomado)"""
+        for ticket in list(self.queue):
+            if self.active.get(ticket.client, 0) >= self.per_client:
+                continue
+            if not self._fits(ticket):
+                # No adelantar a la más antigua admisible: evita su inanición
+                break
+            self.queue.remove(ticket)
+            ticket.granted = True
+            self.in_flight_bytes += ticket.num_bytes
+            self.active[ticket.client] = self.active.get(ticket.client, 0) + 1
+            self.admitted += 1
+            self.total_wait += time.time() - ticket.enqueued_at
+        self.changed.notify_all()
+
+    def acquire(self, client: str, num_bytes: int) -> Optional[Ticket]:
+        """
+        Espera a que la petición sea admitida
+        Retorna el ticket a liberar con release(), o None si fue rechazada
+        """
+        ticket = Ticket(client, num_bytes)
+        with self.lock:
+            if len(self.queue) >= self.max_queue:
+                self.rejected_queue_full += 1
+                return None
+            self.queue.append(ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            self._grant()
+
+            deadline = ticket.enqueued_at + self.max_wait
+            while not ticket.granted:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.queue.remove(ticket)
+                    self.rejected_timeout += 1
+                    # Puede que ahora otra petición de la cola sí sea admisible
+                    self._grant()
+                    return None
+                self.changed.wait(remaining)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Devuelve al presupuesto los bytes de una petición terminada"""
+        with self.lock:
+            self.in_flight_bytes -= ticket.num_bytes
+            self.active[ticket.client] -= 1
+            if not self.active[ticket.client]:
+                del self.active[ticket.client]
+            self._grant()
+
+    def retry_after(self) -> int:
+        """Segundos sugeridos al cliente antes de reintentar"""
+        with self.lock:
+            waiting = len(self.queue)
+        return max(1, min(int(self.max_wait), 1 + waiting // max(1, self.per_client)))
+
+    def metrics(self) -> dict:
+        """Métricas de admisión"""
+        with self.lock:
+            queued_by_client: Dict[str, int] = {}
+            for ticket in self.queue:
+                queued_by_client[ticket.client] = queued_by_client.get(ticket.client, 0) + 1
+            return {
+                "budget_bytes": self.budget,
+                "in_flight_bytes": self.in_flight_bytes,
+                "active_by_client": dict(self.active),
+                "queue_depth": len(self.queue),
+                "queued_by_client": queued_by_client,
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout,
+                "avg_wait_seconds": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0
+            }
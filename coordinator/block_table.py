@@ -1,16 +1,33 @@
 """
 Tabla de bloques del sistema distribuido
 """
+import heapq
+import threading
 from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from enum import Enum
 
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    BLOCK_SIZE, PLACEMENT_POLICY, REPLICATION_FACTOR, BLOCK_MAP_DEFAULT_CELLS, BLOCK_MAP_MAX_FILES
+)
+from coordinator.placement import NodeLoad, PlacementPolicy, create_policy
+
 class BlockStatus(Enum):
     """Estado de un bloque"""
     FREE = "FREE"
     USED = "USED"
     REPLICATED = "REPLICATED"
 
+# Códigos de estado del mapa de bloques agregado (BlockTable.summary)
+MAP_FREE, MAP_USED, MAP_REPLICATED, MAP_DEGRADED, MAP_OTHER = range(5)
+MAP_LEGEND = ["FREE", "USED", "REPLICATED", "DEGRADED", "OTHER"]
+# Una celda que agrupa varios bloques muestra el más relevante: primero los degradados
+MAP_PRIORITY = {MAP_FREE: 0, MAP_OTHER: 1, MAP_REPLICATED: 2, MAP_USED: 3, MAP_DEGRADED: 4}
+
 @dataclass
 class BlockEntry:
     """Entrada en la tabla de bloques"""
@@ -20,6 +37,9 @@ class BlockEntry:
     block_number: int
     node_id: str
     replica_node_id: Optional[str] = None
+    node_durable: bool = False  # el nodo principal confirmó la escritura
+    replica_durable: bool = False  # el nodo réplica confirmó la escritura
+    checksum: Optional[int] = None  # CRC32 de los datos, registrado al subir
     
     def to_dict(self):
         """Convierte la entrada a diccionario"""
@@ -29,7 +49,10 @@ class BlockEntry:
             "file_id": self.file_id,
             "block_number": self.block_number,
             "node_id": self.node_id,
-            "replica_node_id": self.replica_node_id
+            "replica_node_id": self.replica_node_id,
+            "node_durable": self.node_durable,
+            "replica_durable": self.replica_durable,
+            "checksum": self.checksum
         }
     
     @classmethod
@@ -41,93 +64,162 @@ class BlockEntry:
             file_id=data["file_id"],
             block_number=data["block_number"],
             node_id=data["node_id"],
-            replica_node_id=data.get("replica_node_id")
+            replica_node_id=data.get("replica_node_id"),
+            node_durable=data.get("node_durable", False),
+            replica_durable=data.get("replica_durable", False),
+            checksum=data.get("checksum")
         )
 
 class BlockTable:
-    """Tabla de bloques del sistema"""
+    """
+    Tabla de bloques del sistema
+    
+    Todas las operaciones toman el lock propio de la tabla (lock del
+    asignador), independiente de los locks de nodos y archivos del
+    coordinador. Los bloques libres y los bytes asignados a cada nodo se
+    mantienen como índices incrementales, así asignar o liberar un archivo
+    no recorre la tabla completa mientras se tiene el lock.
+    """
     
-    def __init__(self, total_blocks: int):
-        self.total_blocks = total_blocks
+    def __init__(self, total_blocks: int, placement: Optional[PlacementPolicy] = None):
+        self.total_blocks = 0
+        self.placement = placement or create_policy(PLACEMENT_POLICY)
+        self.lock = threading.RLock()
         self.blocks: Dict[int, BlockEntry] = {}
         self.file_blocks: Dict[str, List[int]] = {}  # file_id -> lista de block_ids
+        self.free_ids = set()  # block_ids libres
+        self.usage: Dict[str, int] = {}  # node_id -> bytes asignados (original y réplicas)
+        self.version = 0  # aumenta con cada cambio; permite responder "sin cambios" a las consultas
         
         # Inicializar todos los bloques como libres
-        for i in range(total_blocks):
-            self.blocks[i] = BlockEntry(
-                block_id=i,
-                status=BlockStatus.FREE,
-                file_id="",
-                block_number=-1,
-                node_id=""
-            )
-    
-    def allocate_blocks(self, file_id: str, num_blocks: int, available_nodes: List[str]) -> List[Tuple[int, str, str]]:
+        self.resize(total_blocks)
+    
+    @staticmethod
+    def free_entry(block_id: int) -> BlockEntry:
+        """Entrada vacía para un bloque libre"""
+        return BlockEntry(
+            block_id=block_id,
+            status=BlockStatus.FREE,
+            file_id="",
+            block_number=-1,
+            node_id=""
+        )
+    
+    def _unindex(self, entry: BlockEntry):
+        """Quita una entrada de los índices (con el lock tomado)"""
+        if entry.status == BlockStatus.FREE:
+            self.free_ids.discard(entry.block_id)
+            return
+        for nid in (entry.node_id, entry.replica_node_id):
+            if nid:
+                self.usage[nid] = self.usage.get(nid, 0) - BLOCK_SIZE
+    
+    def _index(self, entry: BlockEntry):
+        """Añade una entrada a los índices (con el lock tomado)"""
+        if entry.status == BlockStatus.FREE:
+            self.free_ids.add(entry.block_id)
+            return
+        for nid in (entry.node_id, entry.replica_node_id):
+            if nid:
+                self.usage[nid] = self.usage.get(nid, 0) + BLOCK_SIZE
+    
+    def _set_entry(self, entry: BlockEntry):
+        """Reemplaza la entrada de un bloque manteniendo los índices"""
+        old = self.blocks.get(entry.block_id)
+        if old is not None:
+            self._unindex(old)
+        self.blocks[entry.block_id] = entry
+        self._index(entry)
+        self.version += 1
+    
+    def allocate_blocks(self, file_id: str, num_blocks: int, available_nodes: List[str],
+                        node_loads: Optional[Dict[str, NodeLoad]] = None) -> List[Tuple[int, str, str]]:
         """
         Asigna bloques libres para un archivo
+        node_loads (node_id -> NodeLoad) aporta capacidad y carga de cada nodo
+        según sus heartbeats; la política de colocación decide los nodos
         Retorna lista de (block_id, node_id, replica_node_id)
         """
         if len(available_nodes) < 2:
             raise ValueError("Se necesitan al menos 2 nodos para replicación")
         
-        allocated = []
-        free_blocks = [bid for bid, entry in self.blocks.items() 
-                      if entry.status == BlockStatus.FREE]
-        
-        if len(free_blocks) < num_blocks:
-            raise ValueError(f"No hay suficientes bloques libres. Necesarios: {num_blocks}, Disponibles: {len(free_blocks)}")
-        
-        for i in range(num_blocks):
-            block_id = free_blocks[i]
-            # Seleccionar nodos diferentes para original y réplica
-            node_idx = i % len(available_nodes)
-            replica_idx = (i + 1) % len(available_nodes)
-            node_id = available_nodes[node_idx]
-            replica_node_id = available_nodes[replica_idx]
+        with self.lock:
+            if len(self.free_ids) < num_blocks:
+                raise ValueError(f"No hay suficientes bloques libres. Necesarios: {num_blocks}, Disponibles: {len(self.free_ids)}")
             
-            # Actualizar entrada del bloque
-            self.blocks[block_id] = BlockEntry(
-                block_id=block_id,
-                status=BlockStatus.REPLICATED,
-                file_id=file_id,
-                block_number=i,
-                node_id=node_id,
-                replica_node_id=replica_node_id
-            )
+            # Estado de los nodos para la política: lo reportado en el heartbeat
+            # (con su salud y latencia) y como ocupación lo reportado o, si es
+            # mayor, lo que ya tienen asignado en la tabla
+            loads = {}
+            for nid in available_nodes:
+                reported = (node_loads or {}).get(nid)
+                if reported:
+                    loads[nid] = replace(reported, used=max(reported.used, self.usage.get(nid, 0)))
+                else:
+                    loads[nid] = NodeLoad(node_id=nid, capacity=self.total_blocks * BLOCK_SIZE,
+                                          used=self.usage.get(nid, 0))
+            placements = self.placement.place(loads, num_blocks, REPLICATION_FACTOR)
             
-            allocated.append((block_id, node_id, replica_node_id))
-        
-        # Registrar bloques del archivo
-        if file_id not in self.file_blocks:
-            self.file_blocks[file_id] = []
-        self.file_blocks[file_id].extend([bid for bid, _, _ in allocated])
+            allocated = []
+            for i, block_id in enumerate(heapq.nsmallest(num_blocks, self.free_ids)):
+                # La política garantiza nodos diferentes para original y réplica
+                node_id, replica_node_id = placements[i][0], placements[i][1]
+                
+                # Actualizar entrada del bloque
+                self._set_entry(BlockEntry(
+                    block_id=block_id,
+                    status=BlockStatus.REPLICATED,
+                    file_id=file_id,
+                    block_number=i,
+                    node_id=node_id,
+                    replica_node_id=replica_node_id
+                ))
+                
+                allocated.append((block_id, node_id, replica_node_id))
+            
+            # Registrar bloques del archivo
+            if file_id not in self.file_blocks:
+                self.file_blocks[file_id] = []
+            self.file_blocks[file_id].extend([bid for bid, _, _ in allocated])
         
         return allocated
     
-    def free_blocks(self, file_id: str):
-        """Libera todos los bloques de un archivo"""
-        if file_id not in self.file_blocks:
-            return
-        
-        for block_id in self.file_blocks[file_id]:
-            if block_id in self.blocks:
-                self.blocks[block_id] = BlockEntry(
-                    block_id=block_id,
-                    status=BlockStatus.FREE,
-                    file_id="",
-                    block_number=-1,
-                    node_id=""
-                )
-        
-        del self.file_blocks[file_id]
+    def free_blocks(self, file_id: str) -> List[BlockEntry]:
+        """Libera todos los bloques de un archivo. Retorna las entradas que tenía"""
+        with self.lock:
+            if file_id not in self.file_blocks:
+                return []
+            
+            freed = []
+            for block_id in self.file_blocks.pop(file_id):
+                if block_id in self.blocks:
+                    freed.append(self.blocks[block_id])
+                    self._set_entry(self.free_entry(block_id))
+            return freed
     
     def get_file_blocks(self, file_id: str) -> List[BlockEntry]:
         """Obtiene todas las entradas de bloques de un archivo"""
-        if file_id not in self.file_blocks:
-            return []
-        
-        return [self.blocks[bid] for bid in self.file_blocks[file_id] 
-                if bid in self.blocks]
+        with self.lock:
+            if file_id not in self.file_blocks:
+                return []
+            
+            return [self.blocks[bid] for bid in self.file_blocks[file_id] 
+                    if bid in self.blocks]
+    
+    def get_file_block(self, file_id: str, block_number: int) -> Optional[BlockEntry]:
+        """Obtiene la entrada de un bloque de un archivo por su número"""
+        with self.lock:
+            block_ids = self.file_blocks.get(file_id, [])
+            # Los bloques se asignan en orden, así que normalmente está en su posición
+            if 0 <= block_number < len(block_ids):
+                entry = self.blocks.get(block_ids[block_number])
+                if entry and entry.block_number == block_number:
+                    return entry
+            for block_id in block_ids:
+                entry = self.blocks.get(block_id)
+                if entry and entry.block_number == block_number:
+                    return entry
+            return None
     
     def get_block_info(self, block_id: int) -> Optional[BlockEntry]:
         """Obtiene información de un bloque específico"""
@@ -135,29 +227,299 @@ class BlockTable:
     
     def get_all_blocks(self) -> List[BlockEntry]:
         """Obtiene todas las entradas de la tabla"""
-        return list(self.blocks.values())
+        with self.lock:
+            return list(self.blocks.values())
+    
+    def get_node_blocks(self, node_id: str) -> List[BlockEntry]:
+        """Entradas de bloques con alguna copia asignada a node_id"""
+        with self.lock:
+            return [entry for entry in self.blocks.values()
+                    if entry.file_id and node_id in (entry.node_id, entry.replica_node_id)]
     
     def get_free_blocks_count(self) -> int:
         """Cuenta bloques libres"""
-        return sum(1 for entry in self.blocks.values() 
-                   if entry.status == BlockStatus.FREE)
+        return len(self.free_ids)
     
     def to_dict(self):
         """Convierte la tabla completa a diccionario"""
-        return {
-            "total_blocks": self.total_blocks,
-            "free_blocks": self.get_free_blocks_count(),
-            "used_blocks": self.total_blocks - self.get_free_blocks_count(),
-            "blocks": [entry.to_dict() for entry in self.blocks.values()],
-            "file_blocks": self.file_blocks
-        }
+        with self.lock:
+            free = len(self.free_ids)
+            return {
+                "version": self.version,
+                "total_blocks": self.total_blocks,
+                "free_blocks": free,
+                "used_blocks": self.total_blocks - free,
+                "blocks": [entry.to_dict() for entry in self.blocks.values()],
+                "file_blocks": {fid: list(bids) for fid, bids in self.file_blocks.items()}
+            }
+    
+    @staticmethod
+    def map_code(entry: BlockEntry, node_id: Optional[str] = None, file_id: Optional[str] = None) -> int:
+        """
+        Código del mapa de un bloque: libre, con una sola copia, replicado,
+        degradado (alguna copia asignada sin confirmar o marcada corrupta) u
+        ocupado por otro nodo o archivo que los filtrados
+        """
+        if entry.status == BlockStatus.FREE:
+            return MAP_FREE
+        if ((node_id and node_id not in (entry.node_id, entry.replica_node_id))
+                or (file_id and entry.file_id != file_id)):
+            return MAP_OTHER
+        if (entry.node_id and not entry.node_durable) or (entry.replica_node_id and not entry.replica_durable):
+            return MAP_DEGRADED
+        return MAP_REPLICATED if entry.replica_node_id else MAP_USED
+    
+    def summary(self, start: int = 0, end: Optional[int] = None, cells: int = BLOCK_MAP_DEFAULT_CELLS,
+                node_id: Optional[str] = None, file_id: Optional[str] = None,
+                max_files: int = BLOCK_MAP_MAX_FILES) -> dict:
+        """
+        Vista agregada de los bloques [start, end) para el mapa del panel
+        
+        El rango se reparte en como mucho cells celdas de blocks_per_cell
+        bloques; cada celda toma el código más relevante de sus bloques y las
+        celdas consecutivas iguales se comprimen en runs [código, celdas].
+        Con node_id o file_id los bloques de otros nodos o archivos aparecen
+        como OTHER y no cuentan en los agregados. Acercarse es pedir un rango
+        menor con las mismas celdas, hasta un bloque por celda.
+        """
+        with self.lock:
+            end = self.total_blocks if end is None else min(end, self.total_blocks)
+            start = max(0, min(start, end))
+            blocks_per_cell = max(1, -(-(end - start) // max(1, cells)))
+            
+            runs: List[List[int]] = []
+            counts = [0] * len(MAP_LEGEND)
+            nodes: Dict[str, Dict[str, int]] = {}
+            files: Dict[str, Dict[str, int]] = {}
+            cell_code = MAP_FREE
+            cell_fill = 0
+            for block_id in range(start, end):
+                entry = self.blocks[block_id]
+                code = self.map_code(entry, node_id, file_id)
+                counts[code] += 1
+                
+                if code not in (MAP_FREE, MAP_OTHER):
+                    for nid, durable, role in ((entry.node_id, entry.node_durable, "primary"),
+                                               (entry.replica_node_id, entry.replica_durable, "replica")):
+                        if nid:
+                            node = nodes.setdefault(nid, {"primary": 0, "replica": 0, "not_durable": 0})
+                            node[role] += 1
+                            if not durable:
+                                node["not_durable"] += 1
+                    aggregate = files.get(entry.file_id)
+                    if aggregate is None:
+                        files[entry.file_id] = {"blocks": 1, "degraded": 0,
+                                                "first_block": block_id, "last_block": block_id}
+                    else:
+                        aggregate["blocks"] += 1
+                        aggregate["last_block"] = block_id
+                    if code == MAP_DEGRADED:
+                        files[entry.file_id]["degraded"] += 1
+                
+                if cell_fill == 0 or MAP_PRIORITY[code] > MAP_PRIORITY[cell_code]:
+                    cell_code = code
+                cell_fill += 1
+                if cell_fill == blocks_per_cell or block_id == end - 1:
+                    if runs and runs[-1][0] == cell_code:
+                        runs[-1][1] += 1
+                    else:
+                        runs.append([cell_code, 1])
+                    cell_fill = 0
+            
+            # Sólo los archivos con más bloques en el rango; el resto se resume en el total
+            top_files = sorted(files.items(), key=lambda item: -item[1]["blocks"])[:max_files]
+            return {
+                "version": self.version,
+                "total_blocks": self.total_blocks,
+                "free_blocks": len(self.free_ids),
+                "used_blocks": self.total_blocks - len(self.free_ids),
+                "start": start,
+                "end": end,
+                "blocks_per_cell": blocks_per_cell,
+                "legend": MAP_LEGEND,
+                "runs": runs,
+                "counts": dict(zip(MAP_LEGEND, counts)),
+                "nodes": nodes,
+                "files": dict(top_files),
+                "files_in_range": len(files)
+            }
     
-    def update_block_node(self, block_id: int, new_node_id: str, is_replica: bool = False):
-        """Actualiza el nodo de un bloque (útil cuando un nodo falla)"""
-        if block_id in self.blocks:
-            entry = self.blocks[block_id]
+    def export_file_blocks(self) -> Dict[str, List[list]]:
+        """Bloques de cada archivo como [block_id, block_number, node_id, replica_node_id, checksum]"""
+        with self.lock:
+            return {file_id: [[entry.block_id, entry.block_number, entry.node_id,
+                               entry.replica_node_id, entry.checksum]
+                              for entry in (self.blocks[bid] for bid in block_ids)]
+                    for file_id, block_ids in self.file_blocks.items()}
+    
+    def node_usage(self) -> Dict[str, int]:
+        """Bytes asignados a cada nodo en la tabla (original y réplicas)"""
+        with self.lock:
+            return {nid: used for nid, used in self.usage.items() if used > 0}
+    
+    def resize(self, total_blocks: int):
+        """Extiende la tabla a total_blocks conservando las entradas existentes"""
+        with self.lock:
+            for i in range(self.total_blocks, total_blocks):
+                self._set_entry(self.free_entry(i))
+            self.total_blocks = max(self.total_blocks, total_blocks)
+    
+    def assign_blocks(self, file_id: str, entries: List[tuple]):
+        """
+        Registra bloques ya asignados a un archivo:
+        (block_id, block_number, node_id, replica_node_id[, checksum])
+        Usado al reconstruir la tabla desde el snapshot y el log de metadatos
+        """
+        with self.lock:
+            if entries:
+                self.resize(max(entry[0] for entry in entries) + 1)
+            
+            file_block_ids = self.file_blocks.setdefault(file_id, [])
+            for block_id, block_number, node_id, replica_node_id, *rest in entries:
+                self._set_entry(BlockEntry(
+                    block_id=block_id,
+                    status=BlockStatus.REPLICATED if replica_node_id else BlockStatus.USED,
+                    file_id=file_id,
+                    block_number=block_number,
+                    node_id=node_id,
+                    replica_node_id=replica_node_id,
+                    checksum=rest[0] if rest else None
+                ))
+                if block_id not in file_block_ids:
+                    file_block_ids.append(block_id)
+    
+    def merge_block_report(self, node_id: str, report: Dict[str, List[tuple]],
+                           known_files=None) -> Tuple[List[Tuple[int, str, int, bool]], List[Tuple[int, bool]]]:
+        """
+        Incorpora el inventario reportado por un nodo
+        (file_id -> [(block_id, block_number, is_replica, checksum)])
+        Ignora archivos que no estén en known_files. Una copia sólo ocupa su
+        hueco si está vacío o ya es de ese nodo, el bloque no pertenece a
+        otro archivo y su checksum coincide con el de la tabla; las demás se
+        dejan a la limpieza de huérfanos. Retorna (copias asignadas al nodo
+        como (block_id, file_id, block_number, is_replica), copias del nodo
+        cuyo checksum no coincide como (block_id, is_replica))
+        """
+        assigned = []
+        stale = []
+        with self.lock:
+            for file_id, records in report.items():
+                if known_files is not None and file_id not in known_files:
+                    continue
+                
+                if records:
+                    self.resize(max(record[0] for record in records) + 1)
+                
+                file_block_ids = self.file_blocks.setdefault(file_id, [])
+                known_ids = set(file_block_ids)
+                for block_id, block_number, is_replica, *rest in records:
+                    reported_checksum = rest[0] if rest else None
+                    old = self.blocks[block_id]
+                    if old.status == BlockStatus.FREE:
+                        entry = BlockEntry(
+                            block_id=block_id,
+                            status=BlockStatus.USED,
+                            file_id=file_id,
+                            block_number=block_number,
+                            node_id=""
+                        )
+                    elif old.file_id != file_id:
+                        continue  # el ID ya es de otro archivo: la copia es huérfana
+                    else:
+                        entry = BlockEntry(**{**old.__dict__})
+                    
+                    owner = entry.replica_node_id if is_replica else entry.node_id
+                    if owner and owner != node_id:
+                        continue  # la copia ya se rehízo en otro nodo
+                    if (entry.checksum is not None and reported_checksum is not None
+                            and reported_checksum != entry.checksum):
+                        if owner == node_id:
+                            stale.append((block_id, is_replica))
+                        continue
+                    
+                    # Un bloque reportado por el nodo está en su disco
+                    if is_replica:
+                        entry.replica_node_id = node_id
+                        entry.replica_durable = True
+                    else:
+                        entry.node_id = node_id
+                        entry.node_durable = True
+                    if entry.checksum is None and reported_checksum is not None:
+                        entry.checksum = reported_checksum
+                    entry.status = (BlockStatus.REPLICATED if entry.node_id and entry.replica_node_id
+                                    else BlockStatus.USED)
+                    self._set_entry(entry)
+                    
+                    if block_id not in known_ids:
+                        known_ids.add(block_id)
+                        file_block_ids.append(block_id)
+                    if owner != node_id:
+                        assigned.append((block_id, file_id, block_number, is_replica))
+                
+                file_block_ids.sort(key=lambda bid: self.blocks[bid].block_number)
+        
+        return assigned, stale
+    
+    def mark_block_stored(self, block_id: int, node_id: str, is_replica: bool) -> bool:
+        """Marca como persistida la copia de un bloque confirmada por un nodo"""
+        with self.lock:
+            entry = self.blocks.get(block_id)
+            if not entry:
+                return False
+            if is_replica and entry.replica_node_id == node_id:
+                entry.replica_durable = True
+            elif not is_replica and entry.node_id == node_id:
+                entry.node_durable = True
+            else:
+                return False
+            self.version += 1
+            return True
+    
+    def mark_block_corrupt(self, block_id: int, node_id: str, is_replica: bool) -> bool:
+        """Marca como no válida la copia de un bloque que un nodo reportó corrupta"""
+        with self.lock:
+            entry = self.blocks.get(block_id)
+            if not entry or node_id not in (entry.node_id, entry.replica_node_id):
+                return False
+            if is_replica:
+                entry.replica_durable = False
+            else:
+                entry.node_durable = False
+            self.version += 1
+            return True
+    
+    def set_checksums(self, checksums: Dict[int, int]):
+        """Registra el CRC32 de varios bloques (block_id -> checksum)"""
+        with self.lock:
+            for block_id, checksum in checksums.items():
+                if block_id in self.blocks:
+                    self.blocks[block_id].checksum = checksum
+            self.version += 1
+    
+    def update_block_node(self, block_id: int, new_node_id: str, is_replica: bool = False,
+                          durable: bool = False,
+                          expected: Optional[Tuple[str, int, Optional[int], Optional[str]]] = None) -> bool:
+        """
+        Actualiza el nodo de un bloque (útil cuando un nodo falla)
+        durable indica que el nuevo nodo ya confirmó la copia. Con expected
+        (file_id, block_number, checksum y nodo actual de la copia) sólo se
+        actualiza si la entrada sigue igual. Retorna si se actualizó
+        """
+        with self.lock:
+            entry = self.blocks.get(block_id)
+            if entry is None:
+                return False
+            if expected is not None:
+                current_node = entry.replica_node_id if is_replica else entry.node_id
+                if (entry.file_id, entry.block_number, entry.checksum, current_node) != expected:
+                    return False
+            self._unindex(entry)
             if is_replica:
                 entry.replica_node_id = new_node_id
+                entry.replica_durable = durable
             else:
                 entry.node_id = new_node_id
-
+                entry.node_durable = durable
+            self._index(entry)
+            self.version += 1
+            return True
@@ -1,22 +1,43 @@
 """
 Coordinador del sistema distribuido
 """
+import base64
+import secrets
 import socket
 import threading
 import time
 import json
 import os
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional, Tuple, Any
+from dataclasses import dataclass, asdict, field, replace
 from datetime import datetime
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import COORDINATOR_PORT, HEARTBEAT_INTERVAL, NODE_TIMEOUT, COORDINATOR_DATA_DIR, BLOCK_SIZE
-from common.protocol import MessageType, receive_message, send_message
+from config import (
+    COORDINATOR_PORT, NODE_TIMEOUT, COORDINATOR_DATA_DIR, BLOCK_SIZE,
+    PLACEMENT_POLICY, WAL_GROUP_COMMIT_INTERVAL, SNAPSHOT_INTERVAL, SNAPSHOT_MAX_RECORDS,
+    ADMISSION_MIN_BYTES, ADMISSION_MEMORY_FACTOR, UNHEALTHY_LATENCY_MS,
+    LIST_FILES_PAGE_SIZE, LIST_FILES_MAX_PAGE, BLOCK_MAP_DEFAULT_CELLS, BLOCK_MAP_MAX_CELLS,
+    UPLOAD_SESSION_TTL, UPLOAD_SESSION_CHECK_INTERVAL
+)
+from common.protocol import (
+    MessageType, receive_message, send_message, unpack_block_report, unpack_id_ranges,
+    receive_message_length, receive_message_body, discard_message_body
+)
 from coordinator.block_table import BlockTable
-from common.utils import ensure_directory
+from coordinator.placement import NodeLoad, create_policy
+from coordinator.metadata_log import MetadataLog
+from coordinator.replication import ReplicationManager
+from coordinator.rebalancer import Rebalancer
+from coordinator.garbage_collector import GarbageCollector
+from coordinator.admission import AdmissionController
+from coordinator.failure_detector import FailureDetector
+from coordinator.event_bus import EventBus
+from coordinator.file_index import FileIndex
+from coordinator.packing import PackManager
+from common.utils import ensure_directory, calculate_checksum, ReadWriteLock
 
 @dataclass
 class NodeInfo:
@@ -27,10 +48,24 @@ class NodeInfo:
     shared_space_size: int  # en bytes
     last_heartbeat: float
     socket: Optional[Any] = field(default=None)
+    used_space: int = 0  # en bytes, reportado en el heartbeat
+    free_space: int = 0  # en bytes, reportado en el heartbeat
+    load: int = 0  # peticiones en curso, reportado en el heartbeat
+    disk_latency_ms: float = 0.0  # media móvil de lectura/escritura de bloques
+    io_errors: int = 0  # errores de disco acumulados en el nodo
+    checksum_errors: int = 0  # bloques corruptos detectados por el nodo
+    new_errors: int = 0  # errores aparecidos desde el heartbeat anterior
+    suspected: bool = False  # el detector de fallos lo da por caído
+    send_lock: Any = field(default_factory=threading.Lock, repr=False, compare=False)
     
     def is_alive(self):
         """Verifica si el nodo está vivo"""
-        return time.time() - self.last_heartbeat < NODE_TIMEOUT
+        return not self.suspected and time.time() - self.last_heartbeat < NODE_TIMEOUT
+    
+    def is_healthy(self):
+        """Vivo, con disco rápido y sin errores recientes"""
+        return (self.is_alive() and self.new_errors == 0 and
+                self.disk_latency_ms < UNHEALTHY_LATENCY_MS)
     
     def to_dict(self):
         """Convierte a diccionario"""
@@ -39,8 +74,26 @@ class NodeInfo:
             "address": self.address,
             "port": self.port,
             "shared_space_size": self.shared_space_size,
-            "is_alive": self.is_alive()
+            "used_space": self.used_space,
+            "free_space": self.free_space,
+            "load": self.load,
+            "disk_latency_ms": self.disk_latency_ms,
+            "io_errors": self.io_errors,
+            "checksum_errors": self.checksum_errors,
+            "is_alive": self.is_alive(),
+            "is_healthy": self.is_healthy()
         }
+    
+    def to_load(self) -> NodeLoad:
+        """Capacidad y carga del nodo para la política de colocación"""
+        return NodeLoad(
+            node_id=self.node_id,
+            capacity=self.shared_space_size,
+            used=self.used_space,
+            load=self.load,
+            latency=self.disk_latency_ms,
+            healthy=self.is_healthy()
+        )
 
 @dataclass
 class FileInfo:
@@ -50,9 +103,60 @@ class FileInfo:
     size: int
     upload_date: str
     num_blocks: int
+    pack_id: str = ""  # paquete que lo contiene si es un archivo pequeño empaquetado
+    pack_offset: int = 0  # posición del archivo dentro del bloque del paquete
+    pack_checksum: Optional[int] = None  # CRC32 del archivo empaquetado
     
     def to_dict(self):
-        return asdict(self)
+        data = asdict(self)
+        if not self.pack_id:
+            for key in ("pack_id", "pack_offset", "pack_checksum"):
+                del data[key]
+        return data
+
+@dataclass
+class UploadSession:
+    """Subida por bloques en curso (UPLOAD_BEGIN ... UPLOAD_COMMIT)"""
+    file_id: str
+    filename: str
+    size: int
+    allocated: List[tuple]  # (block_id, node_id, replica_node_id) por número de bloque
+    owner: Any = field(default=None, repr=False)  # conexión que la inició (o la reanudó)
+    checksums: Dict[int, int] = field(default_factory=dict)  # número de bloque -> checksum
+    upload_id: str = ""  # secreto con el que se reanuda una subida reanudable
+    resumable: bool = False  # sobrevive a la conexión y al reinicio del coordinador
+    last_activity: float = field(default_factory=time.time)
+    packed: bool = False  # archivo pequeño: va a un paquete al confirmar, sin bloques propios
+    packed_data: Optional[bytes] = field(default=None, repr=False)  # su único bloque, hasta el commit
+    
+    @property
+    def num_blocks(self) -> int:
+        return 1 if self.packed else len(self.allocated)
+    
+    def to_dict(self):
+        """Estado persistente de una subida reanudable (para el snapshot)"""
+        return {
+            "file_id": self.file_id,
+            "filename": self.filename,
+            "size": self.size,
+            "upload_id": self.upload_id,
+            "allocated": [list(assignment) for assignment in self.allocated],
+            "checksums": {str(number): checksum for number, checksum in self.checksums.items()},
+            "packed": self.packed
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            file_id=data["file_id"],
+            filename=data["filename"],
+            size=data["size"],
+            allocated=[tuple(assignment) for assignment in data["allocated"]],
+            checksums={int(number): checksum for number, checksum in data.get("checksums", {}).items()},
+            upload_id=data["upload_id"],
+            resumable=True,
+            packed=data.get("packed", False)
+        )
 
 class Coordinator:
     """Coordinador del sistema distribuido"""
@@ -62,70 +166,227 @@ class Coordinator:
         self.socket = None
         self.running = False
         
-        # Nodos registrados
+        # Nodos registrados (lectores: heartbeats, subidas, consultas;
+        # escritores: altas y bajas de nodos)
         self.nodes: Dict[str, NodeInfo] = {}
-        self.node_lock = threading.Lock()
+        self.node_lock = ReadWriteLock()
         
         # Registro de nodos por dirección (para reasignar IDs)
         self.node_registry: Dict[str, str] = {}  # address:port -> node_id
         self.next_node_number = 1
         
-        # Tabla de bloques
-        self.block_table: Optional[BlockTable] = None
+        # Tabla de bloques (con su propio lock de asignación) y política de colocación
+        self.placement = create_policy(PLACEMENT_POLICY)
+        self.block_table = BlockTable(0, self.placement)
         
         # Archivos almacenados
         self.files: Dict[str, FileInfo] = {}
+        self.uploading: set = set()  # file_ids reservados por subidas en curso
         self.files_lock = threading.Lock()
+        self.files_version = 0  # aumenta con cada alta o baja de archivo
+        self.upload_sessions: Dict[str, UploadSession] = {}  # file_id -> subida por bloques
+        # Subidas reanudables ya confirmadas: file_id -> (upload_id, momento del commit).
+        # Permiten responder a UPLOAD_RESUME si el cliente no recibió la respuesta del commit
+        self.completed_uploads: Dict[str, Tuple[str, float]] = {}
+        self.file_index = FileIndex()  # índices ordenados para LIST_FILES paginado
+        self.packer = PackManager(self)  # archivos pequeños agrupados en bloques de paquete
         
         # Directorio de datos del coordinador
         ensure_directory(COORDINATOR_DATA_DIR)
         
-        # Cargar estado persistente
+        # Cargar estado persistente (snapshot + log de metadatos)
+        self.metadata_log = MetadataLog(COORDINATOR_DATA_DIR, WAL_GROUP_COMMIT_INTERVAL)
         self.load_state()
+        self.metadata_log.start()
+        self.last_snapshot_time = time.time()
+        
+        # Re-replicación de bloques de nodos perdidos
+        self.replication = ReplicationManager(self)
+        self.rebalancer = Rebalancer(self)
+        
+        # Borrado asíncrono de bloques en los nodos
+        self.garbage_collector = GarbageCollector(self)
+        
+        # Presupuesto de memoria para subidas y descargas en curso
+        self.admission = AdmissionController()
+        
+        # Difusión de cambios del clúster a los suscriptores
+        self.events = EventBus()
+        
+        # Detección de nodos caídos a partir de los heartbeats (phi-accrual)
+        self.failure_detector = FailureDetector(self.handle_node_suspected)
         
-        # Thread para monitorear nodos
-        self.monitor_thread = None
+        # Thread para tomar snapshots
+        self.snapshot_thread = None
     
     def load_state(self):
-        """Carga el estado persistente del coordinador"""
+        """Carga el estado persistente: último snapshot más los registros del log"""
+        try:
+            snapshot, records = self.metadata_log.load()
+            if snapshot is None:
+                snapshot = self.load_legacy_state()
+            if snapshot:
+                self.apply_snapshot(snapshot)
+            for record in records:
+                self.apply_metadata_record(record)
+        except Exception as e:
+            print(f"Error cargando estado: {e}")
+        
+        # Los índices se construyen una sola vez tras reproducir el log
+        self.file_index.rebuild(self.files.values())
+        self.packer.rebuild(self.files.values())
+        
+        # Calcular el siguiente número de nodo
+        max_num = 0
+        for node_id in self.node_registry.values():
+            if node_id.startswith("nodo"):
+                try:
+                    num = int(node_id.replace("nodo", ""))
+                    max_num = max(max_num, num)
+                except:
+                    pass
+        self.next_node_number = max_num + 1
+        # Las ubicaciones de bloques se completan con los reportes de inventario
+        # que envían los nodos al registrarse (ver merge_block_report)
+    
+    def load_legacy_state(self) -> Optional[dict]:
+        """Lee el state.json de versiones anteriores (sin log de metadatos)"""
         state_file = os.path.join(COORDINATOR_DATA_DIR, "state.json")
         if os.path.exists(state_file):
-            try:
-                with open(state_file, 'r') as f:
-                    state = json.load(f)
-                    # Cargar archivos
-                    self.files = {fid: FileInfo(**data) 
-                                 for fid, data in state.get("files", {}).items()}
-                    # Cargar registro de nodos
-                    self.node_registry = state.get("node_registry", {})
-                    # Calcular el siguiente número de nodo
-                    if self.node_registry:
-                        max_num = 0
-                        for node_id in self.node_registry.values():
-                            if node_id.startswith("nodo"):
-                                try:
-                                    num = int(node_id.replace("nodo", ""))
-                                    max_num = max(max_num, num)
-                                except:
-                                    pass
-                        self.next_node_number = max_num + 1
-                    # La tabla de bloques se reconstruirá cuando los nodos se registren
-            except Exception as e:
-                print(f"Error cargando estado: {e}")
+            with open(state_file, 'r') as f:
+                return json.load(f)
+        return None
     
-    def save_state(self):
-        """Guarda el estado persistente del coordinador"""
-        state_file = os.path.join(COORDINATOR_DATA_DIR, "state.json")
+    def apply_snapshot(self, snapshot: dict):
+        """Restaura archivos, registro de nodos y tabla de bloques desde un snapshot"""
+        self.files = {fid: FileInfo(**data) 
+                     for fid, data in snapshot.get("files", {}).items()}
+        self.node_registry = snapshot.get("node_registry", {})
+        
+        self.block_table.resize(snapshot.get("total_blocks", 0))
+        for file_id, entries in snapshot.get("file_blocks", {}).items():
+            self.assign_file_blocks(file_id, entries)
+        for pack_id, pack_data in snapshot.get("packs", {}).items():
+            self.packer.register(pack_id, pack_data.get("written", 0))
+        for session_data in snapshot.get("upload_sessions", []):
+            self.restore_upload_session(UploadSession.from_dict(session_data))
+        self.completed_uploads = {fid: tuple(completed)
+                                  for fid, completed in snapshot.get("completed_uploads", {}).items()}
+    
+    def apply_metadata_record(self, record: dict):
+        """Aplica una mutación del log (las operaciones son idempotentes)"""
+        op = record.get("op")
+        if op == "register_node":
+            self.node_registry[record["node_key"]] = record["node_id"]
+        elif op == "add_file":
+            file_info = FileInfo(**record["file"])
+            self.files[file_info.file_id] = file_info
+            self.assign_file_blocks(file_info.file_id, record.get("blocks", []))
+            if file_info.pack_id:
+                self.packer.replay_append(file_info.pack_id, file_info.pack_offset + file_info.size,
+                                          record.get("pack_block_checksum"))
+            # El commit de una subida reanudable la cierra
+            self.upload_sessions.pop(file_info.file_id, None)
+            self.uploading.discard(file_info.file_id)
+            if record.get("upload_id"):
+                self.completed_uploads[file_info.file_id] = (record["upload_id"], time.time())
+        elif op == "begin_upload":
+            self.restore_upload_session(UploadSession.from_dict(record["session"]))
+        elif op == "upload_block":
+            session = self.upload_sessions.get(record["file_id"])
+            if session:
+                session.checksums[record["block_number"]] = record["checksum"]
+        elif op == "abort_upload":
+            if self.upload_sessions.pop(record["file_id"], None):
+                self.uploading.discard(record["file_id"])
+                self.block_table.free_blocks(record["file_id"])
+        elif op == "delete_file":
+            self.files.pop(record["file_id"], None)
+            self.block_table.free_blocks(record["file_id"])
+        elif op == "add_pack":
+            self.packer.register(record["pack_id"])
+            self.assign_file_blocks(record["pack_id"], record.get("blocks", []))
+        elif op == "repack_file":
+            file_info = self.files.get(record["file_id"])
+            if file_info:
+                self.files[file_info.file_id] = replace(file_info, pack_id=record["pack_id"],
+                                                        pack_offset=record["pack_offset"])
+                self.packer.replay_append(record["pack_id"], record["pack_offset"] + file_info.size,
+                                          record.get("pack_block_checksum"))
+        elif op == "free_pack":
+            self.packer.forget(record["pack_id"])
+            self.block_table.free_blocks(record["pack_id"])
+        elif op == "move_block":
+            entry = self.block_table.get_block_info(record["block_id"])
+            if record.get("file_id") and (not entry or entry.file_id != record["file_id"]):
+                # Copia incorporada del inventario de un nodo en un bloque que la tabla no tenía
+                node_id = record["node_id"]
+                self.assign_file_blocks(record["file_id"], [[
+                    record["block_id"], record["block_number"],
+                    "" if record.get("is_replica") else node_id, node_id if record.get("is_replica") else ""
+                ]])
+            else:
+                self.block_table.update_block_node(record["block_id"], record["node_id"],
+                                                   record.get("is_replica", False))
+    
+    def restore_upload_session(self, session: UploadSession):
+        """Recupera una subida reanudable del snapshot o del log; espera a que la reanuden"""
+        self.upload_sessions[session.file_id] = session
+        self.uploading.add(session.file_id)
+        self.assign_file_blocks(session.file_id, [[block_id, number, node_id, replica_node_id]
+                                                  for number, (block_id, node_id, replica_node_id)
+                                                  in enumerate(session.allocated)])
+    
+    def assign_file_blocks(self, file_id: str, entries: list):
+        """Registra en la tabla los bloques [block_id, block_number, node_id, replica_node_id] de un archivo"""
+        if not entries:
+            return
+        self.block_table.assign_blocks(file_id, [tuple(entry) for entry in entries])
+    
+    def log_mutation(self, record: dict, wait: bool = True):
+        """Registra una mutación de metadatos en el log (group commit)"""
         try:
-            with open(state_file, 'w') as f:
-                state = {
-                    "files": {fid: file_info.to_dict() 
-                             for fid, file_info in self.files.items()},
-                    "node_registry": self.node_registry
-                }
-                json.dump(state, f, indent=2)
+            self.metadata_log.append(record, wait)
         except Exception as e:
-            print(f"Error guardando estado: {e}")
+            print(f"Error registrando mutación de metadatos: {e}")
+    
+    def save_snapshot(self):
+        """Escribe un snapshot compacto de los metadatos y descarta el log que cubre"""
+        try:
+            last_seq = self.metadata_log.begin_snapshot()
+            # Copias rápidas bajo los locks; la serialización se hace fuera
+            with self.files_lock:
+                files = dict(self.files)
+                upload_sessions = [session.to_dict() for session in self.upload_sessions.values()
+                                   if session.resumable]
+                completed_uploads = {fid: list(completed) for fid, completed in self.completed_uploads.items()}
+            with self.node_lock.read():
+                node_registry = dict(self.node_registry)
+            file_blocks = self.block_table.export_file_blocks()
+            total_blocks = self.block_table.total_blocks
+            packs = self.packer.export()
+            
+            self.metadata_log.write_snapshot({
+                "files": {fid: file_info.to_dict() for fid, file_info in files.items()},
+                "node_registry": node_registry,
+                "total_blocks": total_blocks,
+                "file_blocks": file_blocks,
+                "upload_sessions": upload_sessions,
+                "completed_uploads": completed_uploads,
+                "packs": packs
+            }, last_seq)
+            self.last_snapshot_time = time.time()
+        except Exception as e:
+            print(f"Error guardando snapshot: {e}")
+    
+    def snapshot_loop(self):
+        """Toma snapshots periódicos o cuando el log crece demasiado"""
+        while self.running:
+            time.sleep(1)
+            pending = self.metadata_log.records_since_snapshot
+            if pending >= SNAPSHOT_MAX_RECORDS or (
+                    pending > 0 and time.time() - self.last_snapshot_time >= SNAPSHOT_INTERVAL):
+                self.save_snapshot()
     
     def start(self):
         """Inicia el coordinador"""
@@ -137,9 +398,28 @@ class Coordinator:
         
         print(f"Coordinador iniciado en puerto {self.port}")
         
-        # Iniciar thread de monitoreo
-        self.monitor_thread = threading.Thread(target=self.monitor_nodes, daemon=True)
-        self.monitor_thread.start()
+        # Iniciar el detector de fallos de nodos
+        self.failure_detector.start()
+        
+        # Iniciar thread de snapshots
+        self.snapshot_thread = threading.Thread(target=self.snapshot_loop, daemon=True)
+        self.snapshot_thread.start()
+        
+        # Iniciar hilos de re-replicación
+        self.replication.start()
+        
+        # Iniciar hilos de rebalanceo y de borrado de bloques
+        self.rebalancer.start()
+        self.garbage_collector.start()
+        
+        # Iniciar la compactación de paquetes de archivos pequeños
+        self.packer.start()
+        
+        # Iniciar el bus de eventos
+        self.events.start()
+        
+        # Cancelar las subidas reanudables abandonadas
+        threading.Thread(target=self.expire_uploads_loop, daemon=True).start()
         
         # Aceptar conexiones
         while self.running:
@@ -150,108 +430,178 @@ class Coordinator:
                 if self.running:
                     print(f"Error aceptando conexión: {e}")
     
-    def monitor_nodes(self):
-        """Monitorea los nodos y detecta desconexiones"""
-        while self.running:
-            time.sleep(HEARTBEAT_INTERVAL)
-            with self.node_lock:
-                disconnected_nodes = []
-                for node_id, node_info in list(self.nodes.items()):
-                    if not node_info.is_alive():
-                        disconnected_nodes.append(node_id)
-                
-                for node_id in disconnected_nodes:
-                    print(f"Nodo {node_id} desconectado (timeout)")
-                    self.handle_node_disconnection(node_id)
+    def handle_node_suspected(self, node_id: str):
+        """El detector de fallos da por caído a un nodo que dejó de enviar heartbeats"""
+        with self.node_lock.read():
+            node_info = self.nodes.get(node_id)
+            if not node_info:
+                return
+            node_info.suspected = True
+        
+        # La notificación y la re-replicación se hacen fuera del lock
+        print(f"Nodo {node_id} desconectado (sin heartbeats)")
+        self.handle_node_disconnection(node_id)
     
     def handle_node_disconnection(self, node_id: str):
         """Maneja la desconexión de un nodo"""
-        if node_id in self.nodes:
-            node_info = self.nodes[node_id]
-            # Cerrar socket si está abierto
-            if node_info.socket:
-                try:
-                    node_info.socket.close()
-                except:
-                    pass
-            
-            # Notificar a todos los nodos activos
-            self.notify_all_nodes({
-                "type": "NODE_DISCONNECTED",
-                "node_id": node_id
-            })
-            
-            # Reconstruir tabla de bloques si es necesario
-            self.rebuild_block_table()
-            
+        with self.node_lock.write():
+            node_info = self.nodes.get(node_id)
+            if not node_info or node_info.is_alive():
+                return
             del self.nodes[node_id]
-    
-    def rebuild_block_table(self):
-        """Reconstruye la tabla de bloques basándose en los nodos activos"""
-        total_blocks = sum(node.shared_space_size // BLOCK_SIZE 
-                          for node in self.nodes.values() if node.is_alive())
+        self.failure_detector.remove(node_id)
+        self.events.unsubscribe(node_id)
         
-        if total_blocks > 0:
-            # Crear nueva tabla de bloques
-            new_table = BlockTable(total_blocks)
-            
-            # Migrar información de archivos existentes
-            # (simplificado - en producción se necesitaría más lógica)
-            self.block_table = new_table
-            
-            # Notificar a todos los nodos
-            self.notify_all_nodes({
-                "type": "BLOCK_TABLE_UPDATED",
-                "table": self.block_table.to_dict()
-            })
+        # Cerrar socket si está abierto
+        if node_info.socket:
+            try:
+                node_info.socket.close()
+            except:
+                pass
+        
+        # Notificar a los suscriptores
+        self.events.publish("nodes", "node_left", node_id, {"node_id": node_id})
+        
+        # Volver a crear en otros nodos las copias que se perdieron
+        self.replication.enqueue_node_loss(node_id)
+    
+    def is_node_alive(self, node_id: str) -> bool:
+        """Indica si el nodo está registrado y envía heartbeats"""
+        node_info = self.nodes.get(node_id)
+        return bool(node_info and node_info.is_alive())
     
-    def notify_all_nodes(self, message: dict):
-        """Notifica a todos los nodos activos"""
-        with self.node_lock:
-            for node_id, node_info in list(self.nodes.items()):
-                if node_info.is_alive() and node_info.socket:
-                    try:
-                        send_message(node_info.socket, MessageType.UPDATE_BLOCK_TABLE, message)
-                    except:
-                        pass
+    def get_node_loads(self) -> Dict[str, NodeLoad]:
+        """Capacidad y carga de los nodos activos para la política de colocación"""
+        with self.node_lock.read():
+            return {node_id: node_info.to_load() for node_id, node_info in self.nodes.items()
+                    if node_info.is_alive()}
+    
+    def move_block_copy(self, block_id: int, node_id: str, is_replica: bool,
+                        expected: Optional[Tuple[str, int, Optional[int], Optional[str]]] = None) -> bool:
+        """
+        Reasigna una copia de un bloque a otro nodo que ya la tiene almacenada
+        expected es la entrada leída antes de copiar (file_id, block_number,
+        checksum, nodo anterior de la copia): si cambió durante la copia (el
+        archivo se borró y el ID se reutilizó, o la copia ya se movió) no se
+        reasigna y la copia recién escrita se borra. Retorna si se reasignó
+        """
+        if not self.block_table.update_block_node(block_id, node_id, is_replica, durable=True,
+                                                  expected=expected):
+            current = self.block_table.get_block_info(block_id)
+            if expected and not (current and current.file_id == expected[0]
+                                 and node_id in (current.node_id, current.replica_node_id)):
+                self.garbage_collector.enqueue(node_id, block_id, expected[0])
+            return False
+        self.log_mutation({"op": "move_block", "block_id": block_id, "node_id": node_id,
+                           "is_replica": is_replica})
+        self.events.publish("blocks", "block_moved", block_id, {
+            "block_id": block_id, "node_id": node_id, "is_replica": is_replica
+        })
+        return True
+    
+    def publish_file_deleted(self, file_id: str, block_ids: List[int]):
+        """Publica la eliminación de un archivo y la liberación de sus bloques"""
+        self.events.publish("files", "file_deleted", file_id, {"file_id": file_id})
+        self.events.publish("blocks", "blocks_freed", f"file:{file_id}", {
+            "file_id": file_id, "block_ids": block_ids
+        })
+    
+    def send_to_node_socket(self, node_info: NodeInfo, msg_type: MessageType, data: dict):
+        """Envía un mensaje por la conexión principal de un nodo (serializado por nodo)"""
+        with node_info.send_lock:
+            send_message(node_info.socket, msg_type, data)
     
     def handle_client(self, client_socket: socket.socket, address):
         """Maneja una conexión de cliente (nodo o cliente GUI)"""
         try:
             while self.running:
-                message = receive_message(client_socket)
-                if not message:
+                length = receive_message_length(client_socket)
+                if length is None:
                     break
                 
-                msg_type = MessageType(message["type"])
-                data = message.get("data", {})
-                
-                if msg_type == MessageType.NODE_REGISTER:
-                    self.handle_node_register(client_socket, data)
-                elif msg_type == MessageType.NODE_HEARTBEAT:
-                    self.handle_node_heartbeat(data)
-                elif msg_type == MessageType.BLOCK_STORED:
-                    self.handle_block_stored(data)
-                elif msg_type == MessageType.UPLOAD_FILE:
-                    self.handle_upload_file(client_socket, data)
-                elif msg_type == MessageType.DOWNLOAD_FILE:
-                    self.handle_download_file(client_socket, data)
-                elif msg_type == MessageType.DELETE_FILE:
-                    self.handle_delete_file(client_socket, data)
-                elif msg_type == MessageType.LIST_FILES:
-                    self.handle_list_files(client_socket)
-                elif msg_type == MessageType.GET_FILE_INFO:
-                    self.handle_get_file_info(client_socket, data)
-                elif msg_type == MessageType.GET_BLOCK_TABLE:
-                    self.handle_get_block_table(client_socket)
-                elif msg_type == MessageType.GET_ACTIVE_NODES:
-                    self.handle_get_active_nodes(client_socket)
+                # Los mensajes grandes (subidas) reservan memoria antes de leerse
+                ticket = None
+                if length >= ADMISSION_MIN_BYTES:
+                    ticket = self.admission.acquire(address[0], length * ADMISSION_MEMORY_FACTOR)
+                    if ticket is None:
+                        if not discard_message_body(client_socket, length):
+                            break
+                        self.send_busy(client_socket)
+                        continue
                 
+                try:
+                    message = receive_message_body(client_socket, length)
+                    if not message:
+                        break
+                    self.dispatch_message(client_socket, message)
+                finally:
+                    if ticket:
+                        self.admission.release(ticket)
+        
         except Exception as e:
             print(f"Error manejando cliente {address}: {e}")
         finally:
+            # Si la conexión era una suscripción a eventos, darla de baja
+            self.events.unsubscribe(self.client_subscriber_name(address))
+            # Las subidas por bloques que dejó a medias no se completarán
+            # (las reanudables esperan a que otra conexión las reanude)
+            self.abort_client_uploads(client_socket)
             client_socket.close()
     
+    def dispatch_message(self, client_socket: socket.socket, message: dict):
+        """Despacha un mensaje recibido a su manejador"""
+        msg_type = MessageType(message["type"])
+        data = message.get("data", {})
+        
+        if msg_type == MessageType.NODE_REGISTER:
+            self.handle_node_register(client_socket, data)
+        elif msg_type == MessageType.NODE_HEARTBEAT:
+            self.handle_node_heartbeat(data)
+        elif msg_type == MessageType.BLOCK_STORED:
+            self.handle_block_stored(data)
+        elif msg_type == MessageType.BLOCK_CORRUPTED:
+            self.handle_block_corrupted(data)
+        elif msg_type == MessageType.INVENTORY_DIGEST:
+            self.handle_inventory_digest(client_socket, data)
+        elif msg_type == MessageType.UPLOAD_FILE:
+            self.handle_upload_file(client_socket, data)
+        elif msg_type == MessageType.UPLOAD_BEGIN:
+            self.handle_upload_begin(client_socket, data)
+        elif msg_type == MessageType.UPLOAD_BLOCK:
+            self.handle_upload_block(client_socket, data)
+        elif msg_type == MessageType.UPLOAD_COMMIT:
+            self.handle_upload_commit(client_socket, data)
+        elif msg_type == MessageType.UPLOAD_ABORT:
+            self.handle_upload_abort(client_socket, data)
+        elif msg_type == MessageType.UPLOAD_RESUME:
+            self.handle_upload_resume(client_socket, data)
+        elif msg_type == MessageType.DOWNLOAD_FILE:
+            self.handle_download_file(client_socket, data)
+        elif msg_type == MessageType.DOWNLOAD_BLOCK:
+            self.handle_download_block(client_socket, data)
+        elif msg_type == MessageType.DELETE_FILE:
+            self.handle_delete_file(client_socket, data)
+        elif msg_type == MessageType.LIST_FILES:
+            self.handle_list_files(client_socket, data)
+        elif msg_type == MessageType.GET_FILE_INFO:
+            self.handle_get_file_info(client_socket, data)
+        elif msg_type == MessageType.GET_BLOCK_TABLE:
+            self.handle_get_block_table(client_socket, data)
+        elif msg_type == MessageType.GET_ACTIVE_NODES:
+            self.handle_get_active_nodes(client_socket)
+        elif msg_type == MessageType.GET_METRICS:
+            self.handle_get_metrics(client_socket)
+        elif msg_type == MessageType.SUBSCRIBE_EVENTS:
+            self.handle_subscribe_events(client_socket, data)
+    
+    def send_busy(self, client_socket: socket.socket):
+        """Rechaza una petición por falta de capacidad indicando cuándo reintentar"""
+        retry_after = self.admission.retry_after()
+        send_message(client_socket, MessageType.ERROR, {
+            "message": f"Coordinador ocupado, reintente en {retry_after} s",
+            "retry_after": retry_after
+        })
+    
     def handle_node_register(self, client_socket: socket.socket, data: dict):
         """Registra un nuevo nodo"""
         requested_node_id = data.get("node_id")  # Puede ser None o vacío
@@ -262,8 +612,18 @@ class Coordinator:
         # Crear clave única para identificar el nodo por su dirección
         node_key = f"{address}:{port}"
         
-        # Determinar el ID del nodo
-        with self.node_lock:
+        # Desempaquetar el inventario de bloques fuera del lock, así los
+        # reportes de varios nodos se decodifican en paralelo
+        block_report = {}
+        if data.get("block_report"):
+            try:
+                block_report = unpack_block_report(data["block_report"])
+            except Exception as e:
+                print(f"Reporte de bloques inválido desde {node_key}: {e}")
+        
+        # Determinar el ID del nodo y actualizar el mapa de nodos (sección exclusiva breve)
+        new_registration = False
+        with self.node_lock.write():
             # Si el nodo ya está registrado (reconexión), usar su ID anterior
             if node_key in self.node_registry:
                 node_id = self.node_registry[node_key]
@@ -272,22 +632,27 @@ class Coordinator:
             elif requested_node_id and requested_node_id not in self.nodes:
                 node_id = requested_node_id
                 self.node_registry[node_key] = node_id
+                new_registration = True
             # Si no, asignar un ID automático (nodo1, nodo2, etc.)
             else:
                 node_id = f"nodo{self.next_node_number}"
                 self.next_node_number += 1
                 self.node_registry[node_key] = node_id
+                new_registration = True
                 print(f"Nuevo nodo asignado: {node_id}")
             
-            # Si el nodo ya existe pero está desconectado, actualizar su información
+            # Si el nodo ya existe pero está desconectado, actualizar su información.
+            # El socket se publica después de enviar REGISTER_RESPONSE para que
+            # ninguna notificación llegue al nodo antes que la respuesta
             if node_id in self.nodes:
-                old_node = self.nodes[node_id]
+                node_info = self.nodes[node_id]
                 # Actualizar información del nodo
-                old_node.address = address
-                old_node.port = port
-                old_node.shared_space_size = shared_space_size
-                old_node.last_heartbeat = time.time()
-                old_node.socket = client_socket
+                node_info.address = address
+                node_info.port = port
+                node_info.shared_space_size = shared_space_size
+                node_info.last_heartbeat = time.time()
+                node_info.suspected = False
+                node_info.socket = None
             else:
                 # Crear nuevo nodo
                 node_info = NodeInfo(
@@ -295,54 +660,101 @@ class Coordinator:
                     address=address,
                     port=port,
                     shared_space_size=shared_space_size,
-                    last_heartbeat=time.time(),
-                    socket=client_socket
+                    last_heartbeat=time.time()
                 )
                 self.nodes[node_id] = node_info
             
-            # Guardar estado
-            self.save_state()
-            
-            # Reconstruir tabla de bloques
             total_blocks = sum(node.shared_space_size // BLOCK_SIZE 
                               for node in self.nodes.values() if node.is_alive())
-            
-            if total_blocks > 0:
-                if self.block_table is None:
-                    self.block_table = BlockTable(total_blocks)
-                else:
-                    # Extender tabla si es necesario
-                    current_total = self.block_table.total_blocks
-                    if total_blocks > current_total:
-                        # En producción, se necesitaría una mejor estrategia
-                        self.block_table = BlockTable(total_blocks)
-            
-            print(f"Nodo {node_id} registrado desde {address}:{port} con {shared_space_size} bytes")
-            
+            # Vista inicial de los demás nodos; después llegan como eventos
+            peers = {other_id: [other.address, other.port] for other_id, other in self.nodes.items()
+                     if other_id != node_id and other.is_alive()}
+        
+        # Empezar a vigilar sus heartbeats
+        self.failure_detector.heartbeat(node_id)
+        
+        # Extender la tabla conservando las asignaciones existentes (lock de la tabla)
+        self.block_table.resize(total_blocks)
+        
+        # Incorporar el inventario reportado por el nodo
+        if block_report:
+            with self.files_lock:
+                known_files = set(self.files) | set(self.upload_sessions) | self.packer.pack_ids()
+            assigned, stale = self.block_table.merge_block_report(node_id, block_report, known_files)
+            for block_id, file_id, block_number, is_replica in assigned:
+                self.log_mutation({"op": "move_block", "block_id": block_id, "node_id": node_id,
+                                   "is_replica": is_replica, "file_id": file_id,
+                                   "block_number": block_number}, wait=False)
+            # Copias desfasadas (p. ej. de un paquete que creció mientras el nodo no estaba)
+            for block_id, is_replica in stale:
+                self.handle_corrupt_copy(block_id, node_id, is_replica)
+            print(f"Inventario de {node_id}: {len(assigned)} copias incorporadas, {len(stale)} desfasadas")
+        
+        print(f"Nodo {node_id} registrado desde {address}:{port} con {shared_space_size} bytes")
+        
+        with node_info.send_lock:
             send_message(client_socket, MessageType.REGISTER_RESPONSE, {
                 "success": True,
                 "node_id": node_id,  # Enviar el ID asignado al nodo
-                "total_blocks": total_blocks,
-                "block_table": self.block_table.to_dict() if self.block_table else {}
+                "total_blocks": self.block_table.total_blocks,
+                "peers": peers
             })
+            node_info.socket = client_socket
         
-        # Notificar a otros nodos
-        self.notify_all_nodes({
-            "type": "NODE_REGISTERED",
-            "node_id": node_id
+        # Suscribir el nodo sólo a los temas que pide
+        self.events.subscribe(
+            node_id,
+            lambda message, node_info=node_info: self.send_to_node_socket(
+                node_info, MessageType.CLUSTER_EVENTS, message),
+            data.get("subscriptions", []))
+        
+        # Registrar la asignación de ID fuera del lock
+        if new_registration:
+            self.log_mutation({"op": "register_node", "node_key": node_key, "node_id": node_id})
+        
+        # Notificar a los suscriptores
+        self.events.publish("nodes", "node_joined", node_id, {
+            "node_id": node_id, "address": address, "port": port
         })
+        
+        # Un nodo nuevo aporta capacidad vacía: repartir bloques hacia él
+        self.rebalancer.trigger()
     
     def handle_node_heartbeat(self, data: dict):
         """Procesa heartbeat de un nodo"""
         node_id = data.get("node_id")
-        with self.node_lock:
-            if node_id in self.nodes:
-                self.nodes[node_id].last_heartbeat = time.time()
+        with self.node_lock.read():
+            node_info = self.nodes.get(node_id)
+            if not node_info:
+                return
+            node_info.last_heartbeat = time.time()
+            node_info.used_space = data.get("used_space", node_info.used_space)
+            node_info.free_space = data.get("free_space", node_info.free_space)
+            node_info.load = data.get("load", node_info.load)
+            node_info.disk_latency_ms = data.get("disk_latency_ms", node_info.disk_latency_ms)
+            io_errors = data.get("io_errors", node_info.io_errors)
+            checksum_errors = data.get("checksum_errors", node_info.checksum_errors)
+            node_info.new_errors = max(0, io_errors - node_info.io_errors) + \
+                max(0, checksum_errors - node_info.checksum_errors)
+            node_info.io_errors = io_errors
+            node_info.checksum_errors = checksum_errors
+        
+        self.failure_detector.heartbeat(node_id)
     
     def handle_block_stored(self, data: dict):
-        """Confirma que un bloque fue almacenado"""
-        # Puede usarse para verificación
-        pass
+        """Confirma que un bloque fue almacenado (mensaje individual de nodos antiguos)"""
+        self.mark_blocks_stored(data.get("node_id"), [{
+            "block_id": data.get("block_id"),
+            "is_replica": data.get("is_replica", False),
+            "stored": True
+        }])
+    
+    def mark_blocks_stored(self, node_id: str, results: list):
+        """Marca como persistidas las copias confirmadas en la respuesta de un lote"""
+        for result in results:
+            if result.get("stored"):
+                self.block_table.mark_block_stored(result.get("block_id"), node_id,
+                                                   result.get("is_replica", False))
     
     def handle_upload_file(self, client_socket: socket.socket, data: dict):
         """Maneja la subida de un archivo"""
@@ -360,9 +772,7 @@ class Coordinator:
         num_blocks = (file_size + BLOCK_SIZE - 1) // BLOCK_SIZE
         
         # Obtener nodos activos
-        with self.node_lock:
-            active_nodes = [node_id for node_id, node_info in self.nodes.items() 
-                           if node_info.is_alive()]
+        active_nodes, node_loads = self.get_upload_nodes()
         
         if len(active_nodes) < 2:
             send_message(client_socket, MessageType.ERROR, {
@@ -371,28 +781,61 @@ class Coordinator:
             return
         
         # Generar ID único para el archivo
-        file_id = f"{filename}_{int(time.time())}"
+        file_id = self.reserve_file_id(filename)
         
         try:
+            if self.packer.accepts(file_size):
+                # Archivo pequeño: se añade a un paquete en lugar de ocupar un bloque propio
+                if not self.store_packed_file(file_id, filename, base64.b64decode(file_data)):
+                    send_message(client_socket, MessageType.ERROR, {
+                        "message": "Ningún nodo confirmó el archivo"
+                    })
+                    return
+                send_message(client_socket, MessageType.UPLOAD_RESPONSE, {
+                    "success": True,
+                    "file_id": file_id,
+                    "message": "Archivo subido exitosamente"
+                })
+                return
+            
             # Asignar bloques
-            allocated = self.block_table.allocate_blocks(file_id, num_blocks, active_nodes)
+            allocated = self.block_table.allocate_blocks(file_id, num_blocks, active_nodes, node_loads)
+            
+            # Dividir el archivo y registrar el checksum de cada bloque
+            file_bytes = base64.b64decode(file_data)
+            blocks = split_file_into_blocks_from_bytes(file_bytes, BLOCK_SIZE)
+            checksums = [calculate_checksum(block_data) for _, block_data in blocks]
+            self.block_table.set_checksums({block_id: checksums[i]
+                                            for i, (block_id, _, _) in enumerate(allocated)
+                                            if i < len(checksums)})
             
             # Guardar información del archivo
+            file_info = FileInfo(
+                file_id=file_id,
+                filename=filename,
+                size=file_size,
+                upload_date=datetime.now().isoformat(),
+                num_blocks=num_blocks
+            )
             with self.files_lock:
-                self.files[file_id] = FileInfo(
-                    file_id=file_id,
-                    filename=filename,
-                    size=file_size,
-                    upload_date=datetime.now().isoformat(),
-                    num_blocks=num_blocks
-                )
+                self.add_file_info(file_info)
+                self.uploading.discard(file_id)
             
-            self.save_state()
+            self.log_mutation({
+                "op": "add_file",
+                "file": file_info.to_dict(),
+                "blocks": [[block_id, i, node_id, replica_node_id,
+                            checksums[i] if i < len(checksums) else None]
+                           for i, (block_id, node_id, replica_node_id) in enumerate(allocated)]
+            })
+            self.events.publish("files", "file_added", file_id, {"file": file_info.to_dict()})
+            self.events.publish("blocks", "blocks_assigned", f"file:{file_id}", {
+                "file_id": file_id,
+                "blocks": [[block_id, node_id, replica_node_id]
+                           for block_id, node_id, replica_node_id in allocated]
+            })
             
             # Enviar instrucciones a los nodos para almacenar bloques
-            import base64
-            file_bytes = base64.b64decode(file_data)
-            blocks = split_file_into_blocks_from_bytes(file_bytes, BLOCK_SIZE)
             
             # Distribuir bloques a nodos
             block_assignments = {}
@@ -408,121 +851,516 @@ class Coordinator:
                         "block_id": block_id,
                         "file_id": file_id,
                         "block_number": i,
-                        "block_data": base64.b64encode(block_data).decode('utf-8')
+                        "block_data": base64.b64encode(block_data).decode('utf-8'),
+                        "checksum": checksums[i]
                     })
                     block_assignments[replica_node_id].append({
                         "block_id": block_id,
                         "file_id": file_id,
                         "block_number": i,
                         "block_data": base64.b64encode(block_data).decode('utf-8'),
+                        "checksum": checksums[i],
                         "is_replica": True
                     })
             
             # Enviar bloques a nodos
-            for node_id, assignments in block_assignments.items():
-                if node_id in self.nodes and self.nodes[node_id].is_alive():
-                    node_info = self.nodes[node_id]
-                    try:
-                        # Conectar al puerto listener del nodo
-                        node_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        node_socket.settimeout(10)
-                        node_socket.connect((node_info.address, node_info.port))
-                        
-                        send_message(node_socket, MessageType.STORE_BLOCK, {
-                            "blocks": assignments
-                        })
-                        
-                        # Esperar confirmación
-                        response = receive_message(node_socket)
-                        node_socket.close()
-                    except Exception as e:
-                        print(f"Error enviando bloques al nodo {node_id}: {e}")
+            self.store_block_assignments(block_assignments)
+            
+            # Cada bloque necesita al menos una copia confirmada
+            missing = [entry.block_number for entry in self.block_table.get_file_blocks(file_id)
+                       if not entry.node_durable and not entry.replica_durable]
+            if missing:
+                freed = self.block_table.free_blocks(file_id)
+                # Las copias que sí llegaron a algún nodo quedarían huérfanas
+                for block_entry in freed:
+                    for node_id in [block_entry.node_id, block_entry.replica_node_id]:
+                        self.garbage_collector.enqueue(node_id, block_entry.block_id, file_id)
+                with self.files_lock:
+                    self.remove_file_info(file_id)
+                self.log_mutation({"op": "delete_file", "file_id": file_id})
+                self.publish_file_deleted(file_id, [block_entry.block_id for block_entry in freed])
+                send_message(client_socket, MessageType.ERROR, {
+                    "message": f"Ningún nodo confirmó {len(missing)} bloque(s) del archivo"
+                })
+                return
             
             send_message(client_socket, MessageType.UPLOAD_RESPONSE, {
                 "success": True,
                 "file_id": file_id,
                 "message": "Archivo subido exitosamente"
             })
-            
+        
         except Exception as e:
             send_message(client_socket, MessageType.ERROR, {
                 "message": f"Error subiendo archivo: {str(e)}"
             })
+        finally:
+            with self.files_lock:
+                self.uploading.discard(file_id)
+    
+    def get_upload_nodes(self):
+        """Retorna (nodos activos, carga de cada uno) para colocar bloques nuevos"""
+        with self.node_lock.read():
+            active_nodes = [node_id for node_id, node_info in self.nodes.items() 
+                           if node_info.is_alive()]
+            node_loads = {node_id: self.nodes[node_id].to_load() for node_id in active_nodes}
+        return active_nodes, node_loads
+    
+    def store_block_assignments(self, block_assignments: Dict[str, list]) -> set:
+        """
+        Envía a cada nodo su lote STORE_BLOCK y marca las copias que confirma
+        Retorna las copias confirmadas como (node_id, block_id, is_replica)
+        """
+        confirmed = set()
+        for node_id, assignments in block_assignments.items():
+            if node_id in self.nodes and self.nodes[node_id].is_alive():
+                node_info = self.nodes[node_id]
+                try:
+                    # Conectar al puerto listener del nodo
+                    node_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    node_socket.settimeout(10)
+                    node_socket.connect((node_info.address, node_info.port))
+                    
+                    send_message(node_socket, MessageType.STORE_BLOCK, {
+                        "blocks": assignments
+                    })
+                    
+                    # Esperar confirmación del lote con el resultado de cada bloque
+                    response = receive_message(node_socket)
+                    node_socket.close()
+                    if response and response.get("type") == MessageType.SUCCESS.value:
+                        results = response.get("data", {}).get("results", [])
+                        self.mark_blocks_stored(node_id, results)
+                        confirmed.update((node_id, result.get("block_id"), result.get("is_replica", False))
+                                         for result in results if result.get("stored"))
+                except Exception as e:
+                    print(f"Error enviando bloques al nodo {node_id}: {e}")
+        return confirmed
+    
+    def store_packed_file(self, file_id: str, filename: str, file_bytes: bytes,
+                          upload_id: str = "") -> Optional[FileInfo]:
+        """
+        Añade un archivo pequeño al paquete abierto y lo registra
+        upload_id es el de la subida reanudable que lo confirma, si la hay.
+        Retorna None si ningún nodo confirmó los datos; lanza ValueError si
+        no se pudo abrir un paquete
+        """
+        location = self.packer.store(file_bytes)
+        if location is None:
+            return None
+        pack_id, offset, block_checksum = location
+        file_info = FileInfo(
+            file_id=file_id,
+            filename=filename,
+            size=len(file_bytes),
+            upload_date=datetime.now().isoformat(),
+            num_blocks=1,
+            pack_id=pack_id,
+            pack_offset=offset,
+            pack_checksum=calculate_checksum(file_bytes)
+        )
+        with self.files_lock:
+            self.upload_sessions.pop(file_id, None)
+            self.add_file_info(file_info)
+            self.packer.attach(file_info)
+            self.uploading.discard(file_id)
+            if upload_id:
+                self.completed_uploads[file_id] = (upload_id, time.time())
+        
+        self.log_mutation({
+            "op": "add_file",
+            "file": file_info.to_dict(),
+            "blocks": [],
+            "pack_block_checksum": block_checksum,
+            "upload_id": upload_id
+        })
+        self.events.publish("files", "file_added", file_id, {"file": file_info.to_dict()})
+        return file_info
+    
+    def handle_upload_begin(self, client_socket: socket.socket, data: dict):
+        """
+        Inicia una subida por bloques: reserva el file_id y asigna los bloques
+        El cliente envía después cada bloque con UPLOAD_BLOCK y termina con
+        UPLOAD_COMMIT, de modo que nunca hay más de un bloque en memoria
+        Con resumable la subida se registra en el log de metadatos y recibe
+        un upload_id: si se corta la conexión o se reinicia el coordinador,
+        el cliente la recupera con UPLOAD_RESUME y envía sólo los bloques
+        que faltan
+        """
+        filename = data.get("filename")
+        file_size = data.get("size")
+        resumable = bool(data.get("resumable"))
+        
+        if not filename or not file_size:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": "Datos incompletos"
+            })
+            return
+        
+        # Un archivo pequeño no reserva bloques: va a un paquete al confirmar
+        packed = self.packer.accepts(file_size)
+        num_blocks = 1 if packed else (file_size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        active_nodes, node_loads = self.get_upload_nodes()
+        if len(active_nodes) < 2:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": "Se necesitan al menos 2 nodos activos"
+            })
+            return
+        
+        file_id = self.reserve_file_id(filename)
+        allocated = []
+        try:
+            if not packed:
+                allocated = self.block_table.allocate_blocks(file_id, num_blocks, active_nodes, node_loads)
+        except Exception as e:
+            with self.files_lock:
+                self.uploading.discard(file_id)
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Error subiendo archivo: {str(e)}"
+            })
+            return
+        
+        session = UploadSession(file_id, filename, file_size, allocated, owner=client_socket,
+                                upload_id=secrets.token_urlsafe(16) if resumable else "",
+                                resumable=resumable, packed=packed)
+        with self.files_lock:
+            self.upload_sessions[file_id] = session
+        if resumable:
+            # El cliente sólo recibe el upload_id cuando la sesión ya es persistente
+            self.log_mutation({"op": "begin_upload", "session": session.to_dict()})
+        
+        response = {
+            "file_id": file_id,
+            "num_blocks": num_blocks,
+            "block_size": BLOCK_SIZE
+        }
+        if resumable:
+            response["upload_id"] = session.upload_id
+        send_message(client_socket, MessageType.SUCCESS, response)
+    
+    def handle_upload_resume(self, client_socket: socket.socket, data: dict):
+        """
+        Reanuda una subida reanudable desde otra conexión
+        Responde los números de bloque que faltan por confirmar; la conexión
+        pasa a ser la dueña de la subida. Si la subida ya se confirmó (el
+        cliente perdió la respuesta del commit) responde committed con el
+        file_id del archivo, para que no la vuelva a empezar
+        """
+        file_id = data.get("file_id")
+        upload_id = str(data.get("upload_id", ""))
+        with self.files_lock:
+            session = self.upload_sessions.get(file_id)
+            found = bool(session and session.resumable and
+                         secrets.compare_digest(session.upload_id, upload_id))
+            if found:
+                session.owner = client_socket
+                session.last_activity = time.time()
+                missing = [number for number in range(session.num_blocks)
+                           if number not in session.checksums]
+            completed = None if found else self.completed_uploads.get(file_id)
+            committed = bool(completed and file_id in self.files and
+                             secrets.compare_digest(completed[0], upload_id))
+        if committed:
+            send_message(client_socket, MessageType.SUCCESS, {
+                "file_id": file_id,
+                "upload_id": upload_id,
+                "committed": True,
+                "missing": []
+            })
+            return
+        if not found:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": "Subida no encontrada"
+            })
+            return
+        send_message(client_socket, MessageType.SUCCESS, {
+            "file_id": file_id,
+            "upload_id": session.upload_id,
+            "filename": session.filename,
+            "size": session.size,
+            "num_blocks": session.num_blocks,
+            "block_size": BLOCK_SIZE,
+            "missing": missing
+        })
+    
+    def get_upload_session(self, client_socket: socket.socket, file_id: str) -> Optional[UploadSession]:
+        """Sesión de subida iniciada por esta conexión (responde con error si no existe)"""
+        with self.files_lock:
+            session = self.upload_sessions.get(file_id)
+        if not session or session.owner is not client_socket:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": "Subida no encontrada"
+            })
+            return None
+        session.last_activity = time.time()
+        return session
+    
+    def handle_upload_block(self, client_socket: socket.socket, data: dict):
+        """Recibe un bloque de una subida y lo almacena en sus dos nodos"""
+        session = self.get_upload_session(client_socket, data.get("file_id"))
+        if not session:
+            return
+        block_number = data.get("block_number")
+        if not isinstance(block_number, int) or not 0 <= block_number < session.num_blocks:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Número de bloque inválido: {block_number}"
+            })
+            return
+        
+        # Todos los bloques ocupan BLOCK_SIZE salvo el último
+        block_data = data.get("block_data", "")
+        block_bytes = base64.b64decode(block_data)
+        expected_size = min(BLOCK_SIZE, session.size - block_number * BLOCK_SIZE)
+        if len(block_bytes) != expected_size:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"El bloque {block_number} mide {len(block_bytes)} bytes, se esperaban {expected_size}"
+            })
+            return
+        checksum = calculate_checksum(block_bytes)
+        if session.packed:
+            # Se guarda en su paquete en el commit; tras un reinicio se vuelve a pedir
+            session.packed_data = block_bytes
+            session.checksums[block_number] = checksum
+            send_message(client_socket, MessageType.SUCCESS, {
+                "file_id": session.file_id,
+                "block_number": block_number
+            })
+            return
+        del block_bytes
+        
+        # Los nodos reciben el mismo base64 que envió el cliente
+        block_id, node_id, replica_node_id = session.allocated[block_number]
+        block_info = {
+            "block_id": block_id,
+            "file_id": session.file_id,
+            "block_number": block_number,
+            "block_data": block_data,
+            "checksum": checksum
+        }
+        self.store_block_assignments({
+            node_id: [block_info],
+            replica_node_id: [{**block_info, "is_replica": True}]
+        })
+        
+        block_entry = self.block_table.get_block_info(block_id)
+        stored = bool(block_entry and (block_entry.node_durable or block_entry.replica_durable))
+        if not stored:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Ningún nodo confirmó el bloque {block_number} del archivo"
+            })
+            return
+        session.checksums[block_number] = checksum
+        if session.resumable:
+            # Sin esperar al disco: si el registro se pierde, el bloque se vuelve a pedir al reanudar
+            self.log_mutation({"op": "upload_block", "file_id": session.file_id,
+                               "block_number": block_number, "checksum": checksum}, wait=False)
+        send_message(client_socket, MessageType.SUCCESS, {
+            "file_id": session.file_id,
+            "block_number": block_number
+        })
+    
+    def handle_upload_commit(self, client_socket: socket.socket, data: dict):
+        """Registra el archivo de una subida por bloques cuando están todos almacenados"""
+        session = self.get_upload_session(client_socket, data.get("file_id"))
+        if not session:
+            return
+        missing = [i for i in range(session.num_blocks) if i not in session.checksums]
+        if missing:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Faltan {len(missing)} bloque(s) del archivo"
+            })
+            return
+        
+        file_id = session.file_id
+        if session.packed:
+            try:
+                file_info = self.store_packed_file(file_id, session.filename, session.packed_data,
+                                                   session.upload_id)
+            except ValueError as e:
+                file_info = None
+                print(f"Error empaquetando {file_id}: {e}")
+            if not file_info:
+                send_message(client_socket, MessageType.ERROR, {
+                    "message": "Ningún nodo confirmó el archivo"
+                })
+                return
+            send_message(client_socket, MessageType.UPLOAD_RESPONSE, {
+                "success": True,
+                "file_id": file_id,
+                "message": "Archivo subido exitosamente"
+            })
+            return
+        
+        self.block_table.set_checksums({block_id: session.checksums[i]
+                                        for i, (block_id, _, _) in enumerate(session.allocated)})
+        file_info = FileInfo(
+            file_id=file_id,
+            filename=session.filename,
+            size=session.size,
+            upload_date=datetime.now().isoformat(),
+            num_blocks=len(session.allocated)
+        )
+        with self.files_lock:
+            self.upload_sessions.pop(file_id, None)
+            self.add_file_info(file_info)
+            self.uploading.discard(file_id)
+            if session.upload_id:
+                self.completed_uploads[file_id] = (session.upload_id, time.time())
+        
+        self.log_mutation({
+            "op": "add_file",
+            "file": file_info.to_dict(),
+            "blocks": [[block_id, i, node_id, replica_node_id, session.checksums[i]]
+                       for i, (block_id, node_id, replica_node_id) in enumerate(session.allocated)],
+            "upload_id": session.upload_id
+        })
+        self.events.publish("files", "file_added", file_id, {"file": file_info.to_dict()})
+        self.events.publish("blocks", "blocks_assigned", f"file:{file_id}", {
+            "file_id": file_id,
+            "blocks": [[block_id, node_id, replica_node_id]
+                       for block_id, node_id, replica_node_id in session.allocated]
+        })
+        
+        send_message(client_socket, MessageType.UPLOAD_RESPONSE, {
+            "success": True,
+            "file_id": file_id,
+            "message": "Archivo subido exitosamente"
+        })
+    
+    def handle_upload_abort(self, client_socket: socket.socket, data: dict):
+        """Cancela una subida por bloques"""
+        session = self.get_upload_session(client_socket, data.get("file_id"))
+        if not session:
+            return
+        self.abort_upload(session)
+        send_message(client_socket, MessageType.SUCCESS, {"file_id": session.file_id})
+    
+    def abort_upload(self, session: UploadSession, idle_since: Optional[float] = None) -> bool:
+        """
+        Libera los bloques de una subida sin completar y borra las copias ya enviadas
+        Con idle_since sólo la cancela si sigue sin dueño y sin actividad desde entonces
+        Retorna si la subida se canceló
+        """
+        with self.files_lock:
+            if idle_since is not None and (session.owner is not None or session.last_activity >= idle_since):
+                return False
+            if self.upload_sessions.pop(session.file_id, None) is None:
+                return False
+            self.uploading.discard(session.file_id)
+        if session.resumable:
+            self.log_mutation({"op": "abort_upload", "file_id": session.file_id})
+        freed = self.block_table.free_blocks(session.file_id)
+        for block_entry in freed:
+            for node_id in [block_entry.node_id, block_entry.replica_node_id]:
+                self.garbage_collector.enqueue(node_id, block_entry.block_id, session.file_id)
+        return True
+    
+    def abort_client_uploads(self, client_socket: socket.socket):
+        """
+        Cancela las subidas por bloques de una conexión que se cerró
+        Las reanudables sólo se sueltan: caducan tras UPLOAD_SESSION_TTL sin reanudarse
+        """
+        with self.files_lock:
+            sessions = [session for session in self.upload_sessions.values()
+                        if session.owner is client_socket]
+            for session in sessions:
+                if session.resumable:
+                    session.owner = None
+                    session.last_activity = time.time()
+        for session in sessions:
+            if not session.resumable:
+                self.abort_upload(session)
+    
+    def expire_uploads_loop(self):
+        """Cancela las subidas reanudables que nadie reanudó a tiempo y olvida las ya confirmadas"""
+        while self.running:
+            time.sleep(UPLOAD_SESSION_CHECK_INTERVAL)
+            cutoff = time.time() - UPLOAD_SESSION_TTL
+            with self.files_lock:
+                expired = [session for session in self.upload_sessions.values()
+                           if session.owner is None and session.last_activity < cutoff]
+                for file_id in [fid for fid, (_, committed_at) in self.completed_uploads.items()
+                                if committed_at < cutoff]:
+                    del self.completed_uploads[file_id]
+            for session in expired:
+                if self.abort_upload(session, idle_since=cutoff):
+                    print(f"Subida {session.file_id} caducada sin reanudarse")
+    
+    def add_file_info(self, file_info: FileInfo):
+        """Registra un archivo y lo añade a los índices (con files_lock tomado)"""
+        self.files[file_info.file_id] = file_info
+        self.file_index.add(file_info)
+        self.files_version += 1
+    
+    def remove_file_info(self, file_id: str) -> Optional[FileInfo]:
+        """Quita un archivo y sus entradas de los índices (con files_lock tomado)"""
+        file_info = self.files.pop(file_id, None)
+        if file_info:
+            self.file_index.remove(file_info)
+            self.files_version += 1
+        return file_info
+    
+    def reserve_file_id(self, filename: str) -> str:
+        """Genera un file_id que no usa ningún archivo ni otra subida en curso"""
+        base_id = f"{filename}_{int(time.time())}"
+        with self.files_lock:
+            file_id = base_id
+            suffix = 1
+            while file_id in self.files or file_id in self.uploading or self.packer.is_pack(file_id):
+                file_id = f"{base_id}_{suffix}"
+                suffix += 1
+            self.uploading.add(file_id)
+        return file_id
     
     def handle_download_file(self, client_socket: socket.socket, data: dict):
         """Maneja la descarga de un archivo"""
         file_id = data.get("file_id")
         
-        if file_id not in self.files:
+        file_info = self.files.get(file_id)
+        if not file_info:
             send_message(client_socket, MessageType.ERROR, {
                 "message": "Archivo no encontrado"
             })
             return
         
-        file_info = self.files[file_id]
+        # La respuesta lleva el archivo completo en base64: reservar su memoria
+        ticket = None
+        if file_info.size >= ADMISSION_MIN_BYTES:
+            client = client_socket.getpeername()[0]
+            ticket = self.admission.acquire(client, file_info.size * ADMISSION_MEMORY_FACTOR)
+            if ticket is None:
+                self.send_busy(client_socket)
+                return
+        try:
+            self.send_download(client_socket, file_info)
+        finally:
+            if ticket:
+                self.admission.release(ticket)
+    
+    def send_download(self, client_socket: socket.socket, file_info: FileInfo):
+        """Reúne los bloques de un archivo y los envía al cliente"""
+        file_id = file_info.file_id
         blocks_info = self.block_table.get_file_blocks(file_id)
         
-        # Obtener bloques de los nodos
+        # Obtener bloques de los nodos (principal o réplica, verificados)
         blocks_data = {}
+        if file_info.pack_id:
+            # Archivo empaquetado: un único bloque con su fragmento del paquete
+            blocks_data[0] = self.packer.read(file_info)
+            if blocks_data[0] is None:
+                send_message(client_socket, MessageType.ERROR, {
+                    "message": "No se pudo recuperar el archivo de su paquete"
+                })
+                return
         for block_entry in blocks_info:
             block_num = block_entry.block_number
-            block_retrieved = False
-            
-            # Intentar obtener del nodo principal primero
-            node_id = block_entry.node_id
-            if node_id in self.nodes and self.nodes[node_id].is_alive():
-                node_info = self.nodes[node_id]
-                try:
-                    # Conectar al puerto listener del nodo
-                    node_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    node_socket.settimeout(5)
-                    node_socket.connect((node_info.address, node_info.port))
-                    
-                    send_message(node_socket, MessageType.RETRIEVE_BLOCK, {
-                        "block_id": block_entry.block_id,
-                        "file_id": file_id,
-                        "block_number": block_num
-                    })
-                    
-                    response = receive_message(node_socket)
-                    node_socket.close()
-                    
-                    if response and response.get("type") == MessageType.BLOCK_RETRIEVED.value:
-                        blocks_data[block_num] = response.get("data", {}).get("block_data")
-                        block_retrieved = True
-                except Exception as e:
-                    print(f"Error obteniendo bloque {block_entry.block_id} del nodo {node_id}: {e}")
-            
-            # Si falla, intentar con la réplica
-            if not block_retrieved:
-                replica_id = block_entry.replica_node_id
-                if replica_id and replica_id in self.nodes and self.nodes[replica_id].is_alive():
-                    replica_info = self.nodes[replica_id]
-                    try:
-                        node_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        node_socket.settimeout(5)
-                        node_socket.connect((replica_info.address, replica_info.port))
-                        
-                        send_message(node_socket, MessageType.RETRIEVE_BLOCK, {
-                            "block_id": block_entry.block_id,
-                            "file_id": file_id,
-                            "block_number": block_num
-                        })
-                        
-                        response = receive_message(node_socket)
-                        node_socket.close()
-                        
-                        if response and response.get("type") == MessageType.BLOCK_RETRIEVED.value:
-                            blocks_data[block_num] = response.get("data", {}).get("block_data")
-                            block_retrieved = True
-                    except Exception as e:
-                        print(f"Error obteniendo bloque {block_entry.block_id} de réplica {replica_id}: {e}")
-            
-            if not block_retrieved:
+            block_data = self.fetch_block(block_entry)
+            if block_data is None:
                 send_message(client_socket, MessageType.ERROR, {
                     "message": f"No se pudo recuperar el bloque {block_num} del archivo"
                 })
                 return
+            blocks_data[block_num] = block_data
         
         # Enviar bloques al cliente
         send_message(client_socket, MessageType.DOWNLOAD_RESPONSE, {
@@ -532,59 +1370,253 @@ class Coordinator:
             "blocks": blocks_data
         })
     
-    def handle_delete_file(self, client_socket: socket.socket, data: dict):
-        """Maneja la eliminación de un archivo"""
+    def handle_download_block(self, client_socket: socket.socket, data: dict):
+        """
+        Envía un único bloque de un archivo
+        Permite descargas en streaming: el cliente pide los bloques de uno en
+        uno y nunca hay más de uno en memoria
+        """
         file_id = data.get("file_id")
+        block_number = data.get("block_number")
         
-        if file_id not in self.files:
+        file_info = self.files.get(file_id)
+        block_entry = None
+        if file_info and isinstance(block_number, int):
+            # Un archivo empaquetado tiene como único bloque el de su paquete
+            block_entry = self.block_table.get_file_block(file_info.pack_id or file_id, block_number)
+        if not block_entry:
             send_message(client_socket, MessageType.ERROR, {
-                "message": "Archivo no encontrado"
+                "message": "Archivo no encontrado" if not file_info else f"Bloque {block_number} no encontrado"
+            })
+            return
+        
+        block_size = min(BLOCK_SIZE, file_info.size - block_number * BLOCK_SIZE)
+        ticket = None
+        if block_size >= ADMISSION_MIN_BYTES:
+            client = client_socket.getpeername()[0]
+            ticket = self.admission.acquire(client, block_size * ADMISSION_MEMORY_FACTOR)
+            if ticket is None:
+                self.send_busy(client_socket)
+                return
+        try:
+            block_data = self.packer.read(file_info) if file_info.pack_id else self.fetch_block(block_entry)
+            if block_data is None:
+                send_message(client_socket, MessageType.ERROR, {
+                    "message": f"No se pudo recuperar el bloque {block_number} del archivo"
+                })
+                return
+            send_message(client_socket, MessageType.DOWNLOAD_RESPONSE, {
+                "success": True,
+                "file_id": file_id,
+                "block_number": block_number,
+                "block_data": block_data
             })
+        finally:
+            if ticket:
+                self.admission.release(ticket)
+    
+    def send_node_request(self, node_id: str, msg_type: MessageType, data: dict, timeout: float = 5):
+        """Envía una petición al puerto listener de un nodo y retorna su respuesta"""
+        node_info = self.nodes.get(node_id)
+        if not node_info or not node_info.is_alive():
+            return None
+        node_socket = socket.create_connection((node_info.address, node_info.port), timeout=timeout)
+        try:
+            send_message(node_socket, msg_type, data)
+            return receive_message(node_socket)
+        finally:
+            node_socket.close()
+    
+    def order_copies(self, block_entry) -> List[tuple]:
+        """
+        Ordena las copias de un bloque para leerlas: nodos sanos antes que los
+        que reportan errores o disco lento, y a igualdad el de menos peticiones
+        en curso y menor latencia (el principal si empatan)
+        """
+        copies = [(block_entry.node_id, False), (block_entry.replica_node_id, True)]
+        with self.node_lock.read():
+            costs = {}
+            for node_id, _ in copies:
+                node_info = self.nodes.get(node_id)
+                if not node_info or not node_info.is_alive():
+                    costs[node_id] = (2, 0, 0.0)
+                else:
+                    costs[node_id] = (0 if node_info.is_healthy() else 1,
+                                      node_info.load, node_info.disk_latency_ms)
+        return sorted(copies, key=lambda copy: costs[copy[0]])
+    
+    def fetch_block(self, block_entry) -> Optional[str]:
+        """
+        Obtiene los datos (base64) de un bloque, primero de la copia en el
+        nodo más sano y menos cargado y luego de la otra si la primera falla
+        o no es íntegra
+        """
+        for node_id, is_replica in self.order_copies(block_entry):
+            if not node_id:
+                continue
+            try:
+                response = self.send_node_request(node_id, MessageType.RETRIEVE_BLOCK, {
+                    "block_id": block_entry.block_id,
+                    "file_id": block_entry.file_id,
+                    "block_number": block_entry.block_number
+                })
+            except Exception as e:
+                print(f"Error obteniendo bloque {block_entry.block_id} del nodo {node_id}: {e}")
+                continue
+            if not response:
+                continue
+            
+            data = response.get("data", {})
+            if response.get("type") == MessageType.BLOCK_RETRIEVED.value:
+                # El nodo verificó los datos contra su checksum; comprobar que es el esperado
+                checksum = data.get("checksum")
+                if block_entry.checksum is None or checksum is None or checksum == block_entry.checksum:
+                    return data.get("block_data")
+                print(f"Checksum inesperado del bloque {block_entry.block_id} en {node_id}")
+                self.handle_corrupt_copy(block_entry.block_id, node_id, is_replica)
+            # Si el nodo detectó la corrupción al leer, ya la notificó con BLOCK_CORRUPTED
+        return None
+    
+    def handle_block_corrupted(self, data: dict):
+        """Procesa el aviso de un nodo (scrubber o lectura) sobre una copia corrupta"""
+        self.handle_corrupt_copy(data.get("block_id"), data.get("node_id"), data.get("is_replica", False))
+    
+    def handle_corrupt_copy(self, block_id: int, node_id: str, is_replica: bool):
+        """Marca una copia como no válida y la repara desde la otra copia en segundo plano"""
+        if not self.block_table.mark_block_corrupt(block_id, node_id, is_replica):
             return
+        print(f"Copia corrupta del bloque {block_id} en {node_id}, reparando")
+        threading.Thread(target=self.repair_block_copy, args=(block_id, node_id, is_replica),
+                         daemon=True).start()
+    
+    def repair_block_copy(self, block_id: int, node_id: str, is_replica: bool):
+        """Reescribe la copia de un bloque en node_id a partir de la copia sana"""
+        entry = self.block_table.get_block_info(block_id)
+        source_id = entry.node_id if is_replica else entry.replica_node_id
+        if not source_id:
+            print(f"Bloque {block_id} sin copia sana para reparar")
+            return
+        try:
+            response = self.send_node_request(source_id, MessageType.RETRIEVE_BLOCK, {
+                "block_id": block_id,
+                "file_id": entry.file_id,
+                "block_number": entry.block_number
+            })
+            if not response or response.get("type") != MessageType.BLOCK_RETRIEVED.value:
+                print(f"No se pudo leer el bloque {block_id} de {source_id} para repararlo")
+                return
+            block_data = response["data"]["block_data"]
+            response = self.send_node_request(node_id, MessageType.STORE_BLOCK, {"blocks": [{
+                "block_id": block_id,
+                "file_id": entry.file_id,
+                "block_number": entry.block_number,
+                "block_data": block_data,
+                "checksum": entry.checksum,
+                "is_replica": is_replica
+            }]}, timeout=10)
+            if response and response.get("type") == MessageType.SUCCESS.value:
+                self.mark_blocks_stored(node_id, response.get("data", {}).get("results", []))
+        except Exception as e:
+            print(f"Error reparando bloque {block_id} en {node_id}: {e}")
+    
+    def handle_delete_file(self, client_socket: socket.socket, data: dict):
+        """Maneja la eliminación de un archivo"""
+        file_id = data.get("file_id")
         
-        # Liberar bloques
-        self.block_table.free_blocks(file_id)
+        with self.files_lock:
+            if file_id not in self.files:
+                send_message(client_socket, MessageType.ERROR, {
+                    "message": "Archivo no encontrado"
+                })
+                return
+            file_info = self.remove_file_info(file_id)
         
-        # Eliminar bloques de los nodos
-        blocks_info = self.block_table.get_file_blocks(file_id)
-        for block_entry in blocks_info:
+        # Un archivo empaquetado sólo deja su rango muerto (ver PackManager)
+        if file_info.pack_id:
+            self.packer.release(file_info)
+        
+        # Liberar las entradas y encolar el borrado de ambas copias
+        freed = self.block_table.free_blocks(file_id)
+        for block_entry in freed:
             for node_id in [block_entry.node_id, block_entry.replica_node_id]:
-                if node_id and node_id in self.nodes and self.nodes[node_id].is_alive():
-                    node_info = self.nodes[node_id]
-                    try:
-                        # Conectar al puerto listener del nodo
-                        node_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        node_socket.settimeout(5)
-                        node_socket.connect((node_info.address, node_info.port))
-                        
-                        send_message(node_socket, MessageType.DELETE_BLOCK, {
-                            "block_id": block_entry.block_id,
-                            "file_id": file_id
-                        })
-                        
-                        node_socket.close()
-                    except Exception as e:
-                        print(f"Error eliminando bloque del nodo {node_id}: {e}")
-        
-        # Eliminar archivo
-        with self.files_lock:
-            del self.files[file_id]
+                self.garbage_collector.enqueue(node_id, block_entry.block_id, file_id)
         
-        self.save_state()
+        self.log_mutation({"op": "delete_file", "file_id": file_id})
+        self.publish_file_deleted(file_id, [block_entry.block_id for block_entry in freed])
         
         send_message(client_socket, MessageType.DELETE_RESPONSE, {
             "success": True,
             "message": "Archivo eliminado exitosamente"
         })
     
-    def handle_list_files(self, client_socket: socket.socket):
-        """Lista todos los archivos"""
-        with self.files_lock:
-            files_list = [file_info.to_dict() for file_info in self.files.values()]
+    def handle_inventory_digest(self, client_socket: socket.socket, data: dict):
+        """
+        Concilia el inventario de un nodo con la tabla de bloques
+        Responde con los bloques que el nodo guarda pero que ya no le corresponden
+        """
+        node_id = data.get("node_id")
+        node_info = self.nodes.get(node_id)
+        if not node_info:
+            return
+        try:
+            held = unpack_id_ranges(data.get("digest", ""))
+        except Exception as e:
+            print(f"Resumen de inventario inválido desde {node_id}: {e}")
+            return
         
-        send_message(client_socket, MessageType.FILE_LIST, {
-            "files": files_list
-        })
+        expected = {entry.block_id for entry in self.block_table.get_node_blocks(node_id)}
+        orphans = sorted(held - expected)
+        if orphans:
+            print(f"Inventario de {node_id}: {len(orphans)} bloques huérfanos")
+        
+        if node_info.socket:
+            self.send_to_node_socket(node_info, MessageType.ORPHAN_BLOCKS, {
+                "block_ids": orphans,
+                "cutoff": data.get("cutoff")
+            })
+    
+    def handle_list_files(self, client_socket: socket.socket, data: dict):
+        """
+        Lista los archivos
+        Con limit, cursor, prefix, filename o sort responde una página:
+        sort es name, size o date (order asc o desc), prefix filtra por el
+        principio del nombre y filename por el nombre exacto. La respuesta
+        incluye next_cursor para pedir la página siguiente y total. Sin
+        ninguno de ellos lista todos los archivos, como antes.
+        Si el cliente envía if_version y no hubo cambios, responde sólo not_modified
+        """
+        paginated = any(key in data for key in ("limit", "cursor", "prefix", "filename", "sort"))
+        limit = data.get("limit", LIST_FILES_PAGE_SIZE)
+        if paginated and (not isinstance(limit, int) or not 0 < limit <= LIST_FILES_MAX_PAGE):
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"limit debe estar entre 1 y {LIST_FILES_MAX_PAGE}"
+            })
+            return
+        
+        response = {}
+        try:
+            with self.files_lock:
+                version = self.files_version
+                if data.get("if_version") == version:
+                    response = {"not_modified": True}
+                elif not paginated:
+                    response = {"files": [file_info.to_dict() for file_info in self.files.values()]}
+                else:
+                    page, next_cursor, total = self.file_index.page(
+                        self.files, limit,
+                        cursor=data.get("cursor"),
+                        sort=data.get("sort", "name"),
+                        descending=data.get("order") == "desc",
+                        prefix=data.get("prefix"),
+                        filename=data.get("filename")
+                    )
+                    response = {"files": [file_info.to_dict() for file_info in page],
+                                "next_cursor": next_cursor, "total": total}
+        except ValueError as e:
+            send_message(client_socket, MessageType.ERROR, {"message": str(e)})
+            return
+        
+        send_message(client_socket, MessageType.FILE_LIST, {"version": version, **response})
     
     def handle_get_file_info(self, client_socket: socket.socket, data: dict):
         """Obtiene información detallada de un archivo"""
@@ -597,27 +1629,62 @@ class Coordinator:
             return
         
         file_info = self.files[file_id]
-        blocks_info = [entry.to_dict() for entry in self.block_table.get_file_blocks(file_id)]
+        blocks_info = [entry.to_dict() for entry in
+                       self.block_table.get_file_blocks(file_info.pack_id or file_id)]
         
         send_message(client_socket, MessageType.FILE_INFO, {
             "file": file_info.to_dict(),
             "blocks": blocks_info
         })
     
-    def handle_get_block_table(self, client_socket: socket.socket):
-        """Obtiene la tabla de bloques completa"""
-        if self.block_table:
+    def handle_get_block_table(self, client_socket: socket.socket, data: dict):
+        """
+        Obtiene la tabla de bloques completa
+        Si el cliente envía if_version y no hubo cambios, responde sólo not_modified
+        Con view="summary" responde en su lugar el mapa agregado de un rango
+        (start, end, cells, node_id, file_id; ver BlockTable.summary)
+        """
+        if self.block_table.total_blocks > 0:
+            version = self.block_table.version
+            if data.get("if_version") == version:
+                send_message(client_socket, MessageType.BLOCK_TABLE_DATA, {
+                    "version": version,
+                    "not_modified": True
+                })
+                return
+            if data.get("view") == "summary":
+                self.send_block_summary(client_socket, data)
+                return
+            table = self.block_table.to_dict()
             send_message(client_socket, MessageType.BLOCK_TABLE_DATA, {
-                "table": self.block_table.to_dict()
+                "version": table["version"],
+                "table": table
             })
         else:
             send_message(client_socket, MessageType.ERROR, {
                 "message": "Tabla de bloques no inicializada"
             })
     
+    def send_block_summary(self, client_socket: socket.socket, data: dict):
+        """Responde el mapa agregado de bloques validando el rango pedido"""
+        start = data.get("start", 0)
+        end = data.get("end")
+        cells = data.get("cells", BLOCK_MAP_DEFAULT_CELLS)
+        if (not isinstance(start, int) or start < 0 or (end is not None and (not isinstance(end, int) or end <= start))
+                or not isinstance(cells, int) or not 1 <= cells <= BLOCK_MAP_MAX_CELLS):
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Rango inválido: start >= 0, end > start y cells entre 1 y {BLOCK_MAP_MAX_CELLS}"
+            })
+            return
+        summary = self.block_table.summary(start, end, cells, data.get("node_id"), data.get("file_id"))
+        send_message(client_socket, MessageType.BLOCK_TABLE_DATA, {
+            "version": summary["version"],
+            "summary": summary
+        })
+    
     def handle_get_active_nodes(self, client_socket: socket.socket):
         """Obtiene lista de nodos activos"""
-        with self.node_lock:
+        with self.node_lock.read():
             nodes_list = [node_info.to_dict() 
                          for node_info in self.nodes.values() 
                          if node_info.is_alive()]
@@ -626,12 +1693,44 @@ class Coordinator:
             "nodes": nodes_list
         })
     
+    @staticmethod
+    def client_subscriber_name(address) -> str:
+        return f"cliente:{address[0]}:{address[1]}"
+    
+    def handle_subscribe_events(self, client_socket: socket.socket, data: dict):
+        """
+        Convierte la conexión de un cliente (la web) en un canal de cambios:
+        tras la confirmación, el coordinador envía por ella los lotes
+        CLUSTER_EVENTS de los temas pedidos hasta que el cliente la cierra
+        """
+        topics = data.get("topics", [])
+        send_message(client_socket, MessageType.SUCCESS, {"topics": topics})
+        self.events.subscribe(
+            self.client_subscriber_name(client_socket.getpeername()),
+            lambda message: send_message(client_socket, MessageType.CLUSTER_EVENTS, message),
+            topics)
+    
+    def handle_get_metrics(self, client_socket: socket.socket):
+        """Obtiene métricas internas del coordinador"""
+        send_message(client_socket, MessageType.METRICS_DATA, {
+            "replication": self.replication.metrics(),
+            "rebalance": self.rebalancer.metrics(),
+            "gc": self.garbage_collector.metrics(),
+            "packing": self.packer.metrics(),
+            "admission": self.admission.metrics(),
+            "failure_detector": self.failure_detector.metrics(),
+            "events": self.events.metrics()
+        })
+    
     def stop(self):
         """Detiene el coordinador"""
         self.running = False
+        self.failure_detector.stop()
+        self.events.stop()
         if self.socket:
             self.socket.close()
-        self.save_state()
+        self.save_snapshot()
+        self.metadata_log.close()
 
 def split_file_into_blocks_from_bytes(file_bytes: bytes, block_size: int):
     """Divide bytes de archivo en bloques"""
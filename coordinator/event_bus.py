@@ -0,0 +1,218 @@
+"""
+Difusión de eventos del clúster por temas, agrupados y asíncronos
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import EVENT_COALESCE_WINDOW, EVENT_QUEUE_LIMIT
+
+# Temas publicados por el coordinador
+TOPICS = ("nodes", "files", "blocks")
+
+class Subscriber:
+    """Suscriptor con su cola de salida y su hilo de envío"""
+    
+    def __init__(self, name: str, send: Callable[[dict], None], topics: Iterable[str],
+                 queue_limit: int):
+        self.name = name
+        self.send = send
+        self.topics = set(topics)
+        self.queue_limit = queue_limit
+        self.queue = deque()
+        self.resync = False  # se descartaron eventos: el suscriptor debe reconstruir su vista
+        self.ready = threading.Condition()
+        self.active = True
+        self.thread: Optional[threading.Thread] = None
+        
+        # Métricas
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        with self.ready:
+            self.active = False
+            self.queue.clear()
+            self.ready.notify()
+    
+    def offer(self, events: List[dict]):
+        """Encola un lote sin bloquear; si la cola está llena se vacía y se pide resincronizar"""
+        with self.ready:
+            if len(self.queue) >= self.queue_limit:
+                self.dropped += sum(len(batch) for batch in self.queue)
+                self.queue.clear()
+                self.resync = True
+            self.queue.append(events)
+            self.ready.notify()
+    
+    def run(self):
+        """Envía los lotes de la cola en orden"""
+        seq = 0
+        while True:
+            with self.ready:
+                while self.active and not self.queue:
+                    self.ready.wait()
+                if not self.active:
+                    return
+                events = self.queue.popleft()
+                resync, self.resync = self.resync, False
+            seq += 1
+            message = {"seq": seq, "events": events}
+            if resync:
+                message["resync"] = True
+            try:
+                self.send(message)
+                self.sent += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Error enviando eventos a {self.name}: {e}")
+
+class EventBus:
+    """
+    Bus publicación/suscripción de cambios del clúster
+    
+    publish() sólo guarda el evento en un diccionario indexado por
+    (tema, clave): si la misma entidad cambia varias veces dentro de la
+    ventana de agrupación sólo se envía su último estado. Un hilo vacía ese
+    diccionario cada window segundos y reparte a cada suscriptor un único
+    lote con los eventos de sus temas. Cada suscriptor tiene su propia cola
+    y su propio hilo de envío, así que un nodo lento no retrasa a los demás
+    ni a quien publica. Si nadie está suscrito a un tema, publicar en él no
+    cuesta nada.
+    """
+    
+    def __init__(self, window: float = EVENT_COALESCE_WINDOW, queue_limit: int = EVENT_QUEUE_LIMIT):
+        self.window = window
+        self.queue_limit = queue_limit
+        self.lock = threading.Lock()
+        self.pending_ready = threading.Condition(self.lock)
+        self.pending: Dict[Tuple[str, str], dict] = {}
+        self.subscribers: Dict[str, Subscriber] = {}
+        self.topic_counts: Dict[str, int] = {}
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        
+        # Métricas
+        self.published = 0
+        self.coalesced = 0
+        self.batches = 0
+    
+    def start(self):
+        """Inicia el hilo que agrupa y reparte los eventos"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        with self.lock:
+            self.running = False
+            subscribers = list(self.subscribers.values())
+            self.pending_ready.notify()
+        for subscriber in subscribers:
+            subscriber.stop()
+    
+    def subscribe(self, name: str, send: Callable[[dict], None], topics: Iterable[str]) -> Subscriber:
+        """Registra (o reemplaza) un suscriptor para los temas indicados"""
+        subscriber = Subscriber(name, send, [t for t in topics if t in TOPICS], self.queue_limit)
+        with self.lock:
+            previous = self.subscribers.pop(name, None)
+            if previous:
+                self._count_topics(previous, -1)
+            self.subscribers[name] = subscriber
+            self._count_topics(subscriber, 1)
+        if previous:
+            previous.stop()
+        subscriber.start()
+        return subscriber
+    
+    def unsubscribe(self, name: str):
+        """Da de baja un suscriptor y descarta sus eventos pendientes"""
+        with self.lock:
+            subscriber = self.subscribers.pop(name, None)
+            if subscriber:
+                self._count_topics(subscriber, -1)
+        if subscriber:
+            subscriber.stop()
+    
+    def _count_topics(self, subscriber: Subscriber, delta: int):
+        """Mantiene cuántos suscriptores tiene cada tema (con el lock tomado)"""
+        for topic in subscriber.topics:
+            self.topic_counts[topic] = self.topic_counts.get(topic, 0) + delta
+            if self.topic_counts[topic] <= 0:
+                del self.topic_counts[topic]
+    
+    def has_subscribers(self, topic: str) -> bool:
+        return topic in self.topic_counts
+    
+    def publish(self, topic: str, event_type: str, key, data: Optional[dict] = None):
+        """
+        Publica un cambio de una entidad (key) en un tema
+        El evento enviado lleva topic, type y los campos de data
+        """
+        if topic not in self.topic_counts:
+            return
+        event = {"topic": topic, "type": event_type, **(data or {})}
+        with self.lock:
+            if not self.topic_counts.get(topic):
+                return
+            self.published += 1
+            if (topic, str(key)) in self.pending:
+                self.coalesced += 1
+            else:
+                self.pending_ready.notify()
+            self.pending[(topic, str(key))] = event
+    
+    def run(self):
+        """Cada ventana reparte a cada suscriptor los eventos de sus temas"""
+        while True:
+            with self.lock:
+                while self.running and not self.pending:
+                    self.pending_ready.wait()
+                if not self.running:
+                    return
+            
+            # Dejar que se acumulen (y se agrupen) los cambios de la ventana
+            time.sleep(self.window)
+            
+            with self.lock:
+                pending = self.pending
+                self.pending = {}
+                subscribers = list(self.subscribers.values())
+            
+            by_topic: Dict[str, List[dict]] = {}
+            for (topic, _), event in pending.items():
+                by_topic.setdefault(topic, []).append(event)
+            for subscriber in subscribers:
+                events = [event for topic in subscriber.topics for event in by_topic.get(topic, [])]
+                if events:
+                    subscriber.offer(events)
+                    self.batches += 1
+    
+    def metrics(self) -> dict:
+        """Métricas del bus de eventos"""
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+            topics = dict(self.topic_counts)
+            pending = len(self.pending)
+        return {
+            "subscribers": len(subscribers),
+            "topics": topics,
+            "pending": pending,
+            "published": self.published,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "sent": sum(s.sent for s in subscribers),
+            "dropped": sum(s.dropped for s in subscribers),
+            "send_errors": sum(s.errors for s in subscribers),
+            "queued": sum(len(s.queue) for s in subscribers)
+        }
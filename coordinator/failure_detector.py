@@ -0,0 +1,166 @@
+"""
+Detector de fallos phi-accrual con un heap de plazos
+"""
+import heapq
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import HEARTBEAT_INTERVAL, NODE_TIMEOUT, PHI_THRESHOLD, PHI_WINDOW, PHI_MIN_STD
+
+class HeartbeatHistory:
+    """Intervalos recientes entre heartbeats de un nodo"""
+    
+    def __init__(self, window: int):
+        self.intervals = deque(maxlen=window)
+        # Arranque: se asume el intervalo configurado hasta tener muestras
+        self.intervals.append(HEARTBEAT_INTERVAL)
+        self.last = time.time()
+    
+    def record(self, now: float):
+        self.intervals.append(now - self.last)
+        self.last = now
+    
+    def mean_std(self) -> Tuple[float, float]:
+        n = len(self.intervals)
+        mean = sum(self.intervals) / n
+        variance = sum((x - mean) ** 2 for x in self.intervals) / n
+        return mean, max(math.sqrt(variance), PHI_MIN_STD)
+
+class FailureDetector:
+    """
+    Sospecha de nodos caídos sin recorrer la lista de nodos
+    
+    Para cada nodo se estima la distribución (normal) de los intervalos entre
+    heartbeats. phi(t) = -log10(P(el siguiente llega después de t)); cada
+    heartbeat calcula el instante en que phi superará el umbral y lo añade a
+    un heap de plazos. Un único hilo duerme hasta el plazo más cercano; las
+    entradas antiguas del heap se descartan por generación. Así la sospecha
+    llega en cuanto phi cruza el umbral y cada heartbeat cuesta O(log n).
+    """
+    
+    def __init__(self, on_suspect: Callable[[str], None], threshold: float = PHI_THRESHOLD,
+                 window: int = PHI_WINDOW, max_timeout: float = NODE_TIMEOUT):
+        self.on_suspect = on_suspect
+        self.threshold = threshold
+        self.window = window
+        self.max_timeout = max_timeout
+        
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.histories: Dict[str, HeartbeatHistory] = {}
+        self.generation: Dict[str, int] = {}
+        self.deadlines: List[Tuple[float, int, str]] = []  # (plazo, generación, node_id)
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        
+        # Métricas
+        self.suspicions = 0
+    
+    def timeout_for(self, history: HeartbeatHistory) -> float:
+        """Tiempo sin heartbeats tras el que phi supera el umbral"""
+        mean, std = history.mean_std()
+        # P(X > t) = 10^-threshold  =>  t = mean + z * std
+        z = math.sqrt(2) * self._erfcinv(2 * 10 ** -self.threshold)
+        return min(self.max_timeout, mean + z * std)
+    
+    @staticmethod
+    def _erfcinv(y: float) -> float:
+        """Inversa de erfc por bisección (sólo se usa con el umbral fijo)"""
+        low, high = 0.0, 10.0
+        for _ in range(60):
+            mid = (low + high) / 2
+            if math.erfc(mid) > y:
+                low = mid
+            else:
+                high = mid
+        return (low + high) / 2
+    
+    def phi(self, node_id: str, now: Optional[float] = None) -> float:
+        """Nivel de sospecha actual de un nodo"""
+        with self.lock:
+            history = self.histories.get(node_id)
+            if not history:
+                return float("inf")
+            mean, std = history.mean_std()
+            elapsed = (now or time.time()) - history.last
+        p_later = 0.5 * math.erfc((elapsed - mean) / (std * math.sqrt(2)))
+        return -math.log10(max(p_later, 1e-300))
+    
+    def heartbeat(self, node_id: str):
+        """Registra un heartbeat y reprograma el plazo de sospecha del nodo"""
+        now = time.time()
+        with self.lock:
+            history = self.histories.get(node_id)
+            if history is None:
+                history = self.histories[node_id] = HeartbeatHistory(self.window)
+            else:
+                history.record(now)
+            generation = self.generation.get(node_id, 0) + 1
+            self.generation[node_id] = generation
+            deadline = now + self.timeout_for(history)
+            heapq.heappush(self.deadlines, (deadline, generation, node_id))
+            if self.deadlines[0][2] == node_id and self.deadlines[0][1] == generation:
+                self.changed.notify()
+    
+    def remove(self, node_id: str):
+        """Deja de vigilar un nodo (sus plazos pendientes quedan obsoletos)"""
+        with self.lock:
+            self.histories.pop(node_id, None)
+            self.generation[node_id] = self.generation.get(node_id, 0) + 1
+    
+    def start(self):
+        """Inicia el hilo que vigila los plazos"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.changed.notify()
+    
+    def run(self):
+        """Duerme hasta el plazo más cercano y sospecha de los nodos vencidos"""
+        while self.running:
+            suspects = []
+            with self.lock:
+                if not self.deadlines:
+                    self.changed.wait(1)
+                    continue
+                deadline, generation, node_id = self.deadlines[0]
+                now = time.time()
+                if deadline > now:
+                    self.changed.wait(deadline - now)
+                    continue
+                while self.deadlines and self.deadlines[0][0] <= now:
+                    deadline, generation, node_id = heapq.heappop(self.deadlines)
+                    if self.generation.get(node_id) == generation and node_id in self.histories:
+                        suspects.append(node_id)
+                        self.histories.pop(node_id, None)
+                        self.suspicions += 1
+            
+            # El callback se ejecuta sin el lock del detector
+            for node_id in suspects:
+                try:
+                    self.on_suspect(node_id)
+                except Exception as e:
+                    print(f"Error procesando la caída del nodo {node_id}: {e}")
+    
+    def metrics(self) -> dict:
+        """Métricas del detector"""
+        with self.lock:
+            nodes = list(self.histories)
+            pending = len(self.deadlines)
+        return {
+            "watched_nodes": len(nodes),
+            "pending_deadlines": pending,
+            "suspicions": self.suspicions,
+            "phi": {node_id: round(self.phi(node_id), 3) for node_id in nodes}
+        }
@@ -0,0 +1,134 @@
+"""
+Índices ordenados de archivos para listados paginados
+"""
+import base64
+import bisect
+import json
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Claves de ordenación admitidas y el campo de FileInfo que ordenan
+SORT_KEYS = {"name": "filename", "size": "size", "date": "upload_date"}
+
+class FileIndex:
+    """
+    Índices ordenados de los archivos del coordinador
+    
+    Por cada clave de ordenación se mantiene una lista ordenada de tuplas
+    (valor, file_id), actualizada con bisect en cada alta o baja, y un
+    diccionario filename -> file_ids para filtrar por nombre exacto. Una
+    página se localiza con una búsqueda binaria a partir del cursor y sólo
+    se recorren los archivos que entran en ella, de modo que listar cuesta
+    O(log n + página) aunque haya millones de archivos. Un prefijo es un
+    rango contiguo del índice por nombre; con otra ordenación, sólo ese
+    rango se ordena al vuelo.
+    
+    No tiene lock propio: se usa con files_lock del coordinador tomado.
+    """
+    
+    def __init__(self):
+        self.indexes: Dict[str, List[tuple]] = {sort: [] for sort in SORT_KEYS}
+        self.by_name: Dict[str, Set[str]] = {}
+    
+    @staticmethod
+    def index_entry(sort: str, file_info) -> tuple:
+        return (getattr(file_info, SORT_KEYS[sort]), file_info.file_id)
+    
+    def __len__(self) -> int:
+        return len(self.indexes["name"])
+    
+    def add(self, file_info):
+        """Da de alta un archivo en todos los índices"""
+        for sort, index in self.indexes.items():
+            bisect.insort(index, self.index_entry(sort, file_info))
+        self.by_name.setdefault(file_info.filename, set()).add(file_info.file_id)
+    
+    def remove(self, file_info):
+        """Da de baja un archivo de todos los índices"""
+        for sort, index in self.indexes.items():
+            entry = self.index_entry(sort, file_info)
+            position = bisect.bisect_left(index, entry)
+            if position < len(index) and index[position] == entry:
+                del index[position]
+        file_ids = self.by_name.get(file_info.filename)
+        if file_ids is not None:
+            file_ids.discard(file_info.file_id)
+            if not file_ids:
+                del self.by_name[file_info.filename]
+    
+    def rebuild(self, files: Iterable):
+        """Reconstruye los índices de una vez (al cargar el estado)"""
+        files = list(files)
+        self.indexes = {sort: sorted(self.index_entry(sort, file_info) for file_info in files)
+                        for sort in SORT_KEYS}
+        self.by_name = {}
+        for file_info in files:
+            self.by_name.setdefault(file_info.filename, set()).add(file_info.file_id)
+    
+    @staticmethod
+    def encode_cursor(sort: str, entry: tuple) -> str:
+        raw = json.dumps([sort, entry[0], entry[1]]).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+    
+    @staticmethod
+    def decode_cursor(sort: str, cursor: str) -> tuple:
+        """Retorna la tupla (valor, file_id) del último archivo de la página anterior"""
+        try:
+            cursor_sort, value, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except Exception:
+            raise ValueError("Cursor inválido")
+        if cursor_sort != sort:
+            raise ValueError("El cursor pertenece a otra ordenación")
+        return (value, file_id)
+    
+    def candidates(self, files: Dict, sort: str, prefix: Optional[str],
+                   filename: Optional[str]) -> Tuple[List[tuple], int, int]:
+        """Retorna (entradas ordenadas, inicio, fin) de los archivos que cumplen los filtros"""
+        if filename is not None:
+            # Pocos archivos comparten nombre: se ordenan al vuelo
+            entries = sorted(self.index_entry(sort, files[file_id])
+                             for file_id in self.by_name.get(filename, ()))
+            return entries, 0, len(entries)
+        
+        index = self.indexes[sort]
+        if not prefix:
+            return index, 0, len(index)
+        
+        # Los nombres con el prefijo forman un rango contiguo del índice por nombre
+        names = self.indexes["name"]
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        lo = bisect.bisect_left(names, (prefix,))
+        hi = bisect.bisect_left(names, (upper,))
+        if sort == "name":
+            return names, lo, hi
+        entries = sorted(self.index_entry(sort, files[file_id]) for _, file_id in names[lo:hi])
+        return entries, 0, len(entries)
+    
+    def page(self, files: Dict, limit: int, cursor: Optional[str] = None, sort: str = "name",
+             descending: bool = False, prefix: Optional[str] = None,
+             filename: Optional[str] = None) -> Tuple[list, Optional[str], int]:
+        """
+        Retorna (archivos de la página, cursor de la siguiente o None, total que cumple los filtros)
+        Lanza ValueError si la ordenación o el cursor no son válidos
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Ordenación no soportada: {sort}")
+        entries, lo, hi = self.candidates(files, sort, prefix, filename)
+        after = self.decode_cursor(sort, cursor) if cursor else None
+        
+        try:
+            if not descending:
+                start = bisect.bisect_right(entries, after, lo, hi) if after else lo
+                end = min(start + limit, hi)
+                selected = entries[start:end]
+                more = end < hi
+            else:
+                end = bisect.bisect_left(entries, after, lo, hi) if after else hi
+                start = max(end - limit, lo)
+                selected = entries[start:end][::-1]
+                more = start > lo
+        except TypeError:
+            # El valor del cursor no es comparable con los del índice
+            raise ValueError("Cursor inválido")
+        
+        next_cursor = self.encode_cursor(sort, selected[-1]) if more and selected else None
+        return [files[file_id] for _, file_id in selected], next_cursor, hi - lo
@@ -0,0 +1,101 @@
+"""
+Borrado asíncrono y por lotes de bloques en los nodos
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import GC_INTERVAL, GC_BATCH_SIZE
+from common.protocol import MessageType
+
+class GarbageCollector:
+    """
+    Cola de borrados pendientes por nodo
+    
+    Eliminar un archivo sólo libera su entrada en la tabla y encola sus
+    copias; un hilo envía a cada nodo un DELETE_BLOCK con hasta batch_size
+    bloques y lee la respuesta. Cada borrado lleva el file_id para que el
+    nodo no elimine un bloque reutilizado por otro archivo. Si el nodo no
+    está disponible o el coordinador se reinicia, la conciliación de
+    inventario (INVENTORY_DIGEST) recoge después lo que quedó sin borrar.
+    """
+    
+    def __init__(self, coordinator, interval: float = GC_INTERVAL, batch_size: int = GC_BATCH_SIZE):
+        self.coordinator = coordinator
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending: Dict[str, List[Tuple[int, str]]] = {}  # node_id -> [(block_id, file_id)]
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        
+        # Métricas
+        self.deleted = 0
+        self.failed_batches = 0
+        self.dropped = 0
+    
+    def start(self):
+        """Inicia el hilo de borrado"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def enqueue(self, node_id: str, block_id: int, file_id: str):
+        """Encola el borrado de una copia de un bloque en un nodo"""
+        if not node_id:
+            return
+        with self.lock:
+            self.pending.setdefault(node_id, []).append((block_id, file_id))
+    
+    def run(self):
+        """Envía periódicamente los borrados acumulados"""
+        while self.coordinator.running:
+            time.sleep(self.interval)
+            self.flush()
+    
+    def flush(self):
+        """Envía a cada nodo sus borrados pendientes en lotes"""
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        
+        for node_id, blocks in pending.items():
+            if node_id not in self.coordinator.nodes:
+                # Nodo perdido: su inventario se concilia cuando vuelva
+                self.dropped += len(blocks)
+                continue
+            for start in range(0, len(blocks), self.batch_size):
+                batch = blocks[start:start + self.batch_size]
+                if not self.send_batch(node_id, batch):
+                    self.failed_batches += 1
+                    # Reintentar en la siguiente pasada
+                    with self.lock:
+                        self.pending.setdefault(node_id, []).extend(blocks[start:])
+                    break
+    
+    def send_batch(self, node_id: str, batch: List[Tuple[int, str]]) -> bool:
+        """Envía un DELETE_BLOCK con varios bloques y espera la respuesta"""
+        try:
+            response = self.coordinator.send_node_request(node_id, MessageType.DELETE_BLOCK, {
+                "blocks": [{"block_id": block_id, "file_id": file_id} for block_id, file_id in batch]
+            }, timeout=30)
+        except Exception as e:
+            print(f"Error enviando borrados al nodo {node_id}: {e}")
+            return False
+        if not response or response.get("type") != MessageType.BLOCK_DELETED.value:
+            return False
+        self.deleted += len(response.get("data", {}).get("deleted", []))
+        return True
+    
+    def metrics(self) -> dict:
+        """Métricas de la cola de borrado"""
+        with self.lock:
+            queued = sum(len(blocks) for blocks in self.pending.values())
+        return {
+            "queued": queued,
+            "deleted": self.deleted,
+            "failed_batches": self.failed_batches,
+            "dropped": self.dropped
+        }
@@ -0,0 +1,232 @@
+"""
+Registro de escritura anticipada (WAL) y snapshots de los metadatos del coordinador
+"""
+import os
+import json
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.utils import ensure_directory
+
+SNAPSHOT_FILE = "snapshot.json"
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".log"
+WRITE_RETRY_DELAY = 1.0  # segundos de espera tras un error de escritura antes de reintentar el lote
+
+class MetadataLog:
+    """
+    Log append-only de mutaciones de metadatos con group commit
+    
+    Cada registro es una línea JSON con un número de secuencia. Los
+    registros se acumulan en memoria y un hilo escritor los vuelca en lote
+    con un único fsync, despertando a todos los que esperaban ese lote.
+    El log se divide en segmentos (wal-<seq>.log) para poder descartar los
+    antiguos una vez que un snapshot los cubre.
+    """
+    
+    def __init__(self, data_dir: str, group_commit_interval: float = 0.005):
+        self.data_dir = data_dir
+        self.group_commit_interval = group_commit_interval
+        ensure_directory(data_dir)
+        
+        self.lock = threading.Lock()
+        self.flushed = threading.Condition(self.lock)
+        # Serializa las escrituras a disco sin bloquear a quienes añaden registros
+        self.write_lock = threading.RLock()
+        self.pending: List[str] = []
+        self.next_seq = 1
+        self.flushed_seq = 0
+        self.records_since_snapshot = 0
+        
+        self.segment = None
+        self.segment_start = 1
+        self.segment_bytes = 0  # tamaño sincronizado del segmento actual
+        self.running = False
+        self.writer_thread: Optional[threading.Thread] = None
+    
+    def load(self) -> Tuple[Optional[dict], Iterator[dict]]:
+        """
+        Lee el último snapshot y los registros posteriores a él
+        Debe llamarse antes de start(). Retorna (snapshot o None, iterador de registros)
+        """
+        snapshot = None
+        snapshot_path = os.path.join(self.data_dir, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+        last_seq = snapshot.get("last_seq", 0) if snapshot else 0
+        
+        # Continuar la numeración después del último registro existente
+        self.next_seq = last_seq + 1
+        for record in self._read_segments():
+            self.next_seq = max(self.next_seq, record["seq"] + 1)
+        self.flushed_seq = self.next_seq - 1
+        
+        records = (record for record in self._read_segments() if record["seq"] > last_seq)
+        return snapshot, records
+    
+    def _segment_paths(self) -> List[Tuple[int, str]]:
+        """Segmentos existentes ordenados por secuencia inicial"""
+        segments = []
+        for name in os.listdir(self.data_dir):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    start = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                except ValueError:
+                    continue
+                segments.append((start, os.path.join(self.data_dir, name)))
+        return sorted(segments)
+    
+    def _read_segments(self) -> Iterator[dict]:
+        """Itera los registros de todos los segmentos, ignorando una cola truncada"""
+        for _, path in self._segment_paths():
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # Escritura interrumpida por una caída: el resto no es válido
+                        break
+    
+    def start(self):
+        """Abre un segmento nuevo e inicia el hilo escritor"""
+        with self.write_lock, self.lock:
+            self._open_segment()
+        self.running = True
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+    
+    def _open_segment(self):
+        """Cierra el segmento actual y abre otro que empieza en next_seq (con ambos locks tomados)"""
+        if self.segment:
+            self.segment.close()
+        self.segment_start = self.next_seq
+        path = os.path.join(self.data_dir, f"{SEGMENT_PREFIX}{self.segment_start:012d}{SEGMENT_SUFFIX}")
+        self.segment = open(path, 'a')
+        self.segment_bytes = os.path.getsize(path)
+        # La entrada del segmento nuevo debe sobrevivir a un corte igual que sus registros
+        self._fsync_dir()
+    
+    def _fsync_dir(self):
+        """Sincroniza el directorio para que las altas, renombrados y bajas sean durables"""
+        fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def _reopen_segment(self):
+        """Recorta el segmento actual a lo ya sincronizado y lo vuelve a abrir (con ambos locks tomados)"""
+        path = self.segment.name
+        try:
+            self.segment.close()
+        except Exception:
+            pass  # el búfer contiene el lote que falló
+        os.truncate(path, self.segment_bytes)
+        self.segment = open(path, 'a')
+    
+    def append(self, record: dict, wait: bool = True) -> int:
+        """
+        Añade un registro al log. Si wait es True, bloquea hasta que el
+        lote que lo contiene esté en disco. Retorna su número de secuencia
+        """
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            record = dict(record, seq=seq)
+            self.pending.append(json.dumps(record, separators=(',', ':')))
+            self.records_since_snapshot += 1
+            if wait:
+                while self.flushed_seq < seq and self.running:
+                    self.flushed.wait()
+        return seq
+    
+    def _writer_loop(self):
+        """Vuelca los registros pendientes en lote con un único fsync"""
+        while self.running:
+            time.sleep(self.group_commit_interval)
+            if not self.flush():
+                time.sleep(WRITE_RETRY_DELAY)
+    
+    def flush(self) -> bool:
+        """Escribe y sincroniza el lote pendiente. Retorna False si falló (el lote se reintenta)"""
+        with self.write_lock:
+            with self.lock:
+                if not self.pending or not self.segment:
+                    return True
+                batch = self.pending
+                self.pending = []
+                last_seq = self.next_seq - 1
+            
+            # La escritura y el fsync se hacen sin el lock de los registros
+            try:
+                self.segment.write('\n'.join(batch) + '\n')
+                self.segment.flush()
+                os.fsync(self.segment.fileno())
+            except Exception as e:
+                print(f"Error escribiendo el log de metadatos (se reintentará): {e}")
+                # Los que esperan el lote siguen esperando: vuelve a la cola y el
+                # segmento se recorta a lo ya sincronizado para no dejar una línea
+                # a medias (la carga descartaría lo que la siga)
+                with self.lock:
+                    self.pending = batch + self.pending
+                    try:
+                        self._reopen_segment()
+                    except Exception as e:
+                        print(f"Error reabriendo el segmento del log de metadatos: {e}")
+                return False
+            
+            self.segment_bytes = os.fstat(self.segment.fileno()).st_size
+            with self.lock:
+                self.flushed_seq = last_seq
+                self.flushed.notify_all()
+            return True
+    
+    def begin_snapshot(self) -> int:
+        """
+        Cambia a un segmento nuevo antes de capturar el estado
+        Retorna la secuencia hasta la que el snapshot debe considerarse completo
+        """
+        with self.write_lock:
+            self.flush()
+            with self.lock:
+                self._open_segment()
+                self.records_since_snapshot = 0
+                return self.next_seq - 1
+    
+    def write_snapshot(self, state: dict, last_seq: int):
+        """Escribe el snapshot de forma atómica y descarta los segmentos que cubre"""
+        state = dict(state, last_seq=last_seq)
+        snapshot_path = os.path.join(self.data_dir, SNAPSHOT_FILE)
+        tmp_path = snapshot_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+        # El renombrado debe ser durable antes de borrar los segmentos que cubre
+        self._fsync_dir()
+        
+        with self.lock:
+            current_start = self.segment_start
+        for start, path in self._segment_paths():
+            if start < current_start and start <= last_seq:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def close(self):
+        """Detiene el hilo escritor tras volcar lo pendiente"""
+        with self.write_lock:
+            self.flush()
+            with self.lock:
+                self.running = False
+                self.flushed.notify_all()
+                if self.segment:
+                    self.segment.close()
+                    self.segment = None
@@ -0,0 +1,416 @@
+"""
+Empaquetado de archivos pequeños en bloques compartidos
+"""
+import base64
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Set, Tuple
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    BLOCK_SIZE, PACK_SMALL_FILES, PACK_MAX_FILE_SIZE, PACK_COMPACTION_THRESHOLD, PACK_COMPACTION_INTERVAL
+)
+from common.protocol import MessageType
+from common.utils import calculate_checksum
+
+@dataclass
+class Pack:
+    """Bloque compartido por varios archivos pequeños"""
+    pack_id: str
+    written: int = 0  # bytes añadidos al bloque, de archivos vivos o ya borrados
+    live: int = 0  # bytes de archivos que siguen existiendo (o a punto de registrarse)
+    files: Set[str] = field(default_factory=set)
+    
+    def dead_ratio(self) -> float:
+        return 1 - self.live / self.written if self.written else 0.0
+
+@dataclass
+class PendingAppend:
+    """Archivo pequeño a la espera del siguiente añadido al paquete abierto"""
+    data: bytes
+    done: bool = False
+    location: Optional[Tuple[str, int, int]] = None  # resultado de store
+
+class PackManager:
+    """
+    Agrupa los archivos pequeños en bloques de paquete
+    
+    Un archivo de hasta PACK_MAX_FILE_SIZE no recibe un bloque propio: sus
+    bytes se añaden al final del paquete abierto, un bloque normal de la
+    tabla (con su réplica) cuyo file_id es el del paquete. Los nodos añaden
+    los datos a su copia (STORE_BLOCK con offset) en lugar de reescribirla,
+    y FileInfo guarda pack_id, pack_offset y el checksum del fragmento, de
+    modo que leer un archivo es pedir a un nodo sólo ese rango.
+    
+    Los añadidos al paquete abierto se serializan con append_lock porque
+    cada uno debe empezar donde acabó el anterior, pero con group commit:
+    quien toma el lock escribe en una sola petición a los nodos todos los
+    archivos que esperaban, y los que llegan mientras tanto forman el lote
+    siguiente. Así la latencia de red se paga por lote y no por archivo.
+    Borrar un archivo deja su
+    rango muerto; un paquete sellado sin archivos vivos se libera y la
+    compactación reubica los archivos de los paquetes con demasiado espacio
+    muerto en el paquete abierto. Tras reiniciar el coordinador todos los
+    paquetes quedan sellados.
+    """
+    
+    def __init__(self, coordinator, threshold: float = PACK_COMPACTION_THRESHOLD,
+                 interval: float = PACK_COMPACTION_INTERVAL):
+        self.coordinator = coordinator
+        self.threshold = threshold
+        self.interval = interval
+        self.packs: Dict[str, Pack] = {}
+        self.open_pack: Optional[str] = None  # paquete al que se añaden los archivos nuevos
+        self.append_lock = threading.Lock()  # un añadido a la vez (incluye la escritura en los nodos)
+        self.pending: List[PendingAppend] = []  # archivos esperando el siguiente añadido
+        self.lock = threading.Lock()  # contabilidad de los paquetes
+        self.thread: Optional[threading.Thread] = None
+        
+        # Métricas
+        self.compacted_files = 0
+        self.freed_packs = 0
+        self.failed_appends = 0
+    
+    def start(self):
+        """Inicia el hilo de compactación"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def run(self):
+        """Compacta periódicamente los paquetes con demasiado espacio muerto"""
+        while self.coordinator.running:
+            time.sleep(self.interval)
+            try:
+                moved = self.compact()
+                if moved:
+                    print(f"Compactación de paquetes: {moved} archivos reubicados")
+            except Exception as e:
+                print(f"Error compactando paquetes: {e}")
+    
+    @staticmethod
+    def accepts(size: int) -> bool:
+        """Indica si un archivo de este tamaño se empaqueta"""
+        return PACK_SMALL_FILES and 0 < size <= min(PACK_MAX_FILE_SIZE, BLOCK_SIZE)
+    
+    def is_pack(self, file_id: str) -> bool:
+        return file_id in self.packs
+    
+    def pack_ids(self) -> Set[str]:
+        with self.lock:
+            return set(self.packs)
+    
+    # --- Estado persistente ---
+    
+    def register(self, pack_id: str, written: int = 0):
+        """Da de alta un paquete del snapshot o del log (queda sellado)"""
+        pack = self.packs.setdefault(pack_id, Pack(pack_id))
+        pack.written = max(pack.written, written)
+    
+    def replay_append(self, pack_id: str, end: int, block_checksum: Optional[int]):
+        """Aplica un añadido registrado en el log: el más lejano fija el checksum del bloque"""
+        pack = self.packs.get(pack_id)
+        if pack is None or end < pack.written:
+            return
+        pack.written = end
+        entry = self.coordinator.block_table.get_file_block(pack_id, 0)
+        if entry and block_checksum is not None:
+            self.coordinator.block_table.set_checksums({entry.block_id: block_checksum})
+    
+    def forget(self, pack_id: str):
+        """Quita un paquete liberado (al reproducir el log)"""
+        self.packs.pop(pack_id, None)
+        if self.open_pack == pack_id:
+            self.open_pack = None
+    
+    def rebuild(self, files):
+        """Recalcula los bytes vivos y los archivos de cada paquete (al cargar el estado)"""
+        with self.lock:
+            for pack in self.packs.values():
+                pack.live = 0
+                pack.files = set()
+            for file_info in files:
+                pack = self.packs.get(file_info.pack_id) if file_info.pack_id else None
+                if pack is not None:
+                    pack.live += file_info.size
+                    pack.files.add(file_info.file_id)
+    
+    def export(self) -> Dict[str, dict]:
+        """Paquetes para el snapshot (sus bloques van con los de los archivos)"""
+        with self.lock:
+            return {pack_id: {"written": pack.written} for pack_id, pack in self.packs.items()}
+    
+    # --- Escritura ---
+    
+    def open_new_pack(self) -> Pack:
+        """Asigna el bloque de un paquete nuevo y lo deja abierto (con append_lock tomado)"""
+        coordinator = self.coordinator
+        active_nodes, node_loads = coordinator.get_upload_nodes()
+        pack_id = f"__pack_{int(time.time())}_{secrets.token_hex(4)}"
+        block_id, node_id, replica_node_id = coordinator.block_table.allocate_blocks(
+            pack_id, 1, active_nodes, node_loads)[0]
+        coordinator.log_mutation({"op": "add_pack", "pack_id": pack_id,
+                                  "blocks": [[block_id, 0, node_id, replica_node_id]]})
+        
+        pack = Pack(pack_id)
+        with self.lock:
+            previous = self.packs.get(self.open_pack) if self.open_pack else None
+            self.packs[pack_id] = pack
+            self.open_pack = pack_id
+        coordinator.events.publish("blocks", "blocks_assigned", f"file:{pack_id}", {
+            "file_id": pack_id,
+            "blocks": [[block_id, node_id, replica_node_id]]
+        })
+        if previous:
+            self.free_if_empty(previous)
+        return pack
+    
+    def store(self, data: bytes) -> Optional[Tuple[str, int, int]]:
+        """
+        Añade los datos de un archivo pequeño al paquete abierto
+        Retorna (pack_id, offset, checksum del bloque hasta el final del
+        archivo) o None si ningún nodo confirmó los datos; lanza ValueError
+        si no se puede abrir un paquete. Los bytes cuentan como vivos desde
+        ya y el archivo se registra después con attach
+        """
+        request = PendingAppend(data)
+        with self.lock:
+            self.pending.append(request)
+        with self.append_lock:
+            # Otro hilo pudo escribirlo en su lote mientras se esperaba el lock
+            try:
+                while not request.done:
+                    self.append_pending()
+            finally:
+                if not request.done:
+                    with self.lock:
+                        self.pending.remove(request)
+        return request.location
+    
+    def append_pending(self):
+        """
+        Escribe en un único añadido los archivos en espera que caben en el
+        paquete abierto (con append_lock tomado)
+        """
+        with self.lock:
+            pack = self.packs.get(self.open_pack) if self.open_pack else None
+            first_size = len(self.pending[0].data)
+        if pack is None or pack.written + first_size > BLOCK_SIZE:
+            pack = self.open_new_pack()
+        
+        batch: List[PendingAppend] = []
+        with self.lock:
+            room = BLOCK_SIZE - pack.written
+            while self.pending and len(self.pending[0].data) <= room:
+                request = self.pending.pop(0)
+                batch.append(request)
+                room -= len(request.data)
+            pack.live += sum(len(request.data) for request in batch)
+        
+        try:
+            locations = self.write_batch(pack, batch)
+        except Exception as e:
+            print(f"Error añadiendo datos al paquete {pack.pack_id}: {e}")
+            locations = None
+        if locations is None:
+            # Un nodo pudo escribir sin llegar a responder: no volver a añadir a este paquete
+            self.failed_appends += 1
+            with self.lock:
+                pack.live -= sum(len(request.data) for request in batch)
+                if self.open_pack == pack.pack_id:
+                    self.open_pack = None
+            locations = [None] * len(batch)
+        for request, location in zip(batch, locations):
+            request.location = location
+            request.done = True
+    
+    def write_batch(self, pack: Pack, batch: List[PendingAppend]) -> Optional[List[Tuple[str, int, int]]]:
+        """
+        Añade los datos del lote al bloque del paquete en ambas copias
+        Retorna la ubicación de cada archivo o None si ningún nodo confirmó
+        """
+        entry = self.coordinator.block_table.get_file_block(pack.pack_id, 0)
+        offset = position = pack.written
+        checksum = entry.checksum or 0
+        locations = []
+        for request in batch:
+            checksum = calculate_checksum(request.data, checksum)
+            locations.append((pack.pack_id, position, checksum))
+            position += len(request.data)
+        
+        block_info = {
+            "block_id": entry.block_id,
+            "file_id": pack.pack_id,
+            "block_number": 0,
+            "offset": offset,
+            "block_data": base64.b64encode(b''.join(request.data for request in batch)).decode('utf-8'),
+            "checksum": checksum
+        }
+        confirmed = self.coordinator.store_block_assignments({
+            entry.node_id: [block_info],
+            entry.replica_node_id: [{**block_info, "is_replica": True}]
+        })
+        stored = {is_replica for _, block_id, is_replica in confirmed if block_id == entry.block_id}
+        if not stored:
+            return None
+        
+        self.coordinator.block_table.set_checksums({entry.block_id: checksum})
+        pack.written = position
+        # La copia que no confirmó queda desfasada: se rehace desde la otra
+        for node_id, is_replica in ((entry.node_id, False), (entry.replica_node_id, True)):
+            if node_id and is_replica not in stored:
+                self.coordinator.handle_corrupt_copy(entry.block_id, node_id, is_replica)
+        return locations
+    
+    def attach(self, file_info):
+        """Registra en su paquete un archivo cuyos datos ya se añadieron con store"""
+        with self.lock:
+            pack = self.packs.get(file_info.pack_id)
+            if pack is not None:
+                pack.files.add(file_info.file_id)
+    
+    def release(self, file_info):
+        """Marca como muerto el rango de un archivo eliminado"""
+        with self.lock:
+            pack = self.packs.get(file_info.pack_id)
+            if pack is None:
+                return
+            pack.live -= file_info.size
+            pack.files.discard(file_info.file_id)
+        self.free_if_empty(pack)
+    
+    def free_if_empty(self, pack: Pack):
+        """Libera el bloque de un paquete sellado sin archivos vivos y encola el borrado de sus copias"""
+        with self.lock:
+            if self.packs.get(pack.pack_id) is not pack or pack.live > 0 or pack.pack_id == self.open_pack:
+                return
+            del self.packs[pack.pack_id]
+        coordinator = self.coordinator
+        freed = coordinator.block_table.free_blocks(pack.pack_id)
+        for block_entry in freed:
+            for node_id in [block_entry.node_id, block_entry.replica_node_id]:
+                coordinator.garbage_collector.enqueue(node_id, block_entry.block_id, pack.pack_id)
+        coordinator.log_mutation({"op": "free_pack", "pack_id": pack.pack_id})
+        coordinator.events.publish("blocks", "blocks_freed", f"file:{pack.pack_id}", {
+            "file_id": pack.pack_id,
+            "block_ids": [block_entry.block_id for block_entry in freed]
+        })
+        self.freed_packs += 1
+    
+    # --- Lectura ---
+    
+    def read(self, file_info) -> Optional[str]:
+        """
+        Obtiene (en base64) el fragmento de un archivo empaquetado, primero de
+        la copia del paquete en el nodo más sano. El fragmento se verifica con
+        el checksum del archivo; la copia que no lo tiene o no coincide se
+        repara desde la otra
+        """
+        entry = self.coordinator.block_table.get_file_block(file_info.pack_id, 0)
+        if not entry:
+            return None
+        for node_id, is_replica in self.coordinator.order_copies(entry):
+            if not node_id:
+                continue
+            try:
+                response = self.coordinator.send_node_request(node_id, MessageType.RETRIEVE_BLOCK, {
+                    "block_id": entry.block_id,
+                    "file_id": file_info.pack_id,
+                    "block_number": 0,
+                    "offset": file_info.pack_offset,
+                    "length": file_info.size
+                })
+            except Exception as e:
+                print(f"Error obteniendo {file_info.file_id} del paquete en el nodo {node_id}: {e}")
+                continue
+            if not response:
+                continue
+            
+            data = response.get("data", {})
+            if response.get("type") == MessageType.BLOCK_RETRIEVED.value:
+                block_data = data.get("block_data", "")
+                if calculate_checksum(base64.b64decode(block_data)) == file_info.pack_checksum:
+                    return block_data
+                print(f"Checksum inesperado de {file_info.file_id} en el paquete de {node_id}")
+            elif not data.get("stale"):
+                continue
+            self.coordinator.handle_corrupt_copy(entry.block_id, node_id, is_replica)
+        return None
+    
+    # --- Compactación ---
+    
+    def compact(self) -> int:
+        """Libera los paquetes vacíos y compacta los que tienen demasiado espacio muerto"""
+        with self.lock:
+            sealed = [pack for pack in self.packs.values() if pack.pack_id != self.open_pack]
+        moved = 0
+        for pack in sealed:
+            if pack.live <= 0:
+                self.free_if_empty(pack)
+            elif pack.dead_ratio() >= self.threshold:
+                moved += self.compact_pack(pack)
+        return moved
+    
+    def compact_pack(self, pack: Pack) -> int:
+        """
+        Copia los archivos vivos de un paquete al paquete abierto y lo libera
+        Retorna los archivos reubicados
+        """
+        coordinator = self.coordinator
+        moved = 0
+        with self.lock:
+            file_ids = sorted(pack.files)
+        for file_id in file_ids:
+            with coordinator.files_lock:
+                file_info = coordinator.files.get(file_id)
+            if not file_info or file_info.pack_id != pack.pack_id:
+                continue
+            block_data = self.read(file_info)
+            location = self.store(base64.b64decode(block_data)) if block_data is not None else None
+            if location is None:
+                print(f"No se pudo reubicar {file_id}; el paquete se compactará más tarde")
+                break
+            pack_id, offset, block_checksum = location
+            
+            # El archivo pudo borrarse mientras se copiaba
+            with coordinator.files_lock:
+                relocated = coordinator.files.get(file_id) is file_info
+                if relocated:
+                    coordinator.files[file_id] = replace(file_info, pack_id=pack_id, pack_offset=offset)
+                    coordinator.files_version += 1
+                with self.lock:
+                    if relocated:
+                        pack.live -= file_info.size
+                        pack.files.discard(file_id)
+                        self.packs[pack_id].files.add(file_id)
+                    else:
+                        self.packs[pack_id].live -= file_info.size
+            if relocated:
+                coordinator.log_mutation({"op": "repack_file", "file_id": file_id, "pack_id": pack_id,
+                                          "pack_offset": offset, "pack_block_checksum": block_checksum})
+                moved += 1
+        
+        self.compacted_files += moved
+        self.free_if_empty(pack)
+        return moved
+    
+    def metrics(self) -> dict:
+        """Métricas de los paquetes de archivos pequeños"""
+        with self.lock:
+            written = sum(pack.written for pack in self.packs.values())
+            live = sum(pack.live for pack in self.packs.values())
+            packed_files = sum(len(pack.files) for pack in self.packs.values())
+            packs = len(self.packs)
+        return {
+            "packs": packs,
+            "packed_files": packed_files,
+            "live_bytes": live,
+            "dead_bytes": written - live,
+            "compacted_files": self.compacted_files,
+            "freed_packs": self.freed_packs,
+            "failed_appends": self.failed_appends
+        }
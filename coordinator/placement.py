@@ -0,0 +1,181 @@
+"""
+Políticas de colocación de bloques en nodos
+"""
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BLOCK_SIZE
+
+@dataclass
+class NodeLoad:
+    """Capacidad y carga de un nodo vista por la política de colocación"""
+    node_id: str
+    capacity: int  # en bytes
+    used: int = 0  # en bytes
+    load: int = 0  # peticiones en curso reportadas en el heartbeat
+    latency: float = 0.0  # latencia de disco (ms) reportada en el heartbeat
+    healthy: bool = True  # sin errores recientes ni disco lento
+    
+    @property
+    def free(self) -> int:
+        return max(0, self.capacity - self.used)
+    
+    @property
+    def fill_ratio(self) -> float:
+        return self.used / self.capacity if self.capacity else 1.0
+
+class PlacementPolicy:
+    """Política base: elige nodos distintos para original y réplicas"""
+    
+    name = "base"
+    
+    def __init__(self, rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random()
+    
+    def candidates(self, nodes: Dict[str, NodeLoad], block_size: int) -> List[NodeLoad]:
+        """Nodos elegibles: los que tienen espacio para un bloque más"""
+        return [n for n in nodes.values() if n.free >= block_size]
+    
+    def choose(self, candidates: List[NodeLoad], count: int) -> List[NodeLoad]:
+        """Elige count nodos distintos entre los candidatos"""
+        raise NotImplementedError
+    
+    def place(self, nodes: Dict[str, NodeLoad], num_blocks: int, copies: int = 2,
+              block_size: int = BLOCK_SIZE) -> List[List[str]]:
+        """
+        Asigna nodos para num_blocks bloques con copies copias cada uno
+        Retorna una lista [node_id, replica_node_id, ...] por bloque y
+        actualiza el espacio usado de cada NodeLoad
+        """
+        placements = []
+        for _ in range(num_blocks):
+            candidates = self.candidates(nodes, block_size)
+            # Evitar los nodos con errores o disco lento mientras haya alternativas
+            healthy = [node for node in candidates if node.healthy]
+            if len(healthy) >= copies:
+                candidates = healthy
+            if len(candidates) < copies:
+                raise ValueError("No hay suficientes nodos con espacio libre para colocar el bloque y su réplica")
+            
+            chosen = self.choose(candidates, copies)
+            if any(node.free < block_size for node in chosen):
+                raise ValueError("El nodo elegido no tiene espacio libre para el bloque")
+            for node in chosen:
+                node.used += block_size
+            placements.append([node.node_id for node in chosen])
+        return placements
+
+class RoundRobinPolicy(PlacementPolicy):
+    """Reparto circular (comportamiento original, ignora capacidad)"""
+    
+    name = "round_robin"
+    
+    def __init__(self, rng: Optional[random.Random] = None):
+        super().__init__(rng)
+        self.position = 0
+    
+    def candidates(self, nodes: Dict[str, NodeLoad], block_size: int) -> List[NodeLoad]:
+        return list(nodes.values())
+    
+    def choose(self, candidates: List[NodeLoad], count: int) -> List[NodeLoad]:
+        ordered = sorted(candidates, key=lambda n: n.node_id)
+        start = self.position % len(ordered)
+        self.position += 1
+        return [ordered[(start + k) % len(ordered)] for k in range(count)]
+
+class WeightedRandomPolicy(PlacementPolicy):
+    """Elección aleatoria ponderada por espacio libre"""
+    
+    name = "weighted_random"
+    
+    def choose(self, candidates: List[NodeLoad], count: int) -> List[NodeLoad]:
+        remaining = list(candidates)
+        chosen = []
+        for _ in range(count):
+            pick = self.rng.choices(remaining, weights=[n.free for n in remaining])[0]
+            chosen.append(pick)
+            remaining.remove(pick)
+        return chosen
+
+class LeastLoadedPolicy(PlacementPolicy):
+    """Elige los nodos con menos peticiones en curso y, a igualdad, más rápidos y menos llenos"""
+    
+    name = "least_loaded"
+    
+    def choose(self, candidates: List[NodeLoad], count: int) -> List[NodeLoad]:
+        return sorted(candidates, key=lambda n: (n.load, n.latency, n.fill_ratio, n.node_id))[:count]
+
+class PowerOfTwoChoicesPolicy(PlacementPolicy):
+    """Para cada copia toma dos nodos al azar y se queda con el menos lleno"""
+    
+    name = "power_of_two"
+    
+    def choose(self, candidates: List[NodeLoad], count: int) -> List[NodeLoad]:
+        remaining = list(candidates)
+        chosen = []
+        for _ in range(count):
+            if len(remaining) == 1:
+                pick = remaining[0]
+            else:
+                a, b = self.rng.sample(remaining, 2)
+                pick = min(a, b, key=lambda n: (n.fill_ratio, n.load, n.latency))
+            chosen.append(pick)
+            remaining.remove(pick)
+        return chosen
+
+PLACEMENT_POLICIES = {
+    policy.name: policy
+    for policy in (RoundRobinPolicy, WeightedRandomPolicy, LeastLoadedPolicy, PowerOfTwoChoicesPolicy)
+}
+
+def create_policy(name: str, rng: Optional[random.Random] = None) -> PlacementPolicy:
+    """Crea una política de colocación por nombre"""
+    if name not in PLACEMENT_POLICIES:
+        raise ValueError(f"Política de colocación desconocida: {name}")
+    return PLACEMENT_POLICIES[name](rng)
+
+def utilization_skew(nodes: Dict[str, NodeLoad]) -> float:
+    """Diferencia entre el nodo más lleno y el menos lleno (0.0 - 1.0)"""
+    ratios = [n.fill_ratio for n in nodes.values()]
+    return max(ratios) - min(ratios) if ratios else 0.0
+
+def simulate(policy_name: str, capacities_mb: List[int], seed: int = 0, max_file_blocks: int = 8,
+             probe_fill: float = 0.5):
+    """
+    Simula subidas de archivos aleatorios hasta que una falla por falta de espacio
+    Retorna (bloques colocados, sesgo de utilización cuando el clúster alcanza probe_fill)
+    """
+    rng = random.Random(seed)
+    policy = create_policy(policy_name, random.Random(seed))
+    nodes = {f"nodo{i + 1}": NodeLoad(f"nodo{i + 1}", mb * BLOCK_SIZE)
+             for i, mb in enumerate(capacities_mb)}
+    capacity = sum(n.capacity for n in nodes.values())
+    
+    placed = 0
+    skew = None
+    while True:
+        num_blocks = rng.randint(1, max_file_blocks)
+        try:
+            policy.place(nodes, num_blocks)
+        except ValueError:
+            return placed, skew if skew is not None else utilization_skew(nodes)
+        placed += num_blocks
+        if skew is None and sum(n.used for n in nodes.values()) >= capacity * probe_fill:
+            skew = utilization_skew(nodes)
+
+if __name__ == "__main__":
+    # Benchmark de simulación: nodos heterogéneos de 50 a 100 MB
+    capacities = [50, 50, 60, 75, 90, 100, 100]
+    total = sum(capacities)
+    print(f"Nodos (MB): {capacities}  capacidad total: {total} bloques ({total // 2} con réplica)")
+    print(f"{'política':<16}{'bloques colocados':>20}{'aprovechamiento':>18}{'sesgo al 50%':>14}")
+    for name in PLACEMENT_POLICIES:
+        results = [simulate(name, capacities, seed) for seed in range(5)]
+        placed = sum(r[0] for r in results) / len(results)
+        skew = sum(r[1] for r in results) / len(results)
+        print(f"{name:<16}{placed:>20.1f}{placed * 2 / total:>17.1%}{skew:>14.3f}")
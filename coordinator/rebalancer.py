@@ -0,0 +1,172 @@
+"""
+Rebalanceo de bloques entre nodos en segundo plano
+"""
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    BLOCK_SIZE, REBALANCE_INTERVAL, REBALANCE_TARGET_SKEW, REBALANCE_BANDWIDTH, REBALANCE_MAX_LOAD
+)
+from common.protocol import MessageType
+from coordinator.placement import NodeLoad, utilization_skew
+from coordinator.replication import TokenBucket
+
+class Rebalancer:
+    """
+    Mueve copias de bloques de los nodos más llenos a los más vacíos
+    
+    Los nodos que se unen después sólo reciben bloques de subidas nuevas;
+    el rebalanceador iguala la ocupación moviendo una copia cada vez del
+    nodo más lleno al menos lleno hasta que el sesgo de ocupación queda
+    dentro de target_skew. Se pausa mientras hay reparaciones pendientes o
+    la carga de los clientes supera max_load, y limita su ancho de banda.
+    """
+    
+    def __init__(self, coordinator, target_skew: float = REBALANCE_TARGET_SKEW,
+                 bandwidth: float = REBALANCE_BANDWIDTH, max_load: int = REBALANCE_MAX_LOAD,
+                 interval: float = REBALANCE_INTERVAL):
+        self.coordinator = coordinator
+        self.target_skew = target_skew
+        self.bandwidth = TokenBucket(bandwidth)
+        self.max_load = max_load
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        
+        # Métricas
+        self.moved = 0
+        self.bytes_moved = 0
+        self.failed = 0
+        self.skew = 0.0
+        self.state = "idle"
+    
+    def start(self):
+        """Inicia el hilo de rebalanceo"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def trigger(self):
+        """Solicita una pasada inmediata (por ejemplo al unirse un nodo)"""
+        self.wakeup.set()
+    
+    def run(self):
+        """Bucle principal: una pasada por intervalo o al ser despertado"""
+        while self.coordinator.running:
+            self.wakeup.wait(timeout=self.interval)
+            self.wakeup.clear()
+            try:
+                self.rebalance()
+            except Exception as e:
+                print(f"Error rebalanceando bloques: {e}")
+            self.state = "idle"
+    
+    def node_loads(self) -> Dict[str, NodeLoad]:
+        """Ocupación de los nodos activos según la tabla de bloques"""
+        loads = self.coordinator.get_node_loads()
+        usage = self.coordinator.block_table.node_usage()
+        for node_id, load in loads.items():
+            load.used = usage.get(node_id, 0)
+        return loads
+    
+    def foreground_busy(self) -> bool:
+        """Hay reparaciones pendientes o demasiadas peticiones de clientes en curso"""
+        if self.coordinator.replication.metrics()["queue_length"] > 0:
+            return True
+        return sum(load.load for load in self.coordinator.get_node_loads().values()) >= self.max_load
+    
+    def rebalance(self):
+        """Mueve bloques hasta que el sesgo de ocupación esté dentro de la banda"""
+        while self.coordinator.running:
+            loads = self.node_loads()
+            if len(loads) < 2:
+                return
+            self.skew = utilization_skew(loads)
+            if self.skew <= self.target_skew:
+                return
+            
+            if self.foreground_busy():
+                self.state = "paused"
+                time.sleep(1)
+                continue
+            self.state = "moving"
+            
+            source = max(loads.values(), key=lambda n: n.fill_ratio)
+            target = min(loads.values(), key=lambda n: n.fill_ratio)
+            # Sólo mover si el movimiento reduce la diferencia entre ambos
+            if (target.free < BLOCK_SIZE or
+                    (target.used + BLOCK_SIZE) / target.capacity > (source.used - BLOCK_SIZE) / source.capacity):
+                return
+            
+            candidate = self.pick_block(source.node_id, target.node_id)
+            if candidate is None:
+                return
+            block_id, is_replica = candidate
+            if not self.move_block(block_id, is_replica, source.node_id, target.node_id):
+                self.failed += 1
+                return
+    
+    def pick_block(self, source_id: str, target_id: str) -> Optional[Tuple[int, bool]]:
+        """Elige una copia en source_id que pueda moverse a target_id"""
+        for entry in self.coordinator.block_table.get_node_blocks(source_id):
+            if target_id in (entry.node_id, entry.replica_node_id):
+                continue
+            # No tocar bloques degradados: primero los repara la re-replicación
+            if not (entry.node_durable and entry.replica_durable):
+                continue
+            if entry.node_id == source_id:
+                return entry.block_id, False
+            if entry.replica_node_id == source_id:
+                return entry.block_id, True
+        return None
+    
+    def move_block(self, block_id: int, is_replica: bool, source_id: str, target_id: str) -> bool:
+        """Copia el bloque de source_id a target_id, reasigna la copia y encola el borrado de la original"""
+        coordinator = self.coordinator
+        entry = coordinator.block_table.get_block_info(block_id)
+        target = coordinator.nodes.get(target_id)
+        if not entry or not target:
+            return False
+        
+        expected = (entry.file_id, entry.block_number, entry.checksum, source_id)
+        self.bandwidth.consume(BLOCK_SIZE)
+        try:
+            response = coordinator.send_node_request(source_id, MessageType.REPLICATE_BLOCK, {
+                "block_id": block_id,
+                "file_id": expected[0],
+                "block_number": expected[1],
+                "checksum": expected[2],
+                "is_replica": is_replica,
+                "target_node_id": target_id,
+                "target_address": target.address,
+                "target_port": target.port
+            }, timeout=30)
+        except Exception as e:
+            print(f"Error moviendo bloque {block_id} de {source_id} a {target_id}: {e}")
+            return False
+        if not response or response.get("type") != MessageType.SUCCESS.value:
+            return False
+        if not any(result.get("stored") for result in response.get("data", {}).get("results", [])):
+            return False
+        
+        if not coordinator.move_block_copy(block_id, target_id, is_replica, expected):
+            return False
+        coordinator.garbage_collector.enqueue(source_id, block_id, expected[0])
+        self.moved += 1
+        self.bytes_moved += BLOCK_SIZE
+        return True
+    
+    def metrics(self) -> dict:
+        """Métricas del rebalanceo"""
+        return {
+            "state": self.state,
+            "skew": round(self.skew, 4),
+            "target_skew": self.target_skew,
+            "moved": self.moved,
+            "bytes_moved": self.bytes_moved,
+            "failed": self.failed
+        }
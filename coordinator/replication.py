@@ -0,0 +1,255 @@
+"""
+Re-replicación automática de bloques tras la pérdida de un nodo
+"""
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    BLOCK_SIZE, REPAIR_CONCURRENCY, REPAIR_BANDWIDTH, REPAIR_RETRY_BACKOFF, REPAIR_RETRY_MAX_BACKOFF
+)
+from common.protocol import MessageType
+
+class TokenBucket:
+    """Limitador de ancho de banda compartido por los hilos de reparación"""
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.time()
+        self.lock = threading.Lock()
+    
+    def consume(self, amount: int):
+        """Bloquea hasta disponer de amount bytes de presupuesto"""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= amount or self.tokens >= self.rate:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ReplicationManager:
+    """
+    Cola priorizada de reparaciones de bloques
+    
+    Cuando un nodo se pierde, cada bloque que tenía una copia en él entra en
+    la cola; los bloques con menos copias vivas salen primero. Un número
+    limitado de hilos copia cada bloque directamente desde el nodo que
+    sobrevive hacia un destino elegido por la política de colocación, bajo
+    un límite de ancho de banda para no afectar al tráfico de los clientes.
+    Una reparación fallida (origen caído, sin destino, error al copiar) se
+    reintenta con una espera que se duplica en cada fallo.
+    """
+    
+    def __init__(self, coordinator, concurrency: int = REPAIR_CONCURRENCY,
+                 bandwidth: float = REPAIR_BANDWIDTH):
+        self.coordinator = coordinator
+        self.concurrency = concurrency
+        self.bandwidth = TokenBucket(bandwidth)
+        
+        self.queue: List[Tuple[int, int, int, bool]] = []  # (copias vivas, orden, block_id, is_replica)
+        self.queued = set()  # (block_id, is_replica) en cola, en curso o esperando reintento
+        self.retries: List[Tuple[float, int, bool]] = []  # (momento del reintento, block_id, is_replica)
+        self.attempts: Dict[Tuple[int, bool], int] = {}  # fallos seguidos de cada reparación
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.workers: List[threading.Thread] = []
+        
+        # Métricas
+        self.in_progress = 0
+        self.repaired = 0
+        self.failed = 0
+        self.unrecoverable = 0
+        self.degraded_since: Optional[float] = None
+        self.last_time_to_redundancy: Optional[float] = None
+        self.lost_while_degraded = 0  # bloques irrecuperables desde que empezó la degradación
+    
+    def start(self):
+        """Inicia los hilos de reparación"""
+        for _ in range(self.concurrency):
+            worker = threading.Thread(target=self.worker_loop, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    
+    def live_copies(self, entry) -> int:
+        """Copias del bloque en nodos vivos"""
+        return sum(1 for nid in (entry.node_id, entry.replica_node_id)
+                   if nid and self.coordinator.is_node_alive(nid))
+    
+    def enqueue_node_loss(self, node_id: str) -> int:
+        """Encola la reparación de todas las copias que vivían en node_id"""
+        enqueued = 0
+        for entry in self.coordinator.block_table.get_node_blocks(node_id):
+            for lost_id, is_replica in ((entry.node_id, False), (entry.replica_node_id, True)):
+                if lost_id == node_id and self.enqueue(entry, is_replica):
+                    enqueued += 1
+        if enqueued:
+            print(f"Re-replicación: {enqueued} copias de {node_id} en cola")
+        return enqueued
+    
+    def enqueue(self, entry, is_replica: bool) -> bool:
+        """Encola la reparación de una copia de un bloque"""
+        live = self.live_copies(entry)
+        if live == 0:
+            with self.lock:
+                self.unrecoverable += 1
+                if self.degraded_since is not None:
+                    self.lost_while_degraded += 1
+            print(f"Bloque {entry.block_id} sin copias vivas, no se puede re-replicar")
+            return False
+        
+        key = (entry.block_id, is_replica)
+        with self.lock:
+            if key in self.queued:
+                return False
+            self.queued.add(key)
+            heapq.heappush(self.queue, (live, next(self.counter), entry.block_id, is_replica))
+            if self.degraded_since is None:
+                self.degraded_since = time.time()
+            self.available.notify()
+        return True
+    
+    def requeue_due_retries(self):
+        """Devuelve a la cola los reintentos cuya espera terminó (con lock tomado)"""
+        now = time.time()
+        while self.retries and self.retries[0][0] <= now:
+            _, block_id, is_replica = heapq.heappop(self.retries)
+            entry = self.coordinator.block_table.get_block_info(block_id)
+            live = self.live_copies(entry) if entry and entry.file_id else 0
+            if live == 0:
+                # El archivo se eliminó o ya no queda ninguna copia de la que partir
+                self.queued.discard((block_id, is_replica))
+                self.attempts.pop((block_id, is_replica), None)
+                if entry and entry.file_id:
+                    self.unrecoverable += 1
+                    self.lost_while_degraded += 1
+                    print(f"Bloque {block_id} sin copias vivas, no se puede re-replicar")
+                continue
+            heapq.heappush(self.queue, (live, next(self.counter), block_id, is_replica))
+        self.finish_if_idle()
+    
+    def worker_loop(self):
+        """Toma reparaciones de la cola y las ejecuta"""
+        while self.coordinator.running:
+            with self.lock:
+                self.requeue_due_retries()
+                while not self.queue and self.coordinator.running:
+                    wait = min(1.0, self.retries[0][0] - time.time()) if self.retries else 1.0
+                    self.available.wait(timeout=max(wait, 0.01))
+                    self.requeue_due_retries()
+                if not self.queue:
+                    continue
+                _, _, block_id, is_replica = heapq.heappop(self.queue)
+                self.in_progress += 1
+            
+            try:
+                ok = self.repair(block_id, is_replica)
+            except Exception as e:
+                print(f"Error re-replicando bloque {block_id}: {e}")
+                ok = False
+            
+            key = (block_id, is_replica)
+            with self.lock:
+                self.in_progress -= 1
+                if ok:
+                    self.repaired += 1
+                    self.queued.discard(key)
+                    self.attempts.pop(key, None)
+                else:
+                    self.failed += 1
+                    self.attempts[key] = self.attempts.get(key, 0) + 1
+                    backoff = min(REPAIR_RETRY_BACKOFF * 2 ** (self.attempts[key] - 1), REPAIR_RETRY_MAX_BACKOFF)
+                    heapq.heappush(self.retries, (time.time() + backoff, block_id, is_replica))
+                self.finish_if_idle()
+    
+    def finish_if_idle(self):
+        """
+        Cierra el periodo degradado cuando no queda nada pendiente (con lock tomado)
+        El tiempo hasta la redundancia completa sólo se registra si no se
+        perdió ningún bloque por el camino
+        """
+        if self.queue or self.retries or self.in_progress or self.degraded_since is None:
+            return
+        if self.lost_while_degraded:
+            print(f"Re-replicación terminada con {self.lost_while_degraded} bloques sin copias vivas")
+        else:
+            self.last_time_to_redundancy = time.time() - self.degraded_since
+            print(f"Redundancia completa restaurada en {self.last_time_to_redundancy:.1f} s")
+        self.degraded_since = None
+        self.lost_while_degraded = 0
+    
+    def choose_target(self, entry, source_id: str) -> Optional[str]:
+        """Elige con la política de colocación un nodo vivo distinto del origen"""
+        loads = {nid: load for nid, load in self.coordinator.get_node_loads().items()
+                 if nid != source_id and load.free >= BLOCK_SIZE}
+        if not loads:
+            return None
+        return self.coordinator.placement.choose(list(loads.values()), 1)[0].node_id
+    
+    def repair(self, block_id: int, is_replica: bool) -> bool:
+        """Copia un bloque desde la copia superviviente a un nodo nuevo"""
+        coordinator = self.coordinator
+        entry = coordinator.block_table.get_block_info(block_id)
+        if not entry or not entry.file_id:
+            return True  # el archivo se eliminó mientras esperaba
+        
+        lost_id = entry.replica_node_id if is_replica else entry.node_id
+        if lost_id and coordinator.is_node_alive(lost_id):
+            return True  # el nodo volvió o la copia ya fue reparada
+        source_id = entry.node_id if is_replica else entry.replica_node_id
+        if not source_id or not coordinator.is_node_alive(source_id):
+            return False
+        
+        target_id = self.choose_target(entry, source_id)
+        if not target_id:
+            print(f"Sin nodo destino para re-replicar el bloque {block_id}")
+            return False
+        target = coordinator.nodes.get(target_id)
+        
+        self.bandwidth.consume(BLOCK_SIZE)
+        # La entrada puede cambiar durante la copia: se reasigna sólo si sigue igual
+        expected = (entry.file_id, entry.block_number, entry.checksum, lost_id)
+        response = coordinator.send_node_request(source_id, MessageType.REPLICATE_BLOCK, {
+            "block_id": block_id,
+            "file_id": expected[0],
+            "block_number": expected[1],
+            "checksum": expected[2],
+            "is_replica": is_replica,
+            "target_node_id": target_id,
+            "target_address": target.address,
+            "target_port": target.port
+        }, timeout=30)
+        if not response or response.get("type") != MessageType.SUCCESS.value:
+            return False
+        results = response.get("data", {}).get("results", [])
+        if not any(result.get("stored") for result in results):
+            return False
+        
+        # Si no se reasigna, repair se reintenta y decide con la entrada nueva
+        return coordinator.move_block_copy(block_id, target_id, is_replica, expected)
+    
+    def metrics(self) -> dict:
+        """Métricas de la cola de reparación"""
+        with self.lock:
+            degraded_for = time.time() - self.degraded_since if self.degraded_since else 0
+            return {
+                "queue_length": len(self.queue),
+                "in_progress": self.in_progress,
+                "retrying": len(self.retries),
+                "repaired": self.repaired,
+                "failed": self.failed,
+                "unrecoverable": self.unrecoverable,
+                "degraded_seconds": round(degraded_for, 3),
+                "last_time_to_full_redundancy": self.last_time_to_redundancy
+            }
@@ -0,0 +1,96 @@
+"""
+Almacén de metadatos de bloques del nodo (SQLite en modo WAL)
+"""
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+class BlockMetadataStore:
+    """
+    Metadatos de bloques persistidos de forma incremental
+    
+    Cada bloque es una fila (block_id, file_id, info JSON). Las altas y bajas
+    se acumulan en la transacción abierta y se confirman con commit(), de
+    modo que un lote de STORE_BLOCK cuesta un único commit. Dentro de
+    batch() los commits intermedios del hilo se posponen hasta que su lote
+    termina; cada lote confirma al salir aunque otros sigan abiertos (la
+    conexión es compartida, así que también confirma lo que lleven ellos).
+    """
+    
+    def __init__(self, db_path: str, durable: bool = True):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.local = threading.local()  # profundidad de lotes del hilo
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # FULL sincroniza el WAL en cada commit: una copia confirmada al
+        # coordinador no pierde su fila aunque se corte la corriente
+        self.conn.execute("PRAGMA synchronous=FULL" if durable else "PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS blocks ("
+            "block_id INTEGER PRIMARY KEY, file_id TEXT NOT NULL, info TEXT NOT NULL)")
+        self.conn.commit()
+    
+    def load(self) -> Dict[str, Dict]:
+        """Carga todos los metadatos (block_id como texto -> info)"""
+        with self.lock:
+            rows = self.conn.execute("SELECT block_id, info FROM blocks").fetchall()
+        return {str(block_id): json.loads(info) for block_id, info in rows}
+    
+    def import_json(self, json_path: str):
+        """Importa un .metadata.json de versiones anteriores y lo elimina"""
+        with open(json_path, 'r') as f:
+            blocks = json.load(f)
+        with self.batch():
+            for info in blocks.values():
+                self.upsert(info)
+        os.remove(json_path)
+    
+    def upsert(self, info: Dict):
+        """Inserta o reemplaza los metadatos de un bloque"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO blocks (block_id, file_id, info) VALUES (?, ?, ?)",
+                (int(info["block_id"]), info.get("file_id", ""), json.dumps(info, separators=(',', ':'))))
+            self.commit()
+    
+    def delete(self, block_id: int):
+        """Elimina los metadatos de un bloque"""
+        with self.lock:
+            self.conn.execute("DELETE FROM blocks WHERE block_id = ?", (int(block_id),))
+            self.commit()
+    
+    def in_batch(self) -> bool:
+        """Indica si el hilo actual tiene un lote abierto"""
+        return getattr(self.local, "depth", 0) > 0
+    
+    def commit(self):
+        """Confirma la transacción salvo que el hilo actual tenga un lote abierto"""
+        with self.lock:
+            if not self.in_batch():
+                self.conn.commit()
+    
+    @contextmanager
+    def batch(self, commit: bool = True):
+        """
+        Agrupa varias operaciones del hilo en un único commit al final
+        Con commit=False el hilo trabaja para el lote de otro hilo (los
+        que escriben en paralelo un STORE_BLOCK) y es ése quien confirma
+        """
+        self.local.depth = getattr(self.local, "depth", 0) + 1
+        try:
+            yield self
+        finally:
+            self.local.depth -= 1
+            if commit and self.local.depth == 0:
+                with self.lock:
+                    self.conn.commit()
+    
+    def close(self):
+        """Cierra la base de datos"""
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
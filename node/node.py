@@ -7,23 +7,29 @@ import time
 import os
 import base64
 import uuid
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import (
     COORDINATOR_HOST, COORDINATOR_PORT, SHARED_DIRECTORY,
-    MIN_SHARED_SPACE, MAX_SHARED_SPACE, HEARTBEAT_INTERVAL, BLOCK_SIZE
+    MIN_SHARED_SPACE, MAX_SHARED_SPACE, HEARTBEAT_INTERVAL, BLOCK_SIZE, STORAGE_BACKEND,
+    STORE_WRITE_WORKERS, INVENTORY_DIGEST_INTERVAL, ORPHAN_GRACE_PERIOD
+)
+from common.protocol import (
+    MessageType, receive_message, send_message, pack_block_report, pack_id_ranges
 )
-from common.protocol import MessageType, receive_message, send_message
 from node.storage import BlockStorage
+from node.segment_storage import SegmentBlockStorage
 from common.utils import ensure_directory
 
 class Node:
     """Nodo del sistema distribuido"""
     
-    def __init__(self, node_id: Optional[str] = None, shared_space_size: Optional[int] = None, coordinator_host: Optional[str] = None):
+    def __init__(self, node_id: Optional[str] = None, shared_space_size: Optional[int] = None, coordinator_host: Optional[str] = None,
+                 storage_backend: Optional[str] = None):
         self.node_id = node_id or f"node_{uuid.uuid4().hex[:8]}"
         self.shared_space_size = shared_space_size or MIN_SHARED_SPACE
         self.coordinator_host = coordinator_host or COORDINATOR_HOST
@@ -32,27 +38,45 @@ class Node:
         self.shared_space_path = os.path.join(os.getcwd(), self.node_id, SHARED_DIRECTORY)
         ensure_directory(self.shared_space_path)
         
-        # Almacenamiento de bloques
-        self.storage = BlockStorage(self.node_id, self.shared_space_path, self.shared_space_size)
+        # Almacenamiento de bloques: un archivo por bloque o segmentos log-structured
+        if (storage_backend or STORAGE_BACKEND) == "segments":
+            self.storage = SegmentBlockStorage(self.node_id, self.shared_space_path, self.shared_space_size)
+        else:
+            self.storage = BlockStorage(self.node_id, self.shared_space_path, self.shared_space_size)
         
-        # Conexión con coordinador
+        # Conexión con coordinador (la comparten el heartbeat y los avisos)
         self.coordinator_socket: Optional[socket.socket] = None
+        self.coordinator_send_lock = threading.Lock()
+        self.storage.on_corruption = self.report_corrupt_block
         self.running = False
         
         # Threads
         self.heartbeat_thread: Optional[threading.Thread] = None
+        self.digest_thread: Optional[threading.Thread] = None
         self.listener_thread: Optional[threading.Thread] = None
         
         # Socket para recibir conexiones del coordinador
         self.listener_socket: Optional[socket.socket] = None
         self.listener_port = 0
+        
+        # Hilos para escribir en paralelo los bloques de un lote
+        self.store_executor = ThreadPoolExecutor(max_workers=STORE_WRITE_WORKERS)
+        
+        # Comandos del coordinador en curso (carga reportada en el heartbeat)
+        self.active_commands = 0
+        self.active_commands_lock = threading.Lock()
+        
+        # Vista de los demás nodos, mantenida con los eventos del tema "nodes"
+        self.peers: Dict[str, Tuple[str, int]] = {}
+        self.departed_peers = set()
+        self.peers_lock = threading.Lock()
     
     def start(self):
         """Inicia el nodo"""
         # Conectar con coordinador
         try:
-            self.coordinator_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.coordinator_socket.connect((self.coordinator_host, COORDINATOR_PORT))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect((self.coordinator_host, COORDINATOR_PORT))
             
             # Iniciar socket listener para recibir comandos del coordinador
             self.listener_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -61,7 +85,10 @@ class Node:
             self.listener_socket.listen(5)
             
             # Registrar nodo en coordinador
-            self.register_with_coordinator()
+            self.register_with_coordinator(sock)
+            
+            # Tareas de mantenimiento del almacenamiento (conciliación de espacio, etc.)
+            self.storage.start_background_tasks()
             
             self.running = True
             
@@ -69,6 +96,10 @@ class Node:
             self.heartbeat_thread = threading.Thread(target=self.send_heartbeat, daemon=True)
             self.heartbeat_thread.start()
             
+            # Iniciar thread de conciliación de inventario
+            self.digest_thread = threading.Thread(target=self.send_inventory_digest, daemon=True)
+            self.digest_thread.start()
+            
             # Iniciar thread listener para comandos del coordinador
             self.listener_thread = threading.Thread(target=self.listen_for_commands, daemon=True)
             self.listener_thread.start()
@@ -77,15 +108,45 @@ class Node:
             print(f"Espacio compartido: {self.shared_space_size / (1024*1024):.2f} MB")
             print(f"Puerto listener: {self.listener_port}")
             
-            # Mantener conexión activa
-            self.handle_coordinator_messages()
-            
+            # Mantener conexión activa y reconectar si el coordinador se reinicia
+            while self.running:
+                self.handle_coordinator_messages()
+                if self.running:
+                    self.reconnect_to_coordinator()
+        
         except Exception as e:
             print(f"Error iniciando nodo: {e}")
             self.stop()
     
-    def register_with_coordinator(self):
-        """Registra el nodo con el coordinador"""
+    def reconnect_to_coordinator(self):
+        """Reintenta la conexión con el coordinador y vuelve a registrar el nodo"""
+        print("Conexión con el coordinador perdida, reintentando...")
+        try:
+            self.coordinator_socket.close()
+        except:
+            pass
+        
+        while self.running:
+            time.sleep(HEARTBEAT_INTERVAL)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.connect((self.coordinator_host, COORDINATOR_PORT))
+                # El registro incluye el inventario para que el coordinador
+                # reconstruya su tabla de bloques
+                self.register_with_coordinator(sock)
+                return
+            except Exception as e:
+                sock.close()
+                print(f"Coordinador no disponible: {e}")
+    
+    def register_with_coordinator(self, sock: socket.socket):
+        """
+        Registra el nodo con el coordinador a través de sock
+        El socket sólo pasa a ser coordinator_socket cuando el registro se
+        acepta, así ningún heartbeat se cuela antes del NODE_REGISTER ni
+        se lee otra respuesta en lugar de REGISTER_RESPONSE. Si el
+        coordinador rechaza el registro lanza ConnectionError
+        """
         try:
             # Intentar obtener IP local conectándose a un servidor externo
             s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -96,41 +157,103 @@ class Node:
             local_ip = "127.0.0.1"
         
         # Enviar registro sin node_id (o con None) para que el coordinador lo asigne
-        send_message(self.coordinator_socket, MessageType.NODE_REGISTER, {
+        send_message(sock, MessageType.NODE_REGISTER, {
             "node_id": self.node_id if self.node_id and self.node_id.startswith("nodo") else None,
             "address": local_ip,
             "port": self.listener_port,
-            "shared_space_size": self.shared_space_size
+            "shared_space_size": self.shared_space_size,
+            "block_report": pack_block_report(self.storage.get_stored_blocks()),
+            # Temas de eventos del clúster que usa el nodo
+            "subscriptions": ["nodes"]
         })
         
         # Esperar respuesta
-        response = receive_message(self.coordinator_socket)
-        if response and response.get("type") == MessageType.REGISTER_RESPONSE.value:
-            data = response.get("data", {})
-            if data.get("success"):
-                # Actualizar el node_id con el asignado por el coordinador
-                assigned_id = data.get("node_id")
-                if assigned_id:
-                    self.node_id = assigned_id
-                    print(f"Nodo registrado exitosamente como: {self.node_id}")
-                    print(f"Total de bloques en el sistema: {data.get('total_blocks', 0)}")
-                else:
-                    print(f"Nodo registrado exitosamente. Total de bloques: {data.get('total_blocks', 0)}")
-            else:
-                print("Error registrando nodo")
+        response = receive_message(sock)
+        if not response or response.get("type") != MessageType.REGISTER_RESPONSE.value:
+            raise ConnectionError("El coordinador no respondió al registro")
+        data = response.get("data", {})
+        if not data.get("success"):
+            raise ConnectionError("El coordinador rechazó el registro del nodo")
+        
+        with self.peers_lock:
+            self.peers = {peer_id: tuple(peer) for peer_id, peer in data.get("peers", {}).items()}
+            self.departed_peers = set()
+        
+        # Actualizar el node_id con el asignado por el coordinador
+        assigned_id = data.get("node_id")
+        if assigned_id:
+            self.node_id = assigned_id
+            print(f"Nodo registrado exitosamente como: {self.node_id}")
+            print(f"Total de bloques en el sistema: {data.get('total_blocks', 0)}")
+        else:
+            print(f"Nodo registrado exitosamente. Total de bloques: {data.get('total_blocks', 0)}")
+        
+        # Publicar el socket ya registrado para el resto de hilos
+        with self.coordinator_send_lock:
+            self.coordinator_socket = sock
+        
+        # Copias que ya se detectaron corruptas (p. ej. al recuperar los segmentos)
+        for block_id in list(self.storage.corrupt_blocks):
+            block_info = self.storage.blocks.get(str(block_id))
+            if block_info:
+                self.report_corrupt_block(block_info)
     
     def send_heartbeat(self):
         """Envía heartbeat periódico al coordinador"""
         while self.running:
             try:
-                if self.coordinator_socket:
-                    send_message(self.coordinator_socket, MessageType.NODE_HEARTBEAT, {
-                        "node_id": self.node_id
-                    })
+                self.send_to_coordinator(MessageType.NODE_HEARTBEAT, {
+                    "node_id": self.node_id,
+                    "used_space": self.storage.get_used_space(),
+                    "free_space": self.storage.get_available_space(),
+                    "load": self.active_commands,
+                    **self.storage.get_health()
+                })
             except:
                 pass
             time.sleep(HEARTBEAT_INTERVAL)
     
+    def send_inventory_digest(self):
+        """
+        Envía periódicamente un resumen (rangos de IDs) de los bloques guardados
+        Sólo incluye bloques con más de ORPHAN_GRACE_PERIOD de antigüedad, para
+        no confundir con huérfanos las copias que aún no figuran en la tabla
+        """
+        while self.running:
+            time.sleep(INVENTORY_DIGEST_INTERVAL)
+            try:
+                cutoff = time.time() - ORPHAN_GRACE_PERIOD
+                self.send_to_coordinator(MessageType.INVENTORY_DIGEST, {
+                    "node_id": self.node_id,
+                    "digest": pack_id_ranges(self.storage.inventory_cutoff_ids(cutoff)),
+                    "cutoff": cutoff
+                })
+            except Exception as e:
+                print(f"Error enviando resumen de inventario: {e}")
+    
+    def handle_orphan_blocks(self, data: dict):
+        """Elimina en lote los bloques que el coordinador considera huérfanos"""
+        block_ids = data.get("block_ids", [])
+        if not block_ids:
+            return
+        deleted = self.storage.delete_orphans(block_ids, data.get("cutoff") or 0)
+        print(f"Eliminados {len(deleted)} bloques huérfanos")
+    
+    def send_to_coordinator(self, msg_type: MessageType, data: dict):
+        """Envía un mensaje por la conexión principal con el coordinador"""
+        with self.coordinator_send_lock:
+            if self.coordinator_socket:
+                send_message(self.coordinator_socket, msg_type, data)
+    
+    def report_corrupt_block(self, block_info: dict):
+        """Avisa al coordinador de una copia corrupta para que la repare"""
+        self.send_to_coordinator(MessageType.BLOCK_CORRUPTED, {
+            "node_id": self.node_id,
+            "block_id": block_info.get("block_id"),
+            "file_id": block_info.get("file_id"),
+            "is_replica": block_info.get("is_replica", False)
+        })
+    
     def listen_for_commands(self):
         """Escucha comandos del coordinador"""
         while self.running:
@@ -153,73 +276,237 @@ class Node:
                 msg_type = MessageType(message["type"])
                 data = message.get("data", {})
                 
-                if msg_type == MessageType.STORE_BLOCK:
-                    self.handle_store_block(client_socket, data)
-                elif msg_type == MessageType.RETRIEVE_BLOCK:
-                    self.handle_retrieve_block(client_socket, data)
-                elif msg_type == MessageType.DELETE_BLOCK:
-                    self.handle_delete_block(client_socket, data)
-                elif msg_type == MessageType.UPDATE_BLOCK_TABLE:
-                    # Actualizar tabla de bloques local si es necesario
-                    pass
-                
+                with self.active_commands_lock:
+                    self.active_commands += 1
+                try:
+                    if msg_type == MessageType.STORE_BLOCK:
+                        self.handle_store_block(client_socket, data)
+                    elif msg_type == MessageType.RETRIEVE_BLOCK:
+                        self.handle_retrieve_block(client_socket, data)
+                    elif msg_type == MessageType.DELETE_BLOCK:
+                        self.handle_delete_block(client_socket, data)
+                    elif msg_type == MessageType.REPLICATE_BLOCK:
+                        self.handle_replicate_block(client_socket, data)
+                finally:
+                    with self.active_commands_lock:
+                        self.active_commands -= 1
+        
         except Exception as e:
             print(f"Error manejando comando del coordinador: {e}")
         finally:
             client_socket.close()
     
     def handle_store_block(self, client_socket: socket.socket, data: dict):
-        """Almacena bloques recibidos del coordinador"""
+        """
+        Almacena un lote de bloques recibidos del coordinador
+        Los bloques se escriben en paralelo, se sincronizan una vez al final
+        del lote y se confirman en una única respuesta con el resultado de cada uno
+        """
         blocks = data.get("blocks", [])
-        stored_count = 0
         
+        # Decodificar el lote y reservar su espacio de una vez
+        decoded = []
+        results = []
         for block_info in blocks:
-            block_id = block_info.get("block_id")
-            file_id = block_info.get("file_id")
-            block_number = block_info.get("block_number")
-            block_data_b64 = block_info.get("block_data")
-            is_replica = block_info.get("is_replica", False)
-            
             try:
-                block_data = base64.b64decode(block_data_b64)
-                if self.storage.store_block(block_id, file_id, block_number, block_data, is_replica):
-                    stored_count += 1
-                    # Notificar al coordinador
-                    send_message(self.coordinator_socket, MessageType.BLOCK_STORED, {
-                        "block_id": block_id,
-                        "file_id": file_id,
-                        "node_id": self.node_id
-                    })
+                decoded.append((block_info, base64.b64decode(block_info.get("block_data"))))
+            except Exception as e:
+                print(f"Error decodificando bloque {block_info.get('block_id')}: {e}")
+                results.append(self.store_result(block_info, False))
+        batch_size = sum(len(block_data) for _, block_data in decoded)
+        reserved = self.storage.reserve_space(batch_size)
+        
+        def store(item, pending):
+            block_info, block_data = item
+            try:
+                with self.storage.batch(pending):
+                    if block_info.get("offset") is not None:
+                        # Datos que se añaden a un bloque de paquete (archivos pequeños)
+                        stored = self.storage.append_block(
+                            block_info.get("block_id"), block_info.get("file_id"), block_info["offset"],
+                            block_data, block_info.get("is_replica", False), reserved, block_info.get("checksum"))
+                    else:
+                        stored = self.storage.store_block(
+                            block_info.get("block_id"), block_info.get("file_id"), block_info.get("block_number"),
+                            block_data, block_info.get("is_replica", False), reserved, block_info.get("checksum"))
             except Exception as e:
-                print(f"Error almacenando bloque {block_id}: {e}")
+                print(f"Error almacenando bloque {block_info.get('block_id')}: {e}")
+                stored = False
+            return self.store_result(block_info, stored), len(block_data) if stored else 0
+        
+        # Los metadatos y los datos del lote se confirman una sola vez al final
+        with self.storage.batch() as pending:
+            outcomes = list(self.store_executor.map(lambda item: store(item, pending), decoded))
+        
+        results.extend(result for result, _ in outcomes)
+        if reserved:
+            self.storage.release_space(batch_size - sum(size for _, size in outcomes))
         
-        # Responder al coordinador
+        stored_count = sum(1 for result in results if result["stored"])
         send_message(client_socket, MessageType.SUCCESS, {
-            "message": f"Almacenados {stored_count} bloques"
+            "message": f"Almacenados {stored_count} bloques",
+            "node_id": self.node_id,
+            "results": results
         })
     
+    @staticmethod
+    def store_result(block_info: dict, stored: bool) -> dict:
+        """Resultado de almacenar un bloque para la respuesta del lote"""
+        return {
+            "block_id": block_info.get("block_id"),
+            "is_replica": block_info.get("is_replica", False),
+            "stored": stored
+        }
+    
     def handle_retrieve_block(self, client_socket: socket.socket, data: dict):
-        """Recupera un bloque solicitado"""
+        """
+        Recupera un bloque solicitado
+        Con offset y length envía sólo ese rango (un archivo de un paquete)
+        """
         block_id = data.get("block_id")
         file_id = data.get("file_id")
         block_number = data.get("block_number")
         
+        if data.get("length") is not None:
+            self.send_block_range(client_socket, block_id, file_id, data.get("offset", 0), data["length"])
+            return
+        
         block_data = self.storage.retrieve_block(block_id)
         
-        if block_data:
+        if block_data is not None:
             send_message(client_socket, MessageType.BLOCK_RETRIEVED, {
                 "block_id": block_id,
                 "file_id": file_id,
                 "block_number": block_number,
-                "block_data": base64.b64encode(block_data).decode('utf-8')
+                "block_data": base64.b64encode(block_data).decode('utf-8'),
+                "checksum": self.storage.blocks.get(str(block_id), {}).get("checksum")
+            })
+        elif block_id in self.storage.corrupt_blocks:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Bloque {block_id} corrupto",
+                "corrupt": True
             })
         else:
             send_message(client_socket, MessageType.ERROR, {
                 "message": f"Bloque {block_id} no encontrado"
             })
     
+    def send_block_range(self, client_socket: socket.socket, block_id: int, file_id: str,
+                         offset: int, length: int):
+        """Envía un rango de un bloque de paquete; stale indica que la copia local no lo contiene"""
+        block_data = self.storage.retrieve_block_range(block_id, file_id, offset, length)
+        if block_data is None:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Rango {offset}+{length} del bloque {block_id} no disponible",
+                "stale": str(block_id) in self.storage.blocks
+            })
+            return
+        send_message(client_socket, MessageType.BLOCK_RETRIEVED, {
+            "block_id": block_id,
+            "file_id": file_id,
+            "offset": offset,
+            "block_data": base64.b64encode(block_data).decode('utf-8')
+        })
+    
+    def handle_cluster_events(self, data: dict):
+        """Aplica un lote de eventos del clúster a la vista local de los demás nodos"""
+        if data.get("resync"):
+            # Se perdieron eventos: reconstruir la vista desde el coordinador
+            threading.Thread(target=self.refresh_peers, daemon=True).start()
+        
+        with self.peers_lock:
+            for event in data.get("events", []):
+                if event.get("topic") != "nodes" or event.get("node_id") == self.node_id:
+                    continue
+                peer_id = event.get("node_id")
+                if event.get("type") == "node_joined":
+                    self.peers[peer_id] = (event.get("address"), event.get("port"))
+                    self.departed_peers.discard(peer_id)
+                elif event.get("type") == "node_left":
+                    self.peers.pop(peer_id, None)
+                    self.departed_peers.add(peer_id)
+    
+    def refresh_peers(self):
+        """Pide al coordinador la lista completa de nodos activos"""
+        try:
+            sock = socket.create_connection((self.coordinator_host, COORDINATOR_PORT), timeout=10)
+            try:
+                send_message(sock, MessageType.GET_ACTIVE_NODES, {})
+                response = receive_message(sock)
+            finally:
+                sock.close()
+        except Exception as e:
+            print(f"Error actualizando la lista de nodos: {e}")
+            return
+        if not response or response.get("type") != MessageType.ACTIVE_NODES_DATA.value:
+            return
+        with self.peers_lock:
+            self.peers = {node["node_id"]: (node["address"], node["port"])
+                          for node in response.get("data", {}).get("nodes", [])
+                          if node["node_id"] != self.node_id}
+            self.departed_peers = set()
+    
+    def handle_replicate_block(self, client_socket: socket.socket, data: dict):
+        """
+        Copia un bloque local directamente a otro nodo (re-replicación)
+        Reenvía al coordinador la respuesta del nodo destino
+        """
+        block_id = data.get("block_id")
+        target_node_id = data.get("target_node_id")
+        with self.peers_lock:
+            departed = target_node_id in self.departed_peers
+        if departed:
+            # No esperar el timeout de conexión con un nodo que ya salió
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"El nodo destino {target_node_id} ya no está activo"
+            })
+            return
+        
+        block_data = self.storage.retrieve_block(block_id)
+        if block_data is None:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Bloque {block_id} no disponible para replicar"
+            })
+            return
+        
+        try:
+            target_socket = socket.create_connection(
+                (data.get("target_address"), data.get("target_port")), timeout=30)
+            try:
+                send_message(target_socket, MessageType.STORE_BLOCK, {"blocks": [{
+                    "block_id": block_id,
+                    "file_id": data.get("file_id"),
+                    "block_number": data.get("block_number"),
+                    "block_data": base64.b64encode(block_data).decode('utf-8'),
+                    "checksum": data.get("checksum"),
+                    "is_replica": data.get("is_replica", False)
+                }]})
+                response = receive_message(target_socket)
+            finally:
+                target_socket.close()
+        except Exception as e:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": f"Error copiando bloque {block_id}: {e}"
+            })
+            return
+        
+        if response:
+            send_message(client_socket, MessageType(response["type"]), response.get("data", {}))
+        else:
+            send_message(client_socket, MessageType.ERROR, {
+                "message": "El nodo destino no respondió"
+            })
+    
     def handle_delete_block(self, client_socket: socket.socket, data: dict):
-        """Elimina un bloque"""
+        """Elimina un bloque, o un lote de bloques si se envía la lista blocks"""
+        if "blocks" in data:
+            deleted = self.storage.delete_blocks(data["blocks"])
+            send_message(client_socket, MessageType.BLOCK_DELETED, {
+                "deleted": deleted,
+                "node_id": self.node_id
+            })
+            return
+        
         block_id = data.get("block_id")
         file_id = data.get("file_id")
         
@@ -242,6 +529,11 @@ class Node:
                 if not message:
                     break
                 # Los comandos principales se manejan en listen_for_commands
+                if message.get("type") == MessageType.ORPHAN_BLOCKS.value:
+                    threading.Thread(target=self.handle_orphan_blocks,
+                                     args=(message.get("data", {}),), daemon=True).start()
+                elif message.get("type") == MessageType.CLUSTER_EVENTS.value:
+                    self.handle_cluster_events(message.get("data", {}))
         except:
             pass
     
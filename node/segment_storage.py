@@ -0,0 +1,363 @@
+"""
+Almacenamiento de bloques en segmentos log-structured
+"""
+import os
+import mmap
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SEGMENT_SIZE, SEGMENT_COMPACTION_THRESHOLD, SEGMENT_COMPACTION_INTERVAL, STORE_SYNC_POLICY
+from node.storage import BlockStorage
+
+# Cabecera de cada registro: magic, tipo, flags, secuencia, block_id,
+# block_number, longitud de datos, longitud del file_id, crc32 de los datos
+RECORD_HEADER = struct.Struct('!4sBBQIIIHI')
+RECORD_MAGIC = b'SBLK'
+RECORD_PUT = 1
+RECORD_TOMBSTONE = 2
+FLAG_REPLICA = 0x01
+
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".seg"
+
+class SegmentBlockStorage(BlockStorage):
+    """
+    Backend que agrupa los bloques en archivos de segmento preasignados
+    
+    Los bloques se añaden al segmento activo y un índice en memoria
+    (persistido en el almacén de metadatos) guarda segmento y offset de cada
+    uno. Los borrados escriben una lápida; el espacio se recupera cuando la
+    compactación copia los bloques vivos de un segmento y lo elimina. Tras
+    una caída el índice se reconstruye recorriendo las cabeceras de los
+    segmentos; cada registro lleva una secuencia global y gana la más alta.
+    """
+    
+    def __init__(self, node_id: str, shared_space_path: str, max_size: int,
+                 segment_size: int = SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.segment_lock = threading.RLock()
+        self.segment_files: Dict[int, object] = {}  # segment_id -> archivo abierto
+        self.segment_maps: Dict[int, mmap.mmap] = {}  # segment_id -> mmap de lectura
+        self.segment_used: Dict[int, int] = {}  # segment_id -> bytes escritos
+        self.segment_live: Dict[int, int] = {}  # segment_id -> bytes de bloques vivos
+        self.active_segment = 0
+        self.next_seq = 1
+        self.compaction_thread: Optional[threading.Thread] = None
+        
+        super().__init__(node_id, shared_space_path, max_size)
+        
+        self.recover()
+    
+    # --- Segmentos ---
+    
+    def segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.shared_space_path, f"{SEGMENT_PREFIX}{segment_id:08d}{SEGMENT_SUFFIX}")
+    
+    def list_segments(self) -> List[int]:
+        """Identificadores de los segmentos existentes, en orden"""
+        segments = []
+        for name in os.listdir(self.shared_space_path):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    pass
+        return sorted(segments)
+    
+    def open_segment(self, segment_id: int, create: bool = False):
+        """Abre (y preasigna si es nuevo) un segmento para lectura y escritura"""
+        path = self.segment_path(segment_id)
+        if create:
+            with open(path, 'wb') as f:
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(f.fileno(), 0, self.segment_size)
+                else:
+                    f.truncate(self.segment_size)
+                os.fsync(f.fileno())
+            self.sync_directory()
+        f = open(path, 'r+b')
+        self.segment_files[segment_id] = f
+        self.segment_maps[segment_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.segment_used.setdefault(segment_id, 0)
+        self.segment_live.setdefault(segment_id, 0)
+    
+    def close_segment(self, segment_id: int, remove: bool = False):
+        """Cierra un segmento y opcionalmente lo elimina del disco"""
+        self.segment_maps.pop(segment_id).close()
+        self.segment_files.pop(segment_id).close()
+        self.segment_used.pop(segment_id, None)
+        self.segment_live.pop(segment_id, None)
+        if remove:
+            os.remove(self.segment_path(segment_id))
+    
+    def roll_segment(self):
+        """Sella el segmento activo y abre uno nuevo"""
+        if self.active_segment in self.segment_files:
+            self.segment_files[self.active_segment].flush()
+            os.fsync(self.segment_files[self.active_segment].fileno())
+        self.active_segment = max(self.segment_files, default=0) + 1
+        self.open_segment(self.active_segment, create=True)
+    
+    def append_record(self, kind: int, seq: int, block_info: Dict, block_data: bytes = b'',
+                      crc: Optional[int] = None) -> int:
+        """
+        Añade un registro al segmento activo (con segment_lock tomado)
+        Retorna el offset de los datos dentro del segmento
+        """
+        fid = block_info["file_id"].encode('utf-8')
+        flags = FLAG_REPLICA if block_info.get("is_replica") else 0
+        header = RECORD_HEADER.pack(RECORD_MAGIC, kind, flags, seq, int(block_info["block_id"]),
+                                    int(block_info["block_number"]), len(block_data), len(fid),
+                                    zlib.crc32(block_data) if crc is None else crc)
+        record_size = len(header) + len(fid) + len(block_data)
+        if record_size > self.segment_size:
+            raise ValueError("El bloque no cabe en un segmento")
+        if self.segment_used[self.active_segment] + record_size > self.segment_size:
+            self.roll_segment()
+        
+        segment_id = self.active_segment
+        offset = self.segment_used[segment_id]
+        f = self.segment_files[segment_id]
+        f.seek(offset)
+        f.write(header + fid + block_data)
+        f.flush()
+        if STORE_SYNC_POLICY == "always" or (STORE_SYNC_POLICY == "batch" and not self.in_batch()):
+            os.fsync(f.fileno())
+        
+        self.segment_used[segment_id] = offset + record_size
+        return offset + len(header) + len(fid)
+    
+    def scan_segment(self, segment_id: int, last: bool = False):
+        """
+        Itera (offset de datos, cabecera, file_id, íntegro) de los registros de un segmento
+        Un PUT cuyo CRC no coincide se entrega como no íntegro y el recorrido
+        sigue con el registro siguiente: sólo una cabecera inválida o un
+        registro truncado terminan el segmento. En el último segmento, un PUT
+        dañado que no va seguido de otro registro es la escritura a medias de
+        una caída y también lo termina
+        """
+        data = self.segment_maps[segment_id]
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            magic, kind, flags, seq, block_id, block_number, data_len, fid_len, crc = \
+                RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + fid_len + data_len
+            if magic != RECORD_MAGIC or kind not in (RECORD_PUT, RECORD_TOMBSTONE) or end > len(data):
+                # Zona preasignada sin usar o registro truncado por una caída
+                break
+            fid_start = offset + RECORD_HEADER.size
+            data_start = fid_start + fid_len
+            intact = kind != RECORD_PUT or zlib.crc32(data[data_start:end]) == crc
+            if not intact and last and data[end:end + len(RECORD_MAGIC)] != RECORD_MAGIC:
+                break
+            file_id = data[fid_start:data_start].decode('utf-8', errors='replace')
+            yield data_start, (kind, flags, seq, block_id, block_number, data_len, crc), file_id, intact
+            offset = end
+        self.segment_used[segment_id] = offset
+    
+    def recover(self):
+        """Reconstruye el índice recorriendo las cabeceras de todos los segmentos"""
+        with self.segment_lock:
+            latest: Dict[int, tuple] = {}  # block_id -> (seq, info o None si borrado, íntegro)
+            segments = self.list_segments()
+            for segment_id in segments:
+                self.open_segment(segment_id)
+                last = segment_id == segments[-1]
+                for data_offset, header, file_id, intact in self.scan_segment(segment_id, last):
+                    kind, flags, seq, block_id, block_number, data_len, crc = header
+                    self.next_seq = max(self.next_seq, seq + 1)
+                    if block_id in latest and latest[block_id][0] > seq:
+                        continue
+                    info = None
+                    if kind == RECORD_PUT:
+                        info = {
+                            "block_id": block_id,
+                            "file_id": file_id,
+                            "block_number": block_number,
+                            "size": data_len,
+                            "is_replica": bool(flags & FLAG_REPLICA),
+                            "checksum": crc,
+                            "segment": segment_id,
+                            "offset": data_offset,
+                            "seq": seq
+                        }
+                    latest[block_id] = (seq, info, intact)
+            
+            recovered = {str(bid): info for bid, (_, info, _) in latest.items() if info}
+            for info in recovered.values():
+                self.segment_live[info["segment"]] += info["size"]
+            
+            # El contenido de los segmentos manda sobre el almacén de metadatos
+            with self.metadata_store.batch():
+                for block_id in set(self.blocks) - set(recovered):
+                    self.metadata_store.delete(int(block_id))
+                for block_id, info in recovered.items():
+                    if self.blocks.get(block_id) != info:
+                        self.metadata_store.upsert(info)
+            self.blocks = recovered
+            
+            # Un registro dañado queda indexado (su checksum no coincidirá al
+            # leerlo) y se marca corrupto para que el coordinador lo repare
+            for _, info, intact in latest.values():
+                if info and not intact:
+                    self.report_corruption(info)
+            
+            if segments and self.segment_used[segments[-1]] < self.segment_size:
+                self.active_segment = segments[-1]
+            else:
+                self.roll_segment()
+        
+        self.reconcile_space()
+    
+    # --- Operaciones de BlockStorage ---
+    
+    def sync_pending(self, paths: List[str]):
+        """Un único fsync del segmento activo (los sellados se sincronizan al rotar)"""
+        if STORE_SYNC_POLICY == "none":
+            return
+        with self.segment_lock:
+            f = self.segment_files[self.active_segment]
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def write_block_data(self, block_info: Dict, block_data: bytes, previous: Optional[Dict]) -> int:
+        with self.segment_lock:
+            before = sum(self.segment_used.values())
+            seq = self.next_seq
+            self.next_seq += 1
+            offset = self.append_record(RECORD_PUT, seq, block_info, block_data)
+            block_info.update(segment=self.active_segment, offset=offset, seq=seq)
+            self.segment_live[self.active_segment] += len(block_data)
+            if previous and previous.get("segment") in self.segment_live:
+                self.segment_live[previous["segment"]] -= previous.get("size", 0)
+            return sum(self.segment_used.values()) - before
+    
+    def read_block_data(self, block_info: Dict) -> Optional[bytes]:
+        with self.segment_lock:
+            data = self.segment_maps.get(block_info.get("segment"))
+            if data is None:
+                return None
+            offset = block_info["offset"]
+            return data[offset:offset + block_info["size"]]
+    
+    def append_block_data(self, block_info: Dict, block_data: bytes, previous: Dict) -> int:
+        """Los registros son inmutables: se reescribe el bloque completo y la compactación recupera el anterior"""
+        with self.segment_lock:
+            existing = self.read_block_data(previous)
+            if existing is None:
+                raise IOError(f"Segmento del bloque {previous['block_id']} no disponible")
+            return self.write_block_data(block_info, existing + block_data, previous)
+    
+    def read_block_range(self, block_info: Dict, offset: int, length: int) -> Optional[bytes]:
+        with self.segment_lock:
+            data = self.segment_maps.get(block_info.get("segment"))
+            if data is None:
+                return None
+            start = block_info["offset"] + offset
+            return data[start:start + length]
+    
+    def iter_block_chunks(self, block_info: Dict, chunk_size: int):
+        """Lee un bloque del mmap por fragmentos"""
+        offset = block_info["offset"]
+        end = offset + block_info["size"]
+        while offset < end:
+            with self.segment_lock:
+                data = self.segment_maps.get(block_info.get("segment"))
+                if data is None:
+                    return
+                chunk = data[offset:min(offset + chunk_size, end)]
+            yield chunk
+            offset += len(chunk)
+    
+    def remove_block_data(self, block_info: Dict) -> int:
+        """Escribe una lápida; el espacio se libera al compactar"""
+        with self.segment_lock:
+            before = sum(self.segment_used.values())
+            seq = self.next_seq
+            self.next_seq += 1
+            self.append_record(RECORD_TOMBSTONE, seq, block_info)
+            if block_info.get("segment") in self.segment_live:
+                self.segment_live[block_info["segment"]] -= block_info.get("size", 0)
+            return before - sum(self.segment_used.values())
+    
+    def reconcile_space(self):
+        """El espacio usado es lo escrito en los segmentos (incluye lo aún no compactado)"""
+        with self.segment_lock:
+            used = sum(self.segment_used.values())
+        with self.space_lock:
+            self.used_bytes = used
+    
+    # --- Compactación ---
+    
+    def compact_segment(self, segment_id: int) -> int:
+        """
+        Copia los bloques vivos de un segmento sellado al segmento activo y lo
+        elimina. Retorna los bytes recuperados
+        """
+        with self.segment_lock:
+            if segment_id == self.active_segment or segment_id not in self.segment_files:
+                return 0
+            is_oldest = segment_id == min(self.segment_files)
+            
+            with self.metadata_store.batch():
+                for data_offset, header, file_id, _ in list(self.scan_segment(segment_id)):
+                    kind, flags, seq, block_id, block_number, data_len, crc = header
+                    info = self.blocks.get(str(block_id))
+                    if kind == RECORD_PUT:
+                        if not info or info.get("segment") != segment_id or info.get("offset") != data_offset:
+                            continue
+                        block_data = self.segment_maps[segment_id][data_offset:data_offset + data_len]
+                        # Se conservan la secuencia y el CRC originales para que la
+                        # recuperación siga siendo correcta y un registro dañado siga constando como tal
+                        new_offset = self.append_record(RECORD_PUT, seq, info, block_data, crc)
+                        info = dict(info, segment=self.active_segment, offset=new_offset)
+                        self.segment_live[self.active_segment] += data_len
+                        self.blocks[str(block_id)] = info
+                        self.metadata_store.upsert(info)
+                    elif not is_oldest:
+                        # Una lápida puede tapar un bloque en un segmento más antiguo
+                        self.append_record(RECORD_TOMBSTONE, seq, {
+                            "block_id": block_id,
+                            "file_id": file_id,
+                            "block_number": block_number
+                        })
+                f = self.segment_files[self.active_segment]
+                f.flush()
+                os.fsync(f.fileno())
+            
+            reclaimed = self.segment_used.get(segment_id, 0)
+            self.close_segment(segment_id, remove=True)
+        
+        self.reconcile_space()
+        return reclaimed
+    
+    def compact(self) -> int:
+        """Compacta los segmentos sellados con demasiado espacio muerto"""
+        with self.segment_lock:
+            candidates = [sid for sid, used in self.segment_used.items()
+                          if sid != self.active_segment and used > 0
+                          and 1 - self.segment_live[sid] / used >= SEGMENT_COMPACTION_THRESHOLD]
+        return sum(self.compact_segment(sid) for sid in sorted(candidates))
+    
+    def start_background_tasks(self):
+        """Inicia la conciliación de espacio y la compactación periódica"""
+        super().start_background_tasks()
+        
+        def compaction_loop():
+            while True:
+                time.sleep(SEGMENT_COMPACTION_INTERVAL)
+                try:
+                    reclaimed = self.compact()
+                    if reclaimed:
+                        print(f"Compactación: {reclaimed} bytes recuperados")
+                except Exception as e:
+                    print(f"Error compactando segmentos: {e}")
+        
+        self.compaction_thread = threading.Thread(target=compaction_loop, daemon=True)
+        self.compaction_thread.start()
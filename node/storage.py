@@ -2,15 +2,22 @@
 Módulo de almacenamiento de bloques en nodos
 """
 import os
-import json
-from typing import Optional, Dict
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, List
 from pathlib import Path
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import SHARED_DIRECTORY, BLOCK_SIZE
-from common.utils import ensure_directory, get_directory_size
+from config import (
+    SHARED_DIRECTORY, BLOCK_SIZE, SPACE_RECONCILE_INTERVAL, STORE_SYNC_POLICY,
+    SCRUB_INTERVAL, SCRUB_BYTES_PER_SEC, DISK_LATENCY_ALPHA
+)
+from common.utils import ensure_directory, get_directory_size, calculate_checksum
+from node.metadata_store import BlockMetadataStore
 
 class BlockStorage:
     """Gestión de almacenamiento de bloques en un nodo"""
@@ -20,103 +27,478 @@ class BlockStorage:
         self.shared_space_path = shared_space_path
         self.max_size = max_size
         self.blocks: Dict[str, Dict] = {}  # block_id -> info
+        # Locks por franjas de block_id: serializan escritura y borrado del
+        # mismo bloque (el coordinador reutiliza IDs) sin serializar el lote
+        self.block_locks = [threading.RLock() for _ in range(64)]
         
         ensure_directory(shared_space_path)
         
         # Cargar metadatos de bloques almacenados
         self.load_metadata()
+        
+        # Contabilidad de espacio en memoria: bytes usados y reservados para
+        # lotes en curso. Se recalcula contra el disco periódicamente
+        self.space_lock = threading.Lock()
+        self.used_bytes = get_directory_size(shared_space_path)
+        self.reserved_bytes = 0
+        self.reconcile_thread: Optional[threading.Thread] = None
+        
+        # Lote abierto por cada hilo: archivos escritos pendientes de sincronizar
+        self.batch_local = threading.local()
+        self.pending_sync_lock = threading.Lock()
+        
+        # Bloques cuya verificación falló y callback para avisar al coordinador
+        self.corrupt_blocks = set()
+        self.on_corruption = None
+        self.scrub_thread: Optional[threading.Thread] = None
+        
+        # Salud del disco reportada en el heartbeat
+        self.stats_lock = threading.Lock()
+        self.disk_latency_ms = 0.0  # media móvil exponencial de lecturas y escrituras
+        self.io_errors = 0
+        self.checksum_errors = 0
     
     def load_metadata(self):
         """Carga metadatos de bloques almacenados"""
-        metadata_file = os.path.join(self.shared_space_path, ".metadata.json")
-        if os.path.exists(metadata_file):
+        self.metadata_store = BlockMetadataStore(os.path.join(self.shared_space_path, ".metadata.db"),
+                                                 durable=STORE_SYNC_POLICY != "none")
+        
+        # Migrar el formato anterior (un único JSON reescrito en cada cambio)
+        legacy_file = os.path.join(self.shared_space_path, ".metadata.json")
+        if os.path.exists(legacy_file):
             try:
-                with open(metadata_file, 'r') as f:
-                    self.blocks = json.load(f)
-            except:
-                self.blocks = {}
-    
-    def save_metadata(self):
-        """Guarda metadatos de bloques"""
-        metadata_file = os.path.join(self.shared_space_path, ".metadata.json")
+                self.metadata_store.import_json(legacy_file)
+            except Exception as e:
+                print(f"Error migrando metadatos: {e}")
+        
         try:
-            with open(metadata_file, 'w') as f:
-                json.dump(self.blocks, f, indent=2)
+            self.blocks = self.metadata_store.load()
         except Exception as e:
-            print(f"Error guardando metadatos: {e}")
+            print(f"Error cargando metadatos: {e}")
+            self.blocks = {}
+    
+    @contextmanager
+    def batch(self, pending: Optional[List[str]] = None):
+        """
+        Agrupa las altas y bajas de un lote: un único commit de metadatos y,
+        con la política "batch", una única sincronización de los datos al
+        final, antes del commit. Con pending el hilo se suma al lote que otro
+        hilo abrió (los que escriben en paralelo un STORE_BLOCK), y es ése
+        quien sincroniza y confirma al salir
+        """
+        current = getattr(self.batch_local, "pending", None)
+        if pending is not None or current is not None:
+            # Lote ajeno o anidado: sólo se anotan los archivos en él
+            self.batch_local.pending = pending if pending is not None else current
+            try:
+                with self.metadata_store.batch(commit=False):
+                    yield self.batch_local.pending
+            finally:
+                self.batch_local.pending = current
+            return
+        
+        self.batch_local.pending = []
+        try:
+            with self.metadata_store.batch():
+                yield self.batch_local.pending
+                self.sync_pending(self.batch_local.pending)
+        finally:
+            self.batch_local.pending = None
+    
+    def in_batch(self) -> bool:
+        """Indica si el hilo actual escribe dentro de un lote"""
+        return getattr(self.batch_local, "pending", None) is not None
+    
+    def add_pending_sync(self, path: str):
+        """Anota un archivo escrito para sincronizarlo al cerrar el lote del hilo"""
+        with self.pending_sync_lock:
+            self.batch_local.pending.append(path)
+    
+    def sync_pending(self, paths: List[str]):
+        """Sincroniza a disco los archivos escritos durante el lote y su directorio"""
+        if not paths or STORE_SYNC_POLICY == "none":
+            return
+        for path in set(paths):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue  # borrado durante el lote
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.sync_directory()
+    
+    def sync_directory(self):
+        """Sincroniza el directorio compartido para que las altas de archivos sean duraderas"""
+        try:
+            fd = os.open(self.shared_space_path, os.O_RDONLY)
+        except OSError:
+            return  # plataformas sin fsync de directorios
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    
+    def get_used_space(self) -> int:
+        """Bytes ocupados en el espacio compartido (contador en memoria)"""
+        return self.used_bytes
     
     def get_available_space(self) -> int:
-        """Obtiene espacio disponible"""
-        used = get_directory_size(self.shared_space_path)
-        return max(0, self.max_size - used)
+        """Obtiene espacio disponible, descontando lo reservado"""
+        with self.space_lock:
+            return max(0, self.max_size - self.used_bytes - self.reserved_bytes)
     
     def can_store_block(self, block_size: int) -> bool:
         """Verifica si se puede almacenar un bloque"""
         return self.get_available_space() >= block_size
     
+    def reserve_space(self, num_bytes: int) -> bool:
+        """Reserva espacio para un lote que se va a escribir"""
+        with self.space_lock:
+            if self.max_size - self.used_bytes - self.reserved_bytes < num_bytes:
+                return False
+            self.reserved_bytes += num_bytes
+            return True
+    
+    def release_space(self, num_bytes: int):
+        """Libera espacio reservado que no llegó a usarse"""
+        with self.space_lock:
+            self.reserved_bytes = max(0, self.reserved_bytes - num_bytes)
+    
+    def reconcile_space(self):
+        """Recalcula el espacio usado recorriendo el directorio compartido"""
+        used = get_directory_size(self.shared_space_path)
+        with self.space_lock:
+            drift = used - self.used_bytes
+            self.used_bytes = used
+        if drift:
+            print(f"Espacio usado ajustado en {drift} bytes tras recorrer el disco")
+    
+    def start_space_reconciler(self):
+        """Inicia el hilo que concilia periódicamente el contador con el disco"""
+        def reconcile_loop():
+            while True:
+                time.sleep(SPACE_RECONCILE_INTERVAL)
+                try:
+                    self.reconcile_space()
+                except Exception as e:
+                    print(f"Error conciliando espacio usado: {e}")
+        
+        self.reconcile_thread = threading.Thread(target=reconcile_loop, daemon=True)
+        self.reconcile_thread.start()
+    
+    def start_background_tasks(self):
+        """Inicia las tareas de mantenimiento en segundo plano"""
+        self.start_space_reconciler()
+        self.start_scrubber()
+    
+    def record_latency(self, started: float):
+        """Incorpora a la media móvil la duración de una lectura o escritura"""
+        elapsed_ms = (time.time() - started) * 1000
+        with self.stats_lock:
+            self.disk_latency_ms += DISK_LATENCY_ALPHA * (elapsed_ms - self.disk_latency_ms)
+    
+    def record_io_error(self):
+        with self.stats_lock:
+            self.io_errors += 1
+    
+    def get_health(self) -> Dict:
+        """Latencia de disco y contadores de errores para el heartbeat"""
+        with self.stats_lock:
+            return {
+                "disk_latency_ms": round(self.disk_latency_ms, 3),
+                "io_errors": self.io_errors,
+                "checksum_errors": self.checksum_errors
+            }
+    
+    def report_corruption(self, block_info: Dict):
+        """Registra una copia corrupta y avisa mediante on_corruption"""
+        with self.stats_lock:
+            self.checksum_errors += 1
+        self.corrupt_blocks.add(int(block_info["block_id"]))
+        print(f"Bloque {block_info['block_id']} corrupto (checksum no coincide)")
+        if self.on_corruption:
+            try:
+                self.on_corruption(block_info)
+            except Exception as e:
+                print(f"Error notificando bloque corrupto: {e}")
+    
+    def scrub_block(self, block_info: Dict, chunk_size: int = 256 * 1024) -> bool:
+        """
+        Verifica un bloque leyéndolo por fragmentos dentro del presupuesto de E/S
+        Retorna False si los datos no coinciden con su checksum
+        """
+        expected = block_info.get("checksum")
+        if expected is None:
+            return True
+        
+        def throttled_chunks():
+            for chunk in self.iter_block_chunks(block_info, chunk_size):
+                yield chunk
+                time.sleep(len(chunk) / SCRUB_BYTES_PER_SEC)
+        
+        if calculate_checksum(throttled_chunks()) != expected:
+            # Releer por si el bloque fue reescrito durante la verificación
+            if self.blocks.get(str(block_info["block_id"])) is block_info:
+                self.report_corruption(block_info)
+                return False
+        return True
+    
+    def start_scrubber(self):
+        """Inicia el hilo que reverifica periódicamente todos los bloques"""
+        def scrub_loop():
+            while True:
+                time.sleep(SCRUB_INTERVAL)
+                checked = corrupt = 0
+                for block_info in list(self.blocks.values()):
+                    try:
+                        checked += 1
+                        if not self.scrub_block(block_info):
+                            corrupt += 1
+                    except Exception as e:
+                        print(f"Error verificando bloque {block_info.get('block_id')}: {e}")
+                print(f"Verificación completa: {checked} bloques, {corrupt} corruptos")
+        
+        self.scrub_thread = threading.Thread(target=scrub_loop, daemon=True)
+        self.scrub_thread.start()
+    
+    def block_lock(self, block_id) -> threading.RLock:
+        """Lock de la franja que corresponde a un bloque"""
+        return self.block_locks[int(block_id) % len(self.block_locks)]
+    
     def store_block(self, block_id: int, file_id: str, block_number: int, 
-                   block_data: bytes, is_replica: bool = False) -> bool:
-        """Almacena un bloque"""
-        if not self.can_store_block(len(block_data)):
+                   block_data: bytes, is_replica: bool = False, reserved: bool = False,
+                   checksum: Optional[int] = None) -> bool:
+        """
+        Almacena un bloque
+        Si reserved es True, el espacio ya fue reservado con reserve_space
+        y pasa de reservado a usado. Si se indica checksum, los datos
+        recibidos deben coincidir con él
+        """
+        actual_checksum = calculate_checksum(block_data)
+        if checksum is not None and checksum != actual_checksum:
+            print(f"Bloque {block_id} recibido con checksum incorrecto")
             return False
         
-        block_filename = f"block_{block_id}_{file_id}_{block_number}.dat"
-        block_path = os.path.join(self.shared_space_path, block_filename)
+        with self.block_lock(block_id):
+            return self._store_block(block_id, file_id, block_number, block_data,
+                                     is_replica, reserved, actual_checksum)
+    
+    def _store_block(self, block_id: int, file_id: str, block_number: int, block_data: bytes,
+                     is_replica: bool, reserved: bool, actual_checksum: int) -> bool:
+        """Escribe el bloque y sus metadatos (con el lock del bloque tomado)"""
+        previous = self.blocks.get(str(block_id))
+        previous_size = previous.get("size", 0) if previous else 0
+        if not reserved and not self.can_store_block(len(block_data) - previous_size):
+            return False
         
         try:
-            with open(block_path, 'wb') as f:
-                f.write(block_data)
-            
-            # Guardar metadatos
-            self.blocks[str(block_id)] = {
+            block_info = {
                 "block_id": block_id,
                 "file_id": file_id,
                 "block_number": block_number,
-                "filename": block_filename,
                 "size": len(block_data),
-                "is_replica": is_replica
+                "is_replica": is_replica,
+                "checksum": actual_checksum,
+                "stored_at": time.time()
             }
-            
-            self.save_metadata()
+            started = time.time()
+            used_delta = self.write_block_data(block_info, block_data, previous)
+            self.record_latency(started)
+            self.save_block_info(block_info, used_delta, len(block_data) if reserved else 0)
             return True
         except Exception as e:
+            self.record_io_error()
             print(f"Error almacenando bloque {block_id}: {e}")
             return False
     
+    def save_block_info(self, block_info: Dict, used_delta: int, reserved_bytes: int):
+        """Guarda los metadatos de un bloque escrito y pasa su espacio de reservado a usado"""
+        self.blocks[str(block_info["block_id"])] = block_info
+        self.metadata_store.upsert(block_info)
+        self.corrupt_blocks.discard(int(block_info["block_id"]))
+        
+        with self.space_lock:
+            self.used_bytes += used_delta
+            self.reserved_bytes = max(0, self.reserved_bytes - reserved_bytes)
+    
+    def append_block(self, block_id: int, file_id: str, offset: int, block_data: bytes,
+                     is_replica: bool = False, reserved: bool = False,
+                     checksum: Optional[int] = None) -> bool:
+        """
+        Añade datos al final de un bloque de paquete (archivos pequeños)
+        offset debe coincidir con el tamaño de la copia local: si no, la copia
+        está desfasada y se rechaza para que el coordinador la repare. El
+        checksum indicado es el del bloque completo tras añadir los datos
+        """
+        if offset == 0:
+            return self.store_block(block_id, file_id, 0, block_data, is_replica, reserved, checksum)
+        
+        with self.block_lock(block_id):
+            previous = self.blocks.get(str(block_id))
+            if (not previous or previous.get("file_id") != file_id or previous.get("size") != offset
+                    or previous.get("checksum") is None):
+                print(f"Bloque {block_id} desfasado: no se puede añadir en el offset {offset}")
+                return False
+            actual_checksum = calculate_checksum(block_data, previous["checksum"])
+            if checksum is not None and checksum != actual_checksum:
+                print(f"Bloque {block_id} recibido con checksum incorrecto")
+                return False
+            if not reserved and not self.can_store_block(len(block_data)):
+                return False
+            
+            try:
+                block_info = dict(previous, size=offset + len(block_data), is_replica=is_replica,
+                                  checksum=actual_checksum, stored_at=time.time())
+                started = time.time()
+                used_delta = self.append_block_data(block_info, block_data, previous)
+                self.record_latency(started)
+                self.save_block_info(block_info, used_delta, len(block_data) if reserved else 0)
+                return True
+            except Exception as e:
+                self.record_io_error()
+                print(f"Error añadiendo datos al bloque {block_id}: {e}")
+                return False
+    
     def retrieve_block(self, block_id: int) -> Optional[bytes]:
         """Recupera un bloque"""
         block_info = self.blocks.get(str(block_id))
         if not block_info:
             return None
         
-        block_path = os.path.join(self.shared_space_path, block_info["filename"])
-        if not os.path.exists(block_path):
+        try:
+            started = time.time()
+            block_data = self.read_block_data(block_info)
+            self.record_latency(started)
+        except Exception as e:
+            self.record_io_error()
+            print(f"Error recuperando bloque {block_id}: {e}")
             return None
         
+        # Verificar la integridad antes de entregar los datos
+        expected = block_info.get("checksum")
+        if block_data is not None and expected is not None and calculate_checksum(block_data) != expected:
+            self.report_corruption(block_info)
+            return None
+        return block_data
+    
+    def retrieve_block_range(self, block_id: int, file_id: str, offset: int, length: int) -> Optional[bytes]:
+        """
+        Lee length bytes de un bloque de paquete a partir de offset
+        No se verifica el bloque completo: el coordinador comprueba el checksum
+        del fragmento. Retorna None si el rango no está en la copia local
+        """
+        block_info = self.blocks.get(str(block_id))
+        if (not block_info or block_info.get("file_id") != file_id or offset < 0 or length < 0
+                or offset + length > block_info.get("size", 0)):
+            return None
         try:
-            with open(block_path, 'rb') as f:
-                return f.read()
+            started = time.time()
+            block_data = self.read_block_range(block_info, offset, length)
+            self.record_latency(started)
+            return block_data
         except Exception as e:
+            self.record_io_error()
             print(f"Error recuperando bloque {block_id}: {e}")
             return None
     
-    def delete_block(self, block_id: int) -> bool:
-        """Elimina un bloque"""
-        block_info = self.blocks.get(str(block_id))
-        if not block_info:
-            return False
+    def delete_block(self, block_id: int, file_id: Optional[str] = None) -> bool:
+        """Elimina un bloque (sólo si pertenece a file_id, cuando se indica)"""
+        with self.block_lock(block_id):
+            block_info = self.blocks.get(str(block_id))
+            if not block_info:
+                return False
+            if file_id is not None and block_info.get("file_id") != file_id:
+                return False
+            
+            try:
+                released = self.remove_block_data(block_info)
+                del self.blocks[str(block_id)]
+                self.metadata_store.delete(block_id)
+                self.corrupt_blocks.discard(int(block_id))
+                
+                with self.space_lock:
+                    self.used_bytes = max(0, self.used_bytes - released)
+                return True
+            except Exception as e:
+                print(f"Error eliminando bloque {block_id}: {e}")
+                return False
+    
+    def write_block_data(self, block_info: Dict, block_data: bytes, previous: Optional[Dict]) -> int:
+        """
+        Escribe los datos del bloque en su propio archivo .dat y anota su
+        ubicación en block_info. Retorna la variación de bytes usados
+        """
+        # El file_id puede llevar '/' (nombres con ruta); el block_id ya hace único el nombre
+        safe_file_id = re.sub(r'[^\w.-]', '_', block_info['file_id'])
+        block_filename = f"block_{block_info['block_id']}_{safe_file_id}_{block_info['block_number']}.dat"
+        block_path = os.path.join(self.shared_space_path, block_filename)
+        created = not os.path.exists(block_path)
+        with open(block_path, 'wb') as f:
+            f.write(block_data)
+            synced = STORE_SYNC_POLICY == "always" or (STORE_SYNC_POLICY == "batch" and not self.in_batch())
+            if synced:
+                f.flush()
+                os.fsync(f.fileno())
+        if synced and created:
+            self.sync_directory()
+        if STORE_SYNC_POLICY == "batch" and self.in_batch():
+            self.add_pending_sync(block_path)
+        block_info["filename"] = block_filename
         
+        released = 0
+        if previous:
+            released = previous.get("size", 0)
+            if previous.get("filename") != block_filename:
+                self.remove_block_data(previous)
+        return len(block_data) - released
+    
+    def append_block_data(self, block_info: Dict, block_data: bytes, previous: Dict) -> int:
+        """Añade los datos al final del archivo .dat del bloque. Retorna los bytes añadidos"""
+        block_path = os.path.join(self.shared_space_path, previous["filename"])
+        with open(block_path, 'r+b') as f:
+            f.seek(previous["size"])
+            f.write(block_data)
+            f.truncate()
+            if STORE_SYNC_POLICY == "always" or (STORE_SYNC_POLICY == "batch" and not self.in_batch()):
+                f.flush()
+                os.fsync(f.fileno())
+        if STORE_SYNC_POLICY == "batch" and self.in_batch():
+            self.add_pending_sync(block_path)
+        return len(block_data)
+    
+    def read_block_data(self, block_info: Dict) -> Optional[bytes]:
+        """Lee los datos de un bloque desde su archivo"""
         block_path = os.path.join(self.shared_space_path, block_info["filename"])
-        
-        try:
-            if os.path.exists(block_path):
-                os.remove(block_path)
-            del self.blocks[str(block_id)]
-            self.save_metadata()
-            return True
-        except Exception as e:
-            print(f"Error eliminando bloque {block_id}: {e}")
-            return False
+        if not os.path.exists(block_path):
+            return None
+        with open(block_path, 'rb') as f:
+            return f.read()
+    
+    def read_block_range(self, block_info: Dict, offset: int, length: int) -> Optional[bytes]:
+        """Lee un rango del archivo de un bloque"""
+        block_path = os.path.join(self.shared_space_path, block_info["filename"])
+        if not os.path.exists(block_path):
+            return None
+        with open(block_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+    
+    def iter_block_chunks(self, block_info: Dict, chunk_size: int):
+        """Lee el archivo de un bloque por fragmentos"""
+        with open(os.path.join(self.shared_space_path, block_info["filename"]), 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+    
+    def remove_block_data(self, block_info: Dict) -> int:
+        """Elimina el archivo de un bloque. Retorna los bytes liberados"""
+        block_path = os.path.join(self.shared_space_path, block_info["filename"])
+        if os.path.exists(block_path):
+            os.remove(block_path)
+        return block_info.get("size", 0)
     
     def delete_file_blocks(self, file_id: str) -> int:
         """Elimina todos los bloques de un archivo"""
@@ -124,12 +506,42 @@ class BlockStorage:
         blocks_to_delete = [bid for bid, info in self.blocks.items() 
                            if info.get("file_id") == file_id]
         
-        for block_id in blocks_to_delete:
-            if self.delete_block(int(block_id)):
-                deleted += 1
+        with self.batch():
+            for block_id in blocks_to_delete:
+                if self.delete_block(int(block_id)):
+                    deleted += 1
         
         return deleted
     
+    def delete_blocks(self, blocks: List[Dict]) -> List[int]:
+        """
+        Elimina en un solo lote los bloques [{block_id, file_id}] indicados
+        Un bloque sólo se borra si sigue perteneciendo a ese file_id (el
+        coordinador reutiliza IDs de bloques liberados). Retorna los IDs borrados
+        """
+        deleted = []
+        with self.batch():
+            for item in blocks:
+                block_id = int(item["block_id"])
+                if self.delete_block(block_id, item.get("file_id")):
+                    deleted.append(block_id)
+        return deleted
+    
+    def inventory_cutoff_ids(self, cutoff: float) -> List[int]:
+        """IDs de los bloques almacenados antes de cutoff (candidatos a conciliación)"""
+        return [int(bid) for bid, info in list(self.blocks.items())
+                if info.get("stored_at", 0) <= cutoff]
+    
+    def delete_orphans(self, block_ids: List[int], cutoff: float) -> List[int]:
+        """
+        Elimina los bloques huérfanos indicados por el coordinador, salvo los
+        que se hayan vuelto a escribir después del resumen enviado
+        """
+        blocks = [{"block_id": bid, "file_id": info["file_id"]}
+                  for bid, info in ((bid, self.blocks.get(str(bid))) for bid in block_ids)
+                  if info and info.get("stored_at", 0) <= cutoff]
+        return self.delete_blocks(blocks)
+    
     def get_stored_blocks(self) -> Dict:
         """Obtiene información de todos los bloques almacenados"""
         return self.blocks.copy()
@@ -0,0 +1,10 @@
+"""
+Cliente del sistema distribuido (SDK y línea de comandos)
+"""
+from sadtf.pool import CoordinatorPool, CoordinatorUnavailable
+from sadtf.client import Client, Progress, SADTFError, TransferReport, TransferResult
+
+__all__ = [
+    "Client", "CoordinatorPool", "CoordinatorUnavailable", "Progress",
+    "SADTFError", "TransferReport", "TransferResult"
+]
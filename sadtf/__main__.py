@@ -0,0 +1,8 @@
+"""
+Permite ejecutar el cliente con python -m sadtf
+"""
+import sys
+
+from sadtf.cli import main
+
+sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Línea de comandos del cliente: python -m sadtf <comando>
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import COORDINATOR_PORT, CLIENT_CONCURRENCY, CLIENT_UPLOAD_JOURNAL
+from common.utils import format_size
+from sadtf.client import Client, SADTFError, TransferReport
+from sadtf.pool import CoordinatorUnavailable
+
+# Códigos de salida para trabajos por lotes
+EXIT_OK = 0
+EXIT_FAILED = 1  # alguna transferencia u operación falló
+EXIT_USAGE = 2  # argumentos inválidos (también los de argparse)
+EXIT_UNAVAILABLE = 3  # no se pudo conectar con el coordinador
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="sadtf", description="Cliente del sistema distribuido de archivos")
+    parser.add_argument("--host", help="IP del coordinador (por defecto la de config.py)")
+    parser.add_argument("--port", type=int, default=COORDINATOR_PORT)
+    parser.add_argument("-j", "--concurrency", type=int, default=CLIENT_CONCURRENCY,
+                        help=f"archivos en paralelo (por defecto {CLIENT_CONCURRENCY})")
+    parser.add_argument("--json", action="store_true", help="resultado en JSON por la salida estándar")
+    parser.add_argument("-q", "--quiet", action="store_true", help="sin progreso")
+    parser.add_argument("--journal", default=CLIENT_UPLOAD_JOURNAL,
+                        help="diario de subidas a medias para reanudarlas (vacío para desactivarlo)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    upload = commands.add_parser("upload", help="subir un archivo o un directorio completo")
+    upload.add_argument("path")
+    upload.add_argument("--prefix", default="", help="prefijo de los nombres en el sistema (p. ej. lote1/)")
+    
+    download = commands.add_parser("download", help="descargar los archivos con un prefijo")
+    download.add_argument("prefix")
+    download.add_argument("dest")
+    
+    ls = commands.add_parser("ls", help="listar archivos")
+    ls.add_argument("prefix", nargs="?")
+    
+    rm = commands.add_parser("rm", help="eliminar archivos por file_id")
+    rm.add_argument("file_ids", nargs="+")
+    return parser
+
+def print_report(report: TransferReport, as_json: bool) -> int:
+    if as_json:
+        print(json.dumps(report.to_dict(), indent=2))
+    else:
+        for result in report.failed:
+            print(f"Error en {result.remote_name}: {result.error}", file=sys.stderr)
+        print(f"{len(report.results) - len(report.failed)}/{len(report.results)} archivos, "
+              f"{format_size(report.bytes)} en {report.seconds:.1f} s "
+              f"({format_size(report.throughput)}/s)")
+    return EXIT_FAILED if report.failed else EXIT_OK
+
+def run(args, client: Client) -> int:
+    progress = None if args.quiet else sys.stderr
+    
+    if args.command == "upload":
+        if not os.path.exists(args.path):
+            print(f"No existe {args.path}", file=sys.stderr)
+            return EXIT_USAGE
+        return print_report(client.upload_tree(args.path, args.prefix, progress), args.json)
+    
+    if args.command == "download":
+        return print_report(client.download_tree(args.prefix, args.dest, progress), args.json)
+    
+    if args.command == "ls":
+        files = list(client.list_files(args.prefix))
+        if args.json:
+            print(json.dumps(files, indent=2))
+        else:
+            for file in files:
+                print(f"{file['file_id']}\t{format_size(file['size'])}\t{file['upload_date']}\t{file['filename']}")
+        return EXIT_OK
+    
+    if args.command == "rm":
+        status = EXIT_OK
+        results = []
+        for file_id in args.file_ids:
+            try:
+                client.delete(file_id)
+                results.append({"file_id": file_id, "ok": True})
+            except SADTFError as e:
+                results.append({"file_id": file_id, "ok": False, "error": str(e)})
+                status = EXIT_FAILED
+                if not args.json:
+                    print(f"Error eliminando {file_id}: {e}", file=sys.stderr)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        return status
+    
+    return EXIT_USAGE
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.concurrency < 1:
+        print("--concurrency debe ser al menos 1", file=sys.stderr)
+        return EXIT_USAGE
+    
+    with Client(args.host, args.port, args.concurrency, args.journal or None) as client:
+        try:
+            return run(args, client)
+        except CoordinatorUnavailable as e:
+            print(str(e), file=sys.stderr)
+            return EXIT_UNAVAILABLE
+        except SADTFError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return EXIT_FAILED
@@ -0,0 +1,459 @@
+"""
+Cliente del sistema distribuido para transferencias masivas
+"""
+import base64
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    COORDINATOR_HOST, COORDINATOR_PORT, BLOCK_SIZE, LIST_FILES_MAX_PAGE, WEB_BLOCK_TIMEOUT,
+    CLIENT_CONCURRENCY, CLIENT_PROGRESS_INTERVAL, CLIENT_RETRIES, CLIENT_RETRY_DELAY, CLIENT_UPLOAD_JOURNAL
+)
+from common.protocol import MessageType
+from common.utils import format_size
+from sadtf.pool import CoordinatorPool, CoordinatorUnavailable
+
+class SADTFError(Exception):
+    """El coordinador rechazó una operación o respondió algo inesperado"""
+
+class ConnectionLost(SADTFError):
+    """El coordinador cerró la conexión a mitad de una operación"""
+
+# Fallos tras los que una transferencia se reanuda por otra conexión
+RETRYABLE_ERRORS = (OSError, CoordinatorUnavailable, ConnectionLost)
+
+@dataclass
+class TransferResult:
+    """Resultado de la transferencia de un archivo"""
+    local_path: str
+    remote_name: str
+    size: int
+    file_id: Optional[str] = None
+    seconds: float = 0.0
+    error: Optional[str] = None
+    
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+    
+    def to_dict(self):
+        return {**asdict(self), "ok": self.ok}
+
+@dataclass
+class TransferReport:
+    """Resumen de una transferencia de varios archivos"""
+    operation: str
+    results: List[TransferResult] = field(default_factory=list)
+    seconds: float = 0.0
+    
+    @property
+    def failed(self) -> List[TransferResult]:
+        return [result for result in self.results if not result.ok]
+    
+    @property
+    def bytes(self) -> int:
+        return sum(result.size for result in self.results if result.ok)
+    
+    @property
+    def throughput(self) -> float:
+        """Bytes por segundo de los archivos transferidos"""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+    
+    def to_dict(self):
+        return {
+            "operation": self.operation,
+            "files": len(self.results),
+            "failed": len(self.failed),
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "throughput": round(self.throughput, 1),
+            "results": [result.to_dict() for result in self.results]
+        }
+
+class Progress:
+    """
+    Progreso compartido por los hilos de una transferencia
+    Escribe como mucho una línea cada interval segundos con los archivos
+    terminados, los bytes y el rendimiento medio
+    """
+    
+    def __init__(self, total_files: int, total_bytes: int, stream: Optional[TextIO] = sys.stderr,
+                 interval: float = CLIENT_PROGRESS_INTERVAL):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.stream = stream
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.last_render = 0.0
+        self.done_files = 0
+        self.failed_files = 0
+        self.done_bytes = 0
+    
+    def add_bytes(self, count: int):
+        with self.lock:
+            self.done_bytes += count
+        self.render()
+    
+    def file_done(self, ok: bool):
+        with self.lock:
+            self.done_files += 1
+            if not ok:
+                self.failed_files += 1
+        self.render()
+    
+    def render(self, final: bool = False):
+        if self.stream is None:
+            return
+        with self.lock:
+            now = time.time()
+            if not final and now - self.last_render < self.interval:
+                return
+            self.last_render = now
+            elapsed = max(now - self.started, 1e-6)
+            line = (f"{self.done_files}/{self.total_files} archivos, "
+                    f"{format_size(self.done_bytes)} de {format_size(self.total_bytes)}, "
+                    f"{format_size(self.done_bytes / elapsed)}/s")
+            if self.failed_files:
+                line += f", {self.failed_files} con error"
+        self.stream.write(f"\r{line}" + ("\n" if final else ""))
+        self.stream.flush()
+
+class UploadJournal:
+    """
+    Subidas reanudables en curso, guardadas en un archivo JSON
+    
+    Cada entrada identifica la subida (file_id, upload_id) de un archivo
+    local con su tamaño y fecha de modificación. Si el proceso se
+    interrumpe, la siguiente subida del mismo archivo sin cambios la
+    reanuda y sólo envía los bloques que el coordinador no confirmó.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self.entries: Dict[str, dict] = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    @staticmethod
+    def key(host: str, port: int, local_path: str, remote_name: str) -> str:
+        return f"{host}:{port}|{os.path.abspath(local_path)}|{remote_name}"
+    
+    def get(self, key: str, size: int, mtime: float) -> Optional[dict]:
+        """Subida pendiente del archivo, si no cambió desde que empezó"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry["size"] == size and entry["mtime"] == mtime:
+            return entry
+        return None
+    
+    def put(self, key: str, entry: dict):
+        with self.lock:
+            self.entries[key] = entry
+            self.save()
+    
+    def remove(self, key: str):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.save()
+    
+    def save(self):
+        """Escribe el diario de forma atómica (con el lock tomado)"""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+
+class Client:
+    """
+    Cliente del coordinador para subir y descargar muchos archivos
+    
+    Cada archivo se transfiere bloque a bloque (UPLOAD_BEGIN/UPLOAD_BLOCK/
+    UPLOAD_COMMIT y DOWNLOAD_BLOCK) por una conexión del pool, así que sólo
+    hay un bloque por archivo en memoria. Los árboles de directorios se
+    transfieren con concurrency archivos en paralelo, y las conexiones se
+    reutilizan de un archivo al siguiente.
+    
+    Las transferencias se reanudan por bloques: si se pierde la conexión (o
+    se reinicia el coordinador) se reintentan hasta CLIENT_RETRIES veces
+    enviando o pidiendo sólo los bloques que faltan, y las subidas a medias
+    quedan en el diario journal_path para reanudarlas en otra ejecución.
+    """
+    
+    def __init__(self, host: Optional[str] = None, port: int = COORDINATOR_PORT,
+                 concurrency: int = CLIENT_CONCURRENCY, journal_path: Optional[str] = CLIENT_UPLOAD_JOURNAL):
+        self.host = host or COORDINATOR_HOST
+        self.port = port
+        self.concurrency = max(1, concurrency)
+        self.pool = CoordinatorPool(self.host, port, max_idle=self.concurrency)
+        self.journal = UploadJournal(journal_path) if journal_path else None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        self.pool.close()
+    
+    @staticmethod
+    def check(response: Optional[dict], expected: MessageType) -> dict:
+        """Retorna los datos de una respuesta del tipo esperado o lanza SADTFError"""
+        if not response:
+            raise ConnectionLost("El coordinador cerró la conexión")
+        data = response.get("data", {})
+        if response.get("type") == MessageType.ERROR.value:
+            raise SADTFError(data.get("message", "Error desconocido"))
+        if response.get("type") != expected.value or data.get("success") is False:
+            raise SADTFError(data.get("message", "Respuesta inesperada del coordinador"))
+        return data
+    
+    def call(self, msg_type: MessageType, data: dict, expected: MessageType) -> dict:
+        return self.check(self.pool.request(msg_type, data), expected)
+    
+    def list_files(self, prefix: Optional[str] = None) -> Iterator[dict]:
+        """Recorre los archivos (con el prefijo indicado) página a página"""
+        request = {"limit": LIST_FILES_MAX_PAGE}
+        if prefix:
+            request["prefix"] = prefix
+        while True:
+            data = self.call(MessageType.LIST_FILES, request, MessageType.FILE_LIST)
+            yield from data.get("files", [])
+            if not data.get("next_cursor"):
+                return
+            request["cursor"] = data["next_cursor"]
+    
+    def file_info(self, file_id: str) -> dict:
+        return self.call(MessageType.GET_FILE_INFO, {"file_id": file_id}, MessageType.FILE_INFO)
+    
+    def delete(self, file_id: str):
+        self.call(MessageType.DELETE_FILE, {"file_id": file_id}, MessageType.DELETE_RESPONSE)
+    
+    @staticmethod
+    def progress_counter(on_bytes: Optional[Callable[[int], None]]) -> Callable[[int], None]:
+        """
+        Retorna report(hecho): informa a on_bytes sólo de los bytes nuevos, de
+        modo que un reintento que reanuda desde hecho no los cuenta dos veces
+        """
+        reported = [0]
+        
+        def report(done: int):
+            if on_bytes and done > reported[0]:
+                on_bytes(done - reported[0])
+            reported[0] = max(reported[0], done)
+        
+        return report
+    
+    def with_retries(self, operation: Callable[[], Any]) -> Any:
+        """Ejecuta operation y la repite (reanudándola) si se pierde la conexión"""
+        for attempt in range(CLIENT_RETRIES + 1):
+            try:
+                return operation()
+            except RETRYABLE_ERRORS:
+                if attempt == CLIENT_RETRIES:
+                    raise
+                time.sleep(CLIENT_RETRY_DELAY * (attempt + 1))
+    
+    def upload(self, local_path: str, remote_name: Optional[str] = None,
+               on_bytes: Optional[Callable[[int], None]] = None) -> str:
+        """
+        Sube un archivo leyéndolo por bloques; retorna su file_id
+        La subida es reanudable: tras un corte se recupera con UPLOAD_RESUME
+        y sólo se envían los bloques que el coordinador no confirmó
+        """
+        size = os.path.getsize(local_path)
+        if size == 0:
+            raise SADTFError("El sistema no admite archivos vacíos")
+        remote_name = remote_name or os.path.basename(local_path)
+        mtime = os.path.getmtime(local_path)
+        key = UploadJournal.key(self.host, self.port, local_path, remote_name)
+        state = {"entry": self.journal.get(key, size, mtime) if self.journal else None}
+        report = self.progress_counter(on_bytes)
+        
+        def attempt() -> str:
+            with self.pool.connection(WEB_BLOCK_TIMEOUT) as sock:
+                missing = None
+                entry = state["entry"]
+                if entry:
+                    response = self.pool.exchange(sock, MessageType.UPLOAD_RESUME,
+                                                  {"file_id": entry["file_id"], "upload_id": entry["upload_id"]})
+                    try:
+                        resumed = self.check(response, MessageType.SUCCESS)
+                    except ConnectionLost:
+                        raise
+                    except SADTFError:
+                        # La subida caducó o se canceló: se empieza de nuevo
+                        state["entry"] = entry = None
+                        if self.journal:
+                            self.journal.remove(key)
+                    else:
+                        if resumed.get("committed"):
+                            # El commit de un intento anterior se aplicó aunque se perdiera su respuesta
+                            return resumed["file_id"]
+                        missing = resumed["missing"]
+                if entry is None:
+                    response = self.pool.exchange(sock, MessageType.UPLOAD_BEGIN,
+                                                  {"filename": remote_name, "size": size, "resumable": True})
+                    data = self.check(response, MessageType.SUCCESS)
+                    state["entry"] = entry = {"file_id": data["file_id"], "upload_id": data["upload_id"],
+                                              "size": size, "mtime": mtime}
+                    if self.journal:
+                        self.journal.put(key, entry)
+                    missing = range(data["num_blocks"])
+                
+                with open(local_path, 'rb') as f:
+                    # Los bloques ya confirmados en un intento anterior cuentan como hechos
+                    done = size - sum(min(BLOCK_SIZE, size - n * BLOCK_SIZE) for n in missing)
+                    report(done)
+                    for block_number in missing:
+                        f.seek(block_number * BLOCK_SIZE)
+                        block = f.read(BLOCK_SIZE)
+                        response = self.pool.exchange(sock, MessageType.UPLOAD_BLOCK, {
+                            "file_id": entry["file_id"],
+                            "block_number": block_number,
+                            "block_data": base64.b64encode(block).decode('utf-8')
+                        })
+                        self.check(response, MessageType.SUCCESS)
+                        done += len(block)
+                        report(done)
+                
+                response = self.pool.exchange(sock, MessageType.UPLOAD_COMMIT, {"file_id": entry["file_id"]})
+                return self.check(response, MessageType.UPLOAD_RESPONSE)["file_id"]
+        
+        file_id = self.with_retries(attempt)
+        if self.journal:
+            self.journal.remove(key)
+        return file_id
+    
+    def download(self, file_id: str, local_path: str, num_blocks: Optional[int] = None,
+                 on_bytes: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Descarga un archivo bloque a bloque en local_path; retorna los bytes del archivo
+        Se escribe en un .part propio del file_id que sólo reemplaza al destino
+        si la descarga termina. Si se interrumpe, el .part se conserva y la
+        siguiente descarga continúa desde su último bloque completo
+        """
+        if num_blocks is None:
+            num_blocks = self.file_info(file_id)["file"]["num_blocks"]
+        directory = os.path.dirname(local_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        partial = f"{local_path}.{zlib.crc32(file_id.encode('utf-8')):08x}.part"
+        report = self.progress_counter(on_bytes)
+        
+        def attempt():
+            with open(partial, 'ab+') as f:
+                # Todos los bloques salvo el último miden BLOCK_SIZE: lo que pase
+                # del último bloque completo se descarta y se vuelve a pedir
+                first_block = min(f.tell() // BLOCK_SIZE, num_blocks)
+                f.truncate(first_block * BLOCK_SIZE)
+                f.seek(first_block * BLOCK_SIZE)
+                report(f.tell())
+                with self.pool.connection(WEB_BLOCK_TIMEOUT) as sock:
+                    for block_number in range(first_block, num_blocks):
+                        response = self.pool.exchange(sock, MessageType.DOWNLOAD_BLOCK,
+                                                      {"file_id": file_id, "block_number": block_number})
+                        block = base64.b64decode(self.check(response, MessageType.DOWNLOAD_RESPONSE)["block_data"])
+                        f.write(block)
+                        report(f.tell())
+                return f.tell()
+        
+        written = self.with_retries(attempt)
+        os.replace(partial, local_path)
+        return written
+    
+    def run_transfers(self, operation: str, jobs: List[TransferResult],
+                      transfer: Callable[[TransferResult, Callable[[int], None]], None],
+                      progress: Optional[Progress]) -> TransferReport:
+        """Ejecuta transfer sobre cada trabajo con concurrency hilos y reúne los resultados"""
+        report = TransferReport(operation, jobs)
+        started = time.time()
+        on_bytes = progress.add_bytes if progress else None
+        
+        def run(job: TransferResult):
+            job_started = time.time()
+            try:
+                transfer(job, on_bytes)
+            except Exception as e:
+                job.error = str(e) or e.__class__.__name__
+            job.seconds = time.time() - job_started
+            if progress:
+                progress.file_done(job.ok)
+        
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(run, jobs))
+        report.seconds = time.time() - started
+        if progress:
+            progress.render(final=True)
+        return report
+    
+    def upload_tree(self, local_dir: str, prefix: str = "",
+                    progress_stream: Optional[TextIO] = sys.stderr) -> TransferReport:
+        """
+        Sube todos los archivos de un directorio (recursivamente)
+        Cada archivo se guarda como prefix + su ruta relativa con '/'; si
+        local_dir es un archivo, se sube sólo ese como prefix + su nombre
+        """
+        jobs = []
+        if os.path.isfile(local_dir):
+            jobs.append(TransferResult(local_dir, prefix + os.path.basename(local_dir),
+                                       os.path.getsize(local_dir)))
+        for root, dirs, names in os.walk(local_dir):
+            dirs.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, local_dir).replace(os.sep, '/')
+                jobs.append(TransferResult(path, prefix + relative, os.path.getsize(path)))
+        progress = Progress(len(jobs), sum(job.size for job in jobs), progress_stream)
+        
+        def transfer(job: TransferResult, on_bytes):
+            job.file_id = self.upload(job.local_path, job.remote_name, on_bytes)
+        
+        return self.run_transfers("upload", jobs, transfer, progress)
+    
+    def download_tree(self, prefix: str, local_dir: str,
+                      progress_stream: Optional[TextIO] = sys.stderr) -> TransferReport:
+        """
+        Descarga los archivos cuyo nombre empieza por prefix en local_dir
+        El resto del nombre es la ruta relativa; si varios archivos comparten
+        nombre se descarga el más reciente
+        """
+        latest: Dict[str, dict] = {}
+        for file in self.list_files(prefix):
+            current = latest.get(file["filename"])
+            if current is None or file["upload_date"] > current["upload_date"]:
+                latest[file["filename"]] = file
+        
+        base = os.path.abspath(local_dir)
+        jobs = []
+        blocks: Dict[str, int] = {}
+        for filename, file in sorted(latest.items()):
+            relative = filename[len(prefix):].lstrip('/') or os.path.basename(filename)
+            path = os.path.abspath(os.path.join(base, *relative.split('/')))
+            job = TransferResult(path, filename, file["size"], file["file_id"])
+            if os.path.commonpath([base, path]) != base:
+                # Un nombre con '..' no puede escribir fuera del destino
+                job.error = "Ruta fuera del directorio de destino"
+            blocks[file["file_id"]] = file["num_blocks"]
+            jobs.append(job)
+        progress = Progress(len(jobs), sum(job.size for job in jobs), progress_stream)
+        
+        def transfer(job: TransferResult, on_bytes):
+            if job.error:
+                raise SADTFError(job.error)
+            self.download(job.file_id, job.local_path, blocks[job.file_id], on_bytes)
+        
+        return self.run_transfers("download", jobs, transfer, progress)
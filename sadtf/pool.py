@@ -0,0 +1,199 @@
+"""
+Conexiones persistentes reutilizables con el coordinador
+"""
+import base64
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    COORDINATOR_PORT, CONNECTION_TIMEOUT, BLOCK_SIZE,
+    WEB_POOL_MAX_IDLE, WEB_POOL_IDLE_TIMEOUT, WEB_BLOCK_TIMEOUT, WEB_UPLOAD_BUSY_RETRIES
+)
+from common.protocol import MessageType, receive_message, send_message
+from common.utils import iter_blocks
+
+# Peticiones que pueden repetirse sin efectos si una conexión reutilizada estaba rota
+IDEMPOTENT_MESSAGES = {
+    MessageType.LIST_FILES, MessageType.GET_FILE_INFO, MessageType.GET_BLOCK_TABLE,
+    MessageType.GET_ACTIVE_NODES, MessageType.GET_METRICS, MessageType.DOWNLOAD_FILE,
+    MessageType.DOWNLOAD_BLOCK
+}
+
+class CoordinatorUnavailable(Exception):
+    """No se pudo abrir una conexión con el coordinador"""
+
+class CoordinatorPool:
+    """
+    Conexiones abiertas con un coordinador, reutilizadas entre peticiones
+    
+    El coordinador atiende varios mensajes por conexión, así que cada
+    petición toma una conexión libre, envía su mensaje, lee la respuesta y la
+    devuelve al pool. Antes de reutilizar una conexión se descarta si lleva
+    demasiado tiempo inactiva o si el coordinador la cerró (el socket es
+    legible sin haber pedido nada). Si falla una petición idempotente sobre
+    una conexión reutilizada, se repite una vez con una conexión nueva.
+    """
+    
+    def __init__(self, host: str, port: int = COORDINATOR_PORT, max_idle: int = WEB_POOL_MAX_IDLE,
+                 idle_timeout: float = WEB_POOL_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle: List[Tuple[socket.socket, float]] = []  # (socket, última vez que se usó)
+        self.lock = threading.Lock()
+        
+        # Métricas
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+    
+    def connect(self) -> socket.socket:
+        """Abre una conexión nueva con keep-alive de TCP"""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=CONNECTION_TIMEOUT)
+        except OSError as e:
+            raise CoordinatorUnavailable(f"No se pudo conectar al coordinador en {self.host}") from e
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.created += 1
+        return sock
+    
+    @staticmethod
+    def is_healthy(sock: socket.socket) -> bool:
+        """Una conexión inactiva sana no tiene nada que leer (ni EOF ni datos sueltos)"""
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+    
+    def acquire(self) -> Tuple[socket.socket, bool]:
+        """Retorna (socket, reutilizado)"""
+        now = time.time()
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                sock, last_used = self.idle.pop()
+            if now - last_used < self.idle_timeout and self.is_healthy(sock):
+                self.reused += 1
+                return sock, True
+            self.discard(sock)
+        return self.connect(), False
+    
+    def release(self, sock: socket.socket):
+        """Devuelve una conexión sana al pool"""
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append((sock, time.time()))
+                return
+        self.discard(sock)
+    
+    def discard(self, sock: socket.socket):
+        self.discarded += 1
+        try:
+            sock.close()
+        except OSError:
+            pass
+    
+    @contextmanager
+    def connection(self, timeout: Optional[float] = CONNECTION_TIMEOUT):
+        """Conexión para un intercambio completo; se descarta si algo falla a medias"""
+        sock, _ = self.acquire()
+        sock.settimeout(timeout)
+        try:
+            yield sock
+        except BaseException:
+            self.discard(sock)
+            raise
+        else:
+            sock.settimeout(CONNECTION_TIMEOUT)
+            self.release(sock)
+    
+    def request(self, msg_type: MessageType, data: dict = None,
+                timeout: Optional[float] = CONNECTION_TIMEOUT) -> Optional[dict]:
+        """Envía un mensaje y retorna la respuesta del coordinador"""
+        attempts = 2 if msg_type in IDEMPOTENT_MESSAGES else 1
+        for attempt in range(attempts):
+            sock, reused = self.acquire()
+            sock.settimeout(timeout)
+            try:
+                send_message(sock, msg_type, data)
+                response = receive_message(sock)
+            except Exception as e:
+                self.discard(sock)
+                if isinstance(e, OSError) and reused and attempt + 1 < attempts:
+                    continue
+                raise
+            if response is None:
+                # El coordinador cerró la conexión
+                self.discard(sock)
+                if reused and attempt + 1 < attempts:
+                    continue
+                return None
+            sock.settimeout(CONNECTION_TIMEOUT)
+            self.release(sock)
+            return response
+        return None
+    
+    @staticmethod
+    def exchange(sock: socket.socket, msg_type: MessageType, data: dict) -> Optional[dict]:
+        """
+        Envía un mensaje por una conexión ya tomada y retorna la respuesta
+        Si el coordinador lo rechaza por estar ocupado, espera retry_after y lo repite
+        """
+        for attempt in range(WEB_UPLOAD_BUSY_RETRIES + 1):
+            send_message(sock, msg_type, data)
+            response = receive_message(sock)
+            busy = (response and response.get("type") == MessageType.ERROR.value
+                    and "retry_after" in response.get("data", {}))
+            if not busy or attempt == WEB_UPLOAD_BUSY_RETRIES:
+                return response
+            time.sleep(response["data"]["retry_after"])
+        return None
+    
+    def upload(self, filename: str, size: int, chunks: Iterable[bytes]) -> Optional[dict]:
+        """
+        Sube un archivo bloque a bloque por una misma conexión
+        Los fragmentos de chunks se reagrupan en bloques de BLOCK_SIZE y sólo
+        uno está en memoria (con su base64) a la vez. Retorna la respuesta
+        final del coordinador (UPLOAD_RESPONSE o ERROR)
+        """
+        with self.connection(WEB_BLOCK_TIMEOUT) as sock:
+            response = self.exchange(sock, MessageType.UPLOAD_BEGIN, {"filename": filename, "size": size})
+            if not response or response.get("type") != MessageType.SUCCESS.value:
+                return response
+            file_id = response["data"]["file_id"]
+            
+            for block_number, block in enumerate(iter_blocks(chunks, BLOCK_SIZE)):
+                response = self.exchange(sock, MessageType.UPLOAD_BLOCK, {
+                    "file_id": file_id,
+                    "block_number": block_number,
+                    "block_data": base64.b64encode(block).decode('utf-8')
+                })
+                if not response or response.get("type") != MessageType.SUCCESS.value:
+                    self.exchange(sock, MessageType.UPLOAD_ABORT, {"file_id": file_id})
+                    return response
+            
+            return self.exchange(sock, MessageType.UPLOAD_COMMIT, {"file_id": file_id})
+    
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for sock, _ in idle:
+            self.discard(sock)
+    
+    def metrics(self) -> dict:
+        with self.lock:
+            idle = len(self.idle)
+        return {"host": self.host, "idle": idle, "created": self.created,
+                "reused": self.reused, "discarded": self.discarded}
@@ -10,7 +10,7 @@ import argparse
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from node.node import Node
-from config import MIN_SHARED_SPACE, MAX_SHARED_SPACE
+from config import MIN_SHARED_SPACE, MAX_SHARED_SPACE, STORAGE_BACKEND
 
 def parse_size(size_str):
     """Parsea tamaño en formato '50MB' o '50' (asume MB)"""
@@ -32,6 +32,9 @@ if __name__ == "__main__":
     parser.add_argument('--coordinator-host', type=str, 
                        help='Dirección IP del coordinador (ej: 192.168.1.100). Por defecto: localhost',
                        default=None)
+    parser.add_argument('--storage', type=str, choices=['files', 'segments'],
+                       help=f'Backend de almacenamiento: un archivo por bloque o segmentos. Por defecto: {STORAGE_BACKEND}',
+                       default=None)
     
     args = parser.parse_args()
     
@@ -54,7 +57,7 @@ if __name__ == "__main__":
     print("Presione Ctrl+C para detener")
     print("=" * 60)
     
-    node = Node(None, space_size, args.coordinator_host)
+    node = Node(None, space_size, args.coordinator_host, args.storage)
     try:
         node.start()
     except KeyboardInterrupt:
@@ -6,6 +6,7 @@ import os
 import sys
 import subprocess
 import argparse
+import importlib.util
 import json
 
 # Cambiar al directorio webapp
@@ -17,6 +18,10 @@ if __name__ == "__main__":
     parser.add_argument('--coordinator-host', type=str, 
                        help='Dirección IP del coordinador (ej: 192.168.1.100). Por defecto: localhost',
                        default='127.0.0.1')
+    parser.add_argument('--asgi', action='store_true',
+                       help='Servir con uvicorn (ASGI): las peticiones que esperan al coordinador no ocupan hilos')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Procesos de uvicorn con --asgi. Por defecto: 1')
     
     args = parser.parse_args()
     
@@ -28,7 +33,7 @@ if __name__ == "__main__":
     print("=" * 60)
     print("SISTEMA DE ARCHIVOS DISTRIBUIDO - INTERFAZ WEB")
     print("=" * 60)
-    print("Iniciando servidor web Django...")
+    print(f"Iniciando servidor web Django ({'ASGI, uvicorn' if args.asgi else 'WSGI, runserver'})...")
     print(f"Coordinador configurado en: {args.coordinator_host}:8888")
     print("=" * 60)
     print("\nEl servidor estará disponible en:")
@@ -38,8 +43,17 @@ if __name__ == "__main__":
     print("=" * 60)
 
     # Ejecutar Django en todas las interfaces (0.0.0.0) para aceptar conexiones externas
+    if args.asgi:
+        if importlib.util.find_spec('uvicorn') is None:
+            print("\nEl modo ASGI necesita uvicorn:")
+            print("  pip install uvicorn")
+            sys.exit(1)
+        command = [sys.executable, '-m', 'uvicorn', 'sadft_web.asgi:application',
+                   '--host', '0.0.0.0', '--port', '8000', '--workers', str(args.workers)]
+    else:
+        command = [sys.executable, 'manage.py', 'runserver', '0.0.0.0:8000']
     try:
-        subprocess.run([sys.executable, 'manage.py', 'runserver', '0.0.0.0:8000'], check=True)
+        subprocess.run(command, check=True)
     except KeyboardInterrupt:
         print("\n\nServidor detenido.")
     except Exception as e:
@@ -0,0 +1,293 @@
+"""
+Cliente asíncrono del coordinador (asyncio streams) para las vistas async
+"""
+import asyncio
+import base64
+import concurrent.futures
+import json
+import socket
+import struct
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from config import (
+    COORDINATOR_PORT, CONNECTION_TIMEOUT, BLOCK_SIZE, WEB_POOL_MAX_IDLE, WEB_POOL_IDLE_TIMEOUT,
+    WEB_BLOCK_TIMEOUT, WEB_UPLOAD_BUSY_RETRIES
+)
+from common.protocol import MessageType, create_message
+from common.utils import iter_blocks
+from .coordinator_client import IDEMPOTENT_MESSAGES, CoordinatorUnavailable, get_default_coordinator_host
+
+class CoordinatorError(Exception):
+    """El coordinador respondió con un ERROR (o con una respuesta inesperada)"""
+    
+    def __init__(self, response: Optional[dict], message: str = "Respuesta inválida del coordinador"):
+        self.response = response
+        if response and response.get("type") == MessageType.ERROR.value:
+            message = response.get("data", {}).get("message", message)
+        super().__init__(message)
+
+Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+class AsyncCoordinatorPool:
+    """
+    Conexiones asyncio abiertas con un coordinador, reutilizadas entre peticiones
+    
+    Equivalente asíncrono de CoordinatorPool: mientras una petición espera
+    al coordinador no ocupa ningún hilo, así que unas pocas conexiones y un
+    solo bucle atienden miles de peticiones lentas. Sólo se usa desde el
+    bucle de CoordinatorLoop.
+    """
+    
+    def __init__(self, host: str, port: int = COORDINATOR_PORT, max_idle: int = WEB_POOL_MAX_IDLE,
+                 idle_timeout: float = WEB_POOL_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle: List[Tuple[Connection, float]] = []  # (conexión, última vez que se usó)
+        
+        # Métricas
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+    
+    async def connect(self) -> Connection:
+        """Abre una conexión nueva con keep-alive de TCP"""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), CONNECTION_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise CoordinatorUnavailable(f"No se pudo conectar al coordinador en {self.host}") from e
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.created += 1
+        return reader, writer
+    
+    async def acquire(self) -> Tuple[Connection, bool]:
+        """Retorna (conexión, reutilizada)"""
+        now = time.time()
+        while self.idle:
+            (reader, writer), last_used = self.idle.pop()
+            # El bucle sigue leyendo las conexiones inactivas: si el coordinador
+            # cerró una, el lector ya está en EOF
+            if now - last_used < self.idle_timeout and not reader.at_eof() and not writer.is_closing():
+                self.reused += 1
+                return (reader, writer), True
+            self.discard((reader, writer))
+        return await self.connect(), False
+    
+    def release(self, conn: Connection):
+        """Devuelve una conexión sana al pool"""
+        if len(self.idle) < self.max_idle:
+            self.idle.append((conn, time.time()))
+        else:
+            self.discard(conn)
+    
+    def discard(self, conn: Connection):
+        self.discarded += 1
+        conn[1].close()
+    
+    @staticmethod
+    async def exchange(conn: Connection, msg_type: MessageType, data: Optional[dict],
+                       timeout: Optional[float]) -> Optional[dict]:
+        """Envía un mensaje y lee la respuesta; None si el coordinador cerró la conexión"""
+        reader, writer = conn
+        
+        async def roundtrip():
+            writer.write(create_message(msg_type, data))
+            await writer.drain()
+            try:
+                header = await reader.readexactly(4)
+                body = await reader.readexactly(struct.unpack('!I', header)[0])
+            except asyncio.IncompleteReadError:
+                return None
+            return json.loads(body.decode('utf-8'))
+        
+        return await asyncio.wait_for(roundtrip(), timeout)
+    
+    @asynccontextmanager
+    async def connection(self):
+        """Conexión para un intercambio completo; se descarta si algo falla a medias"""
+        conn, _ = await self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.discard(conn)
+            raise
+        else:
+            self.release(conn)
+    
+    async def request(self, msg_type: MessageType, data: dict = None,
+                      timeout: Optional[float] = CONNECTION_TIMEOUT) -> Optional[dict]:
+        """Envía un mensaje y retorna la respuesta del coordinador"""
+        attempts = 2 if msg_type in IDEMPOTENT_MESSAGES else 1
+        for attempt in range(attempts):
+            conn, reused = await self.acquire()
+            try:
+                response = await self.exchange(conn, msg_type, data, timeout)
+            except BaseException as e:
+                self.discard(conn)
+                if isinstance(e, OSError) and reused and attempt + 1 < attempts:
+                    continue
+                raise
+            if response is None:
+                # El coordinador cerró la conexión
+                self.discard(conn)
+                if reused and attempt + 1 < attempts:
+                    continue
+                return None
+            self.release(conn)
+            return response
+        return None
+    
+    async def exchange_busy(self, conn: Connection, msg_type: MessageType, data: dict) -> Optional[dict]:
+        """exchange() que espera retry_after y repite si el coordinador está ocupado"""
+        for attempt in range(WEB_UPLOAD_BUSY_RETRIES + 1):
+            response = await self.exchange(conn, msg_type, data, WEB_BLOCK_TIMEOUT)
+            busy = (response and response.get("type") == MessageType.ERROR.value
+                    and "retry_after" in response.get("data", {}))
+            if not busy or attempt == WEB_UPLOAD_BUSY_RETRIES:
+                return response
+            await asyncio.sleep(response["data"]["retry_after"])
+        return None
+    
+    async def upload(self, filename: str, size: int, chunks: Iterable[bytes]) -> Optional[dict]:
+        """
+        Sube un archivo bloque a bloque por una misma conexión (ver CoordinatorPool.upload)
+        Los fragmentos se leen en un hilo del executor para no bloquear el bucle
+        """
+        loop = asyncio.get_running_loop()
+        blocks = iter_blocks(chunks, BLOCK_SIZE)
+        async with self.connection() as conn:
+            response = await self.exchange_busy(conn, MessageType.UPLOAD_BEGIN,
+                                                {"filename": filename, "size": size})
+            if not response or response.get("type") != MessageType.SUCCESS.value:
+                return response
+            file_id = response["data"]["file_id"]
+            
+            block_number = 0
+            while True:
+                block = await loop.run_in_executor(None, next, blocks, None)
+                if block is None:
+                    break
+                response = await self.exchange_busy(conn, MessageType.UPLOAD_BLOCK, {
+                    "file_id": file_id,
+                    "block_number": block_number,
+                    "block_data": base64.b64encode(block).decode('utf-8')
+                })
+                if not response or response.get("type") != MessageType.SUCCESS.value:
+                    await self.exchange(conn, MessageType.UPLOAD_ABORT, {"file_id": file_id}, CONNECTION_TIMEOUT)
+                    return response
+                block_number += 1
+            
+            return await self.exchange_busy(conn, MessageType.UPLOAD_COMMIT, {"file_id": file_id})
+    
+    def metrics(self) -> dict:
+        return {"host": self.host, "idle": len(self.idle), "created": self.created,
+                "reused": self.reused, "discarded": self.discarded}
+
+class CoordinatorLoop:
+    """
+    Bucle asyncio propio, en un hilo, dueño de todas las conexiones asíncronas
+    
+    Las vistas pueden ejecutarse en bucles distintos (uno por petición bajo
+    WSGI, el del worker bajo ASGI). Las conexiones asyncio pertenecen al
+    bucle que las abrió, así que todas viven en este y las vistas esperan el
+    resultado con asyncio.wrap_future, sin bloquear su propio bucle.
+    """
+    
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.lock = threading.Lock()
+        self.pools: Dict[str, AsyncCoordinatorPool] = {}
+    
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, daemon=True).start()
+            return self.loop
+    
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Ejecuta una corrutina en el bucle; retorna un Future utilizable desde cualquier hilo o bucle"""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+    
+    def get_pool(self, host: str) -> AsyncCoordinatorPool:
+        """Pool de un coordinador (sólo desde el bucle propio)"""
+        pool = self.pools.get(host)
+        if pool is None:
+            pool = self.pools[host] = AsyncCoordinatorPool(host)
+        return pool
+
+coordinator_loop = CoordinatorLoop()
+
+def submit_request(coordinator_host: Optional[str], msg_type: MessageType, data: dict = None,
+                   timeout: Optional[float] = CONNECTION_TIMEOUT) -> concurrent.futures.Future:
+    """Lanza una petición al coordinador sin esperar su respuesta"""
+    host = coordinator_host or get_default_coordinator_host()
+    
+    async def run():
+        return await coordinator_loop.get_pool(host).request(msg_type, data, timeout)
+    
+    return coordinator_loop.submit(run())
+
+async def coordinator_call(coordinator_host: Optional[str], msg_type: MessageType, data: dict = None,
+                           timeout: Optional[float] = CONNECTION_TIMEOUT) -> Optional[dict]:
+    """Envía una petición al coordinador y espera la respuesta sin bloquear el bucle de la vista"""
+    return await asyncio.wrap_future(submit_request(coordinator_host, msg_type, data, timeout))
+
+async def upload_file(coordinator_host: Optional[str], filename: str, size: int,
+                      chunks: Iterable[bytes]) -> Optional[dict]:
+    """Sube un archivo por bloques; retorna la respuesta final del coordinador"""
+    host = coordinator_host or get_default_coordinator_host()
+    
+    async def run():
+        return await coordinator_loop.get_pool(host).upload(filename, size, chunks)
+    
+    return await asyncio.wrap_future(coordinator_loop.submit(run()))
+
+def submit_block(coordinator_host: str, file_id: str, block_number: int) -> concurrent.futures.Future:
+    """Pide un bloque de un archivo; el Future resuelve a sus bytes o lanza CoordinatorError"""
+    async def run():
+        response = await coordinator_loop.get_pool(coordinator_host).request(
+            MessageType.DOWNLOAD_BLOCK, {"file_id": file_id, "block_number": block_number},
+            WEB_BLOCK_TIMEOUT)
+        if not response or response.get("type") != MessageType.DOWNLOAD_RESPONSE.value:
+            raise CoordinatorError(response, f"Error descargando el bloque {block_number}")
+        return base64.b64decode(response["data"]["block_data"])
+    
+    return coordinator_loop.submit(run())
+
+def stream_file_blocks(coordinator_host: str, file_id: str, first_block: bytes, start_block: int,
+                       end_block: int, last_size: Optional[int] = None):
+    """
+    Iterador síncrono (WSGI) de los bloques [start_block, end_block) de un archivo
+    first_block es el primero, ya obtenido (y recortado); el último se recorta
+    a last_size bytes. El siguiente bloque se pide mientras se envía el
+    actual, así que hay como mucho dos bloques en memoria
+    """
+    yield first_block
+    pending = submit_block(coordinator_host, file_id, start_block + 1) if start_block + 1 < end_block else None
+    for block_number in range(start_block + 1, end_block):
+        block = pending.result()
+        pending = submit_block(coordinator_host, file_id, block_number + 1) if block_number + 1 < end_block else None
+        yield block if block_number + 1 < end_block else block[:last_size]
+
+async def astream_file_blocks(coordinator_host: str, file_id: str, first_block: bytes, start_block: int,
+                              end_block: int, last_size: Optional[int] = None):
+    """Iterador asíncrono (ASGI) de los bloques de un archivo, con el mismo adelanto de un bloque"""
+    yield first_block
+    pending = submit_block(coordinator_host, file_id, start_block + 1) if start_block + 1 < end_block else None
+    for block_number in range(start_block + 1, end_block):
+        block = await asyncio.wrap_future(pending)
+        pending = submit_block(coordinator_host, file_id, block_number + 1) if block_number + 1 < end_block else None
+        yield block if block_number + 1 < end_block else block[:last_size]
@@ -0,0 +1,114 @@
+"""
+Caché compartida de corta duración para las consultas que el panel repite
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from config import WEB_CACHE_TTL, WEB_CACHE_MAX_ENTRIES, CONNECTION_TIMEOUT
+
+class CacheEntry:
+    """Respuesta JSON ya serializada con su ETag"""
+    
+    def __init__(self, body: bytes, version: Optional[int] = None):
+        self.body = body
+        self.version = version
+        # El contenido distingue versiones iguales de un coordinador reiniciado
+        checksum = zlib.crc32(body) & 0xffffffff
+        self.etag = f'"{version}-{checksum:08x}"' if version is not None else f'"{checksum:08x}"'
+        self.expires_at = 0.0
+
+class ResponseCache:
+    """
+    Respuestas por (coordinador, endpoint) válidas durante ttl segundos
+    
+    Mientras una entrada está vigente todos los paneles abiertos la
+    comparten. Cuando caduca, sólo la primera petición consulta al
+    coordinador; las que llegan mientras tanto esperan su resultado en lugar
+    de lanzar su propia consulta. Así la carga del coordinador depende del
+    ttl y no del número de navegadores.
+    """
+    
+    def __init__(self, ttl: float = WEB_CACHE_TTL, max_entries: int = WEB_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: Dict[Hashable, CacheEntry] = {}
+        # Consultas en curso; Futures de concurrent.futures porque las vistas que
+        # esperan pueden ejecutarse en bucles asyncio distintos
+        self.inflight: Dict[Hashable, concurrent.futures.Future] = {}
+        self.lock = threading.Lock()
+        
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+    
+    async def get(self, key: Hashable,
+                  fetch: Callable[[Optional[CacheEntry]], Awaitable[Optional[CacheEntry]]]) -> Optional[CacheEntry]:
+        """
+        Retorna la entrada vigente o la obtiene con await fetch(entrada_anterior)
+        fetch puede retornar la entrada anterior si el coordinador indica que
+        no hubo cambios, o None si la consulta falló (no se guarda)
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry.expires_at > time.time():
+                self.hits += 1
+                return entry
+            done = self.inflight.get(key)
+            leader = done is None
+            if leader:
+                done = self.inflight[key] = concurrent.futures.Future()
+        
+        if not leader:
+            # Otra petición ya está consultando al coordinador: esperar su resultado
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(done)), CONNECTION_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry and entry.expires_at > time.time():
+                    self.coalesced += 1
+                    return entry
+            # La consulta del líder falló o tardó demasiado: consultar por cuenta propia
+            return await fetch(entry)
+        
+        try:
+            self.misses += 1
+            new_entry = await fetch(entry)
+            if new_entry is not None:
+                with self.lock:
+                    now = time.time()
+                    if key not in self.entries and len(self.entries) >= self.max_entries:
+                        # Cada página o filtro es una clave: purgar las caducadas
+                        self.entries = {k: e for k, e in self.entries.items() if e.expires_at > now}
+                    new_entry.expires_at = now + self.ttl
+                    self.entries[key] = new_entry
+            return new_entry
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            done.set_result(None)
+    
+    def invalidate(self, host: str, endpoint: Optional[str] = None):
+        """Descarta las entradas de un coordinador (o sólo las de un endpoint)"""
+        with self.lock:
+            for key in [key for key in self.entries
+                        if key[0] == host and (endpoint is None or key[1] == endpoint)]:
+                del self.entries[key]
+    
+    def metrics(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits,
+                    "misses": self.misses, "coalesced": self.coalesced}
+
+# Caché compartida por todas las vistas del proceso
+response_cache = ResponseCache()
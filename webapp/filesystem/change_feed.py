@@ -0,0 +1,199 @@
+"""
+Canal de cambios del coordinador repartido a los navegadores (Server-Sent Events)
+"""
+import asyncio
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from config import COORDINATOR_PORT, CONNECTION_TIMEOUT, WEB_SSE_CLIENT_QUEUE
+from common.protocol import MessageType, receive_message, send_message
+from .cache import response_cache
+
+# Temas que el panel muestra y endpoint cacheado que invalida cada uno
+TOPIC_ENDPOINTS = {"nodes": "nodes", "files": "files", "blocks": "blocks"}
+
+class FeedClient:
+    """
+    Cola de mensajes de un navegador
+    Se lee con get() desde un hilo (WSGI) o con await aget() desde una
+    corrutina (ASGI), en cuyo caso esperar no ocupa ningún hilo
+    """
+    
+    def __init__(self, maxsize: int = WEB_SSE_CLIENT_QUEUE):
+        self.maxsize = maxsize
+        self.messages = deque()
+        self.ready = threading.Condition()
+        self.waiter: Optional[asyncio.Future] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def put(self, message: dict):
+        """Encola un mensaje; si el navegador va atrasado se le pide recargar todo"""
+        with self.ready:
+            if len(self.messages) >= self.maxsize:
+                self.messages.clear()
+                message = {"resync": True, "events": []}
+            self.messages.append(message)
+            self.ready.notify()
+            waiter, loop = self.waiter, self.loop
+        if waiter is not None:
+            loop.call_soon_threadsafe(self._wake, waiter)
+    
+    @staticmethod
+    def _wake(waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(None)
+    
+    def get(self, timeout: float) -> Optional[dict]:
+        """Siguiente mensaje, o None si no llegó ninguno en timeout segundos"""
+        with self.ready:
+            if not self.messages:
+                self.ready.wait(timeout)
+            return self.messages.popleft() if self.messages else None
+    
+    async def aget(self, timeout: float) -> Optional[dict]:
+        """Versión asíncrona de get()"""
+        with self.ready:
+            if self.messages:
+                return self.messages.popleft()
+            self.loop = asyncio.get_running_loop()
+            self.waiter = waiter = self.loop.create_future()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self.ready:
+            self.waiter = None
+            return self.messages.popleft() if self.messages else None
+
+class ChangeFeed:
+    """
+    Una única suscripción a los eventos de un coordinador por proceso web
+    
+    La primera pestaña que abre /api/events/ arranca un hilo que abre una
+    conexión propia con el coordinador, envía SUBSCRIBE_EVENTS y lee los
+    lotes CLUSTER_EVENTS que el coordinador empuja. Cada lote invalida las
+    entradas afectadas de la caché y se copia en la cola de cada navegador.
+    Cuando se va la última pestaña se cierra la conexión. Si no hay cambios
+    no hay tráfico con el coordinador.
+    """
+    
+    def __init__(self, host: str, port: int = COORDINATOR_PORT):
+        self.host = host
+        self.port = port
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.sock: Optional[socket.socket] = None
+        self.thread: Optional[threading.Thread] = None
+    
+    def add_client(self) -> FeedClient:
+        """Registra un navegador y retorna la cola de la que leerá sus mensajes"""
+        client = FeedClient()
+        with self.lock:
+            self.clients.add(client)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return client
+    
+    def remove_client(self, client: FeedClient):
+        """Da de baja un navegador; sin navegadores se cierra la suscripción"""
+        with self.lock:
+            self.clients.discard(client)
+            if self.clients or self.sock is None:
+                return
+            sock = self.sock
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def broadcast(self, message: dict):
+        """Copia un mensaje en la cola de cada navegador"""
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.put(message)
+    
+    def subscribe(self) -> socket.socket:
+        """Abre la conexión de eventos con el coordinador"""
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECTION_TIMEOUT)
+        send_message(sock, MessageType.SUBSCRIBE_EVENTS, {"topics": list(TOPIC_ENDPOINTS)})
+        response = receive_message(sock)
+        if not response or response.get("type") != MessageType.SUCCESS.value:
+            sock.close()
+            raise ConnectionError("El coordinador rechazó la suscripción a eventos")
+        # A partir de aquí la conexión sólo recibe eventos, sin plazo
+        sock.settimeout(None)
+        return sock
+    
+    def run(self):
+        """Mantiene la suscripción mientras haya navegadores conectados"""
+        reconnecting = False
+        while True:
+            with self.lock:
+                if not self.clients:
+                    self.thread = None
+                    return
+            try:
+                sock = self.subscribe()
+            except Exception as e:
+                print(f"Error suscribiendo a los eventos del coordinador {self.host}: {e}")
+                reconnecting = True
+                time.sleep(2)
+                continue
+            with self.lock:
+                if not self.clients:
+                    # La última pestaña se fue mientras se conectaba
+                    sock.close()
+                    continue
+                self.sock = sock
+            if reconnecting:
+                # Los cambios ocurridos sin conexión se perdieron
+                response_cache.invalidate(self.host)
+                self.broadcast({"resync": True, "events": []})
+                reconnecting = False
+            
+            try:
+                while True:
+                    message = receive_message(sock)
+                    if not message:
+                        break
+                    if message.get("type") != MessageType.CLUSTER_EVENTS.value:
+                        continue
+                    data = message.get("data", {})
+                    self.invalidate_cache(data)
+                    self.broadcast(data)
+            except Exception:
+                pass
+            finally:
+                with self.lock:
+                    self.sock = None
+                sock.close()
+            reconnecting = True
+    
+    def invalidate_cache(self, data: dict):
+        """Descarta de la caché los endpoints cuyos datos cambiaron"""
+        if data.get("resync"):
+            response_cache.invalidate(self.host)
+            return
+        for topic in {event.get("topic") for event in data.get("events", [])}:
+            if topic in TOPIC_ENDPOINTS:
+                response_cache.invalidate(self.host, TOPIC_ENDPOINTS[topic])
+
+_feeds: Dict[str, ChangeFeed] = {}
+_feeds_lock = threading.Lock()
+
+def get_change_feed(host: str) -> ChangeFeed:
+    """Canal de cambios compartido por todas las pestañas para un coordinador"""
+    with _feeds_lock:
+        feed = _feeds.get(host)
+        if feed is None:
+            feed = _feeds[host] = ChangeFeed(host)
+        return feed
@@ -0,0 +1,55 @@
+"""
+Cliente del coordinador con conexiones persistentes reutilizables
+"""
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from config import COORDINATOR_HOST
+# El pool síncrono es el del cliente sadtf; se reexporta para las vistas
+from sadtf.pool import IDEMPOTENT_MESSAGES, CoordinatorPool, CoordinatorUnavailable
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'coordinator_config.json')
+
+_config_lock = threading.Lock()
+_config_cache: Tuple[Optional[float], str] = (None, COORDINATOR_HOST)
+
+def get_default_coordinator_host() -> str:
+    """
+    IP del coordinador desde coordinator_config.json o config.py
+    El archivo sólo se vuelve a leer si cambia su fecha de modificación
+    """
+    global _config_cache
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime
+    except OSError:
+        return COORDINATOR_HOST
+    cached_mtime, host = _config_cache
+    if cached_mtime == mtime:
+        return host
+    with _config_lock:
+        try:
+            with open(CONFIG_FILE, 'r') as f:
+                host = json.load(f).get('coordinator_host', COORDINATOR_HOST)
+        except Exception:
+            host = COORDINATOR_HOST
+        _config_cache = (mtime, host)
+    return host
+
+_pools: Dict[str, CoordinatorPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(coordinator_host: Optional[str] = None) -> CoordinatorPool:
+    """Pool compartido por todo el proceso para un coordinador"""
+    host = coordinator_host or get_default_coordinator_host()
+    pool = _pools.get(host)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(host)
+            if pool is None:
+                pool = _pools[host] = CoordinatorPool(host)
+    return pool
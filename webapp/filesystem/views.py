@@ -1,11 +1,13 @@
 """
 Vistas para el sistema de archivos distribuido
 """
-import socket
-import base64
+import asyncio
 import os
 import json
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse
+)
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
@@ -14,202 +16,303 @@ import sys
 # Añadir ruta del proyecto
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from config import COORDINATOR_HOST, COORDINATOR_PORT
-from common.protocol import MessageType, receive_message, send_message
-from common.utils import format_size, combine_blocks_into_file
+from config import BLOCK_SIZE, WEB_SSE_KEEPALIVE
+from common.protocol import MessageType
+from common.utils import format_size
+from .coordinator_client import get_default_coordinator_host
+from .async_client import (
+    CoordinatorError, coordinator_call, upload_file as upload_to_coordinator, submit_block,
+    stream_file_blocks, astream_file_blocks
+)
+from .cache import CacheEntry, response_cache
+from .change_feed import get_change_feed
 
-def get_default_coordinator_host():
-    """Obtiene la IP del coordinador desde el archivo de configuración o config.py"""
-    try:
-        config_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'webapp', 'coordinator_config.json')
-        if os.path.exists(config_file):
-            with open(config_file, 'r') as f:
-                config = json.load(f)
-                return config.get('coordinator_host', COORDINATOR_HOST)
-    except:
-        pass
-    return COORDINATOR_HOST
+# Las vistas que hablan con el coordinador son asíncronas: bajo ASGI una
+# petición que espera a un coordinador lento no ocupa ningún hilo del worker
 
-def get_coordinator_connection(coordinator_host=None):
-    """Obtiene una conexión con el coordinador"""
-    # Usar IP del request si está disponible, sino usar la del archivo de config, sino la del config.py
-    if coordinator_host:
-        host = coordinator_host
-    else:
-        host = get_default_coordinator_host()
+async def coordinator_request(coordinator_host, msg_type, data=None):
+    """
+    Envía una petición al coordinador por una conexión del pool
+    Usa la IP del request si está disponible, sino la del archivo de config, sino la del config.py
+    """
+    return await coordinator_call(coordinator_host, msg_type, data)
+
+def is_asgi(request) -> bool:
+    """
+    Las respuestas en streaming deben usar iteradores asíncronos bajo ASGI y
+    síncronos bajo WSGI; de lo contrario Django las acumula enteras en memoria
+    """
+    return isinstance(request, ASGIRequest)
+
+async def cached_coordinator_query(request, endpoint, msg_type, expected_type, error_message, params=None):
+    """
+    Consulta de solo lectura servida desde la caché compartida
+    Al caducar, se revalida con el coordinador enviando la versión conocida;
+    el navegador recibe un ETag y un 304 si ya tiene la misma respuesta
+    params se envía al coordinador y forma parte de la clave de la caché
+    """
+    coordinator_host = request.GET.get('coordinator_host', None) or get_default_coordinator_host()
+    key = (coordinator_host, endpoint)
+    if params:
+        key += (tuple(sorted(params.items())),)
+    
+    async def fetch(previous):
+        request_data = dict(params or {})
+        if previous is not None and previous.version is not None:
+            request_data["if_version"] = previous.version
+        response = await coordinator_request(coordinator_host, msg_type, request_data)
+        if response and response.get("type") == MessageType.ERROR.value:
+            raise CoordinatorError(response)
+        if not response or response.get("type") != expected_type.value:
+            return None
+        data = response.get("data", {})
+        if data.get("not_modified") and previous is not None:
+            return previous
+        return CacheEntry(json.dumps(data).encode('utf-8'), data.get("version"))
+    
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-        sock.connect((host, COORDINATOR_PORT))
-        return sock
+        entry = await response_cache.get(key, fetch)
+    except CoordinatorError as e:
+        return coordinator_error_response(e.response)
     except Exception as e:
-        return None
+        return JsonResponse({"error": str(e)}, status=500)
+    if entry is None:
+        return JsonResponse({"error": error_message}, status=500)
+    
+    if request.headers.get('If-None-Match') == entry.etag:
+        http_response = HttpResponseNotModified()
+    else:
+        http_response = HttpResponse(entry.body, content_type='application/json')
+    http_response['ETag'] = entry.etag
+    # El navegador debe revalidar siempre (con If-None-Match)
+    http_response['Cache-Control'] = 'no-cache'
+    return http_response
+
+def coordinator_error_response(response):
+    """Respuesta HTTP para un ERROR del coordinador (503 con Retry-After si está saturado)"""
+    data = response.get("data", {})
+    retry_after = data.get("retry_after")
+    if retry_after:
+        http_response = JsonResponse({"error": data.get("message", "Coordinador ocupado"),
+                                      "retry_after": retry_after}, status=503)
+        http_response['Retry-After'] = str(retry_after)
+        return http_response
+    return JsonResponse({"error": data.get("message", "Error desconocido")}, status=500)
 
 def index(request):
     """Página principal"""
     return render(request, 'filesystem/index.html')
 
 @require_http_methods(["GET"])
-def get_coordinator_host(request):
+async def get_coordinator_host(request):
     """Obtiene la IP del coordinador configurada"""
     coordinator_host = get_default_coordinator_host()
     return JsonResponse({"coordinator_host": coordinator_host})
 
 @require_http_methods(["GET"])
-def get_active_nodes(request):
+async def get_active_nodes(request):
     """Obtiene lista de nodos activos"""
-    coordinator_host = request.GET.get('coordinator_host', None)
-    sock = get_coordinator_connection(coordinator_host)
-    if not sock:
-        return JsonResponse({"error": f"No se pudo conectar al coordinador en {coordinator_host or COORDINATOR_HOST}"}, status=500)
-    
-    try:
-        send_message(sock, MessageType.GET_ACTIVE_NODES)
-        response = receive_message(sock)
-        
-        if response and response.get("type") == MessageType.ACTIVE_NODES_DATA.value:
-            return JsonResponse(response.get("data", {}))
-        else:
-            return JsonResponse({"error": "Error obteniendo nodos"}, status=500)
-    except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
-    finally:
-        sock.close()
+    return await cached_coordinator_query(request, "nodes", MessageType.GET_ACTIVE_NODES,
+                                    MessageType.ACTIVE_NODES_DATA, "Error obteniendo nodos")
 
 @require_http_methods(["GET"])
-def list_files(request):
-    """Lista todos los archivos"""
-    coordinator_host = request.GET.get('coordinator_host', None)
-    sock = get_coordinator_connection(coordinator_host)
-    if not sock:
-        return JsonResponse({"error": f"No se pudo conectar al coordinador en {coordinator_host or COORDINATOR_HOST}"}, status=500)
-    
-    try:
-        send_message(sock, MessageType.LIST_FILES)
-        response = receive_message(sock)
-        
-        if response and response.get("type") == MessageType.FILE_LIST.value:
-            return JsonResponse(response.get("data", {}))
-        else:
-            return JsonResponse({"error": "Error obteniendo archivos"}, status=500)
-    except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
-    finally:
-        sock.close()
+async def list_files(request):
+    """
+    Lista los archivos
+    Con limit, cursor, prefix, filename, sort (name, size, date) u order
+    (asc, desc) devuelve una página y el next_cursor de la siguiente
+    """
+    params = {name: request.GET[name] for name in ('cursor', 'prefix', 'filename', 'sort', 'order')
+              if request.GET.get(name)}
+    if request.GET.get('limit'):
+        try:
+            params['limit'] = int(request.GET['limit'])
+        except ValueError:
+            return JsonResponse({"error": "limit debe ser un número"}, status=400)
+    return await cached_coordinator_query(request, "files", MessageType.LIST_FILES,
+                                    MessageType.FILE_LIST, "Error obteniendo archivos", params)
 
 @require_http_methods(["GET"])
-def get_block_table(request):
+async def get_block_table(request):
     """Obtiene la tabla de bloques"""
-    coordinator_host = request.GET.get('coordinator_host', None)
-    sock = get_coordinator_connection(coordinator_host)
-    if not sock:
-        return JsonResponse({"error": f"No se pudo conectar al coordinador en {coordinator_host or COORDINATOR_HOST}"}, status=500)
+    return await cached_coordinator_query(request, "blocks", MessageType.GET_BLOCK_TABLE,
+                                    MessageType.BLOCK_TABLE_DATA, "Error obteniendo tabla de bloques")
+
+@require_http_methods(["GET"])
+async def get_block_map(request):
+    """
+    Mapa agregado de la tabla de bloques
+    Con start, end y cells devuelve sólo el rango visible en runs de estado
+    [código, celdas], más los agregados por nodo y por archivo; node_id o
+    file_id resaltan los bloques de un nodo o archivo
+    """
+    params = {"view": "summary"}
+    for name in ('start', 'end', 'cells'):
+        if request.GET.get(name):
+            try:
+                params[name] = int(request.GET[name])
+            except ValueError:
+                return JsonResponse({"error": f"{name} debe ser un número"}, status=400)
+    if params.get('start', 0) < 0 or params.get('end', float('inf')) <= params.get('start', 0):
+        return JsonResponse({"error": "Rango inválido: se requiere 0 <= start < end"}, status=400)
+    params.update({name: request.GET[name] for name in ('node_id', 'file_id') if request.GET.get(name)})
+    # Comparte endpoint con la tabla completa: los eventos de bloques invalidan ambas
+    return await cached_coordinator_query(request, "blocks", MessageType.GET_BLOCK_TABLE,
+                                    MessageType.BLOCK_TABLE_DATA, "Error obteniendo mapa de bloques", params)
+
+@require_http_methods(["GET"])
+async def events(request):
+    """
+    Canal Server-Sent Events con los cambios del coordinador
+    Cada mensaje lleva los eventos de un lote (temas nodes, files, blocks) o
+    resync si el navegador debe recargar todo
+    """
+    coordinator_host = request.GET.get('coordinator_host', None) or get_default_coordinator_host()
+    feed = get_change_feed(coordinator_host)
+    client = feed.add_client()
     
-    try:
-        send_message(sock, MessageType.GET_BLOCK_TABLE)
-        response = receive_message(sock)
-        
-        if response and response.get("type") == MessageType.BLOCK_TABLE_DATA.value:
-            return JsonResponse(response.get("data", {}))
-        else:
-            return JsonResponse({"error": "Error obteniendo tabla de bloques"}, status=500)
-    except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
-    finally:
-        sock.close()
+    def format_message(message):
+        # Sin mensajes se envía un comentario que mantiene viva la conexión a través de proxies
+        return f"data: {json.dumps(message)}\n\n" if message is not None else ": keep-alive\n\n"
+    
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                yield format_message(client.get(WEB_SSE_KEEPALIVE))
+        finally:
+            feed.remove_client(client)
+    
+    async def astream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                yield format_message(await client.aget(WEB_SSE_KEEPALIVE))
+        finally:
+            feed.remove_client(client)
+    
+    http_response = StreamingHttpResponse(astream() if is_asgi(request) else stream(),
+                                          content_type='text/event-stream')
+    http_response['Cache-Control'] = 'no-cache'
+    http_response['X-Accel-Buffering'] = 'no'
+    return http_response
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def upload_file(request):
+async def upload_file(request):
     """Sube un archivo"""
     if 'file' not in request.FILES:
         return JsonResponse({"error": "No se proporcionó archivo"}, status=400)
     
     file = request.FILES['file']
-    filename = file.name
-    file_data = file.read()
-    file_size = len(file_data)
-    
-    # Codificar en base64
-    file_data_b64 = base64.b64encode(file_data).decode('utf-8')
+    if not file.size:
+        return JsonResponse({"error": "El archivo está vacío"}, status=400)
     
     coordinator_host = request.POST.get('coordinator_host', None)
-    sock = get_coordinator_connection(coordinator_host)
-    if not sock:
-        return JsonResponse({"error": f"No se pudo conectar al coordinador en {coordinator_host or COORDINATOR_HOST}"}, status=500)
-    
     try:
-        send_message(sock, MessageType.UPLOAD_FILE, {
-            "filename": filename,
-            "size": file_size,
-            "file_data": file_data_b64
-        })
-        
-        response = receive_message(sock)
+        # Django deja los archivos grandes en disco; se envían bloque a bloque
+        # leyéndolos por fragmentos, sin cargarlos enteros en memoria
+        response = await upload_to_coordinator(coordinator_host, file.name, file.size, file.chunks())
         
         if response and response.get("type") == MessageType.UPLOAD_RESPONSE.value:
             data = response.get("data", {})
             if data.get("success"):
+                # Quien sube debe ver el archivo sin esperar a que caduque la caché
+                response_cache.invalidate(coordinator_host or get_default_coordinator_host())
                 return JsonResponse({"success": True, "message": "Archivo subido exitosamente", "file_id": data.get("file_id")})
             else:
                 return JsonResponse({"error": data.get("message", "Error desconocido")}, status=500)
         elif response and response.get("type") == MessageType.ERROR.value:
-            return JsonResponse({"error": response.get("data", {}).get("message", "Error desconocido")}, status=500)
+            return coordinator_error_response(response)
         else:
             return JsonResponse({"error": "Respuesta inválida del coordinador"}, status=500)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
-    finally:
-        sock.close()
+
+def parse_byte_range(header, size):
+    """
+    (inicio, fin), ambos incluidos, de una cabecera Range de un solo rango
+    Retorna None si no hay cabecera o no se entiende (se envía el archivo
+    entero) y False si el rango queda fuera del archivo
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            # bytes=-N: los últimos N bytes
+            suffix = int(last)
+            return (max(0, size - suffix), size - 1) if suffix > 0 else False
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, end
 
 @require_http_methods(["GET"])
-def download_file(request):
-    """Descarga un archivo"""
+async def download_file(request):
+    """
+    Descarga un archivo en streaming
+    Los bloques se piden al coordinador de uno en uno (con un bloque de
+    adelanto) y se envían al navegador según llegan. Con una cabecera Range
+    sólo se piden los bloques del rango, así que una descarga interrumpida
+    se reanuda sin volver a transferir lo ya recibido
+    """
     file_id = request.GET.get('file_id')
     if not file_id:
         return JsonResponse({"error": "No se proporcionó file_id"}, status=400)
     
-    coordinator_host = request.GET.get('coordinator_host', None)
-    sock = get_coordinator_connection(coordinator_host)
-    if not sock:
-        return JsonResponse({"error": f"No se pudo conectar al coordinador en {coordinator_host or COORDINATOR_HOST}"}, status=500)
-    
+    coordinator_host = request.GET.get('coordinator_host', None) or get_default_coordinator_host()
     try:
-        send_message(sock, MessageType.DOWNLOAD_FILE, {"file_id": file_id})
-        response = receive_message(sock)
-        
-        if response and response.get("type") == MessageType.DOWNLOAD_RESPONSE.value:
-            data = response.get("data", {})
-            if data.get("success"):
-                blocks_data = data.get("blocks", {})
-                
-                # Combinar bloques (ordenar por número de bloque)
-                blocks = [(int(k), base64.b64decode(v)) for k, v in blocks_data.items()]
-                blocks.sort(key=lambda x: x[0])  # Ordenar por número de bloque
-                
-                # Crear archivo temporal
-                import tempfile
-                with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                    combine_blocks_into_file(blocks, tmp_file.name)
-                    file_content = open(tmp_file.name, 'rb').read()
-                    os.unlink(tmp_file.name)
-                
-                filename = data.get("filename", "archivo")
-                http_response = HttpResponse(file_content, content_type='application/octet-stream')
-                http_response['Content-Disposition'] = f'attachment; filename="{filename}"'
-                return http_response
-            else:
-                return JsonResponse({"error": data.get("message", "Error desconocido")}, status=500)
-        else:
+        response = await coordinator_request(coordinator_host, MessageType.GET_FILE_INFO, {"file_id": file_id})
+        if response and response.get("type") == MessageType.ERROR.value:
+            return coordinator_error_response(response)
+        if not response or response.get("type") != MessageType.FILE_INFO.value:
             return JsonResponse({"error": "Error descargando archivo"}, status=500)
+        file_info = response.get("data", {}).get("file", {})
+        if not file_info.get("num_blocks"):
+            http_response = HttpResponse(b'', content_type='application/octet-stream')
+            http_response['Content-Disposition'] = f'attachment; filename="{file_info.get("filename", "archivo")}"'
+            return http_response
+        
+        size = file_info["size"]
+        byte_range = parse_byte_range(request.headers.get('Range'), size)
+        if byte_range is False:
+            http_response = HttpResponse(status=416)
+            http_response['Content-Range'] = f'bytes */{size}'
+            return http_response
+        start, end = byte_range or (0, size - 1)
+        start_block, end_block = start // BLOCK_SIZE, end // BLOCK_SIZE + 1
+        
+        # El primer bloque se obtiene antes de responder para poder informar de errores
+        first_block = await asyncio.wrap_future(submit_block(coordinator_host, file_id, start_block))
+        first_block = first_block[start - start_block * BLOCK_SIZE:end - start_block * BLOCK_SIZE + 1]
+    except CoordinatorError as e:
+        if e.response and e.response.get("type") == MessageType.ERROR.value:
+            return coordinator_error_response(e.response)
+        return JsonResponse({"error": str(e)}, status=500)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
-    finally:
-        sock.close()
+    
+    stream = astream_file_blocks if is_asgi(request) else stream_file_blocks
+    http_response = StreamingHttpResponse(
+        stream(coordinator_host, file_id, first_block, start_block, end_block,
+               end - (end_block - 1) * BLOCK_SIZE + 1),
+        content_type='application/octet-stream',
+        status=206 if byte_range else 200
+    )
+    if byte_range:
+        http_response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    http_response['Accept-Ranges'] = 'bytes'
+    http_response['Content-Length'] = str(end - start + 1)
+    http_response['Content-Disposition'] = f'attachment; filename="{file_info.get("filename", "archivo")}"'
+    return http_response
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def delete_file(request):
+async def delete_file(request):
     """Elimina un archivo"""
     try:
         data = json.loads(request.body)
@@ -220,17 +323,13 @@ def delete_file(request):
     
     if not file_id:
         return JsonResponse({"error": "No se proporcionó file_id"}, status=400)
-    sock = get_coordinator_connection(coordinator_host)
-    if not sock:
-        return JsonResponse({"error": f"No se pudo conectar al coordinador en {coordinator_host or COORDINATOR_HOST}"}, status=500)
-    
     try:
-        send_message(sock, MessageType.DELETE_FILE, {"file_id": file_id})
-        response = receive_message(sock)
+        response = await coordinator_request(coordinator_host, MessageType.DELETE_FILE, {"file_id": file_id})
         
         if response and response.get("type") == MessageType.DELETE_RESPONSE.value:
             data = response.get("data", {})
             if data.get("success"):
+                response_cache.invalidate(coordinator_host or get_default_coordinator_host())
                 return JsonResponse({"success": True, "message": "Archivo eliminado exitosamente"})
             else:
                 return JsonResponse({"error": data.get("message", "Error desconocido")}, status=500)
@@ -238,24 +337,17 @@ def delete_file(request):
             return JsonResponse({"error": "Error eliminando archivo"}, status=500)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
-    finally:
-        sock.close()
 
 @require_http_methods(["GET"])
-def get_file_info(request):
+async def get_file_info(request):
     """Obtiene información detallada de un archivo"""
     file_id = request.GET.get('file_id')
     if not file_id:
         return JsonResponse({"error": "No se proporcionó file_id"}, status=400)
     
     coordinator_host = request.GET.get('coordinator_host', None)
-    sock = get_coordinator_connection(coordinator_host)
-    if not sock:
-        return JsonResponse({"error": f"No se pudo conectar al coordinador en {coordinator_host or COORDINATOR_HOST}"}, status=500)
-    
     try:
-        send_message(sock, MessageType.GET_FILE_INFO, {"file_id": file_id})
-        response = receive_message(sock)
+        response = await coordinator_request(coordinator_host, MessageType.GET_FILE_INFO, {"file_id": file_id})
         
         if response and response.get("type") == MessageType.FILE_INFO.value:
             return JsonResponse(response.get("data", {}))
@@ -263,6 +355,4 @@ def get_file_info(request):
             return JsonResponse({"error": "Error obteniendo información del archivo"}, status=500)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
-    finally:
-        sock.close()
 
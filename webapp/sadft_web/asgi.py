@@ -0,0 +1,10 @@
+"""
+ASGI config for sadft_web project.
+"""
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sadft_web.settings')
+
+application = get_asgi_application()
@@ -12,6 +12,10 @@ PROJECT_ROOT = BASE_DIR.parent.parent
 # Add project root to path
 sys.path.insert(0, str(PROJECT_ROOT))
 
+# config.py está en la raíz del repositorio, junto a webapp/
+sys.path.insert(0, str(BASE_DIR.parent))
+from config import BLOCK_SIZE
+
 # Quick-start development settings - unsuitable for production
 SECRET_KEY = 'django-insecure-sadft-web-key-change-in-production'
 
@@ -82,3 +86,12 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Subidas: los archivos de más de un bloque se guardan en un temporal en disco
+# en lugar de en memoria, y se leen por fragmentos al reenviarlos
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = BLOCK_SIZE
+FILE_UPLOAD_TEMP_DIR = None  # directorio temporal del sistema
+